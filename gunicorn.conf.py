@@ -0,0 +1,59 @@
+"""
+    Gunicorn configuration of the container, `gunicorn --config gunicorn.conf.py`.
+
+    Gunicorn manages the worker processes (restarts, graceful reloads and shutdowns) and each
+    worker runs the ASGI application with uvicorn. With `WEB_WORKER_CLASS=gthread` the workers run
+    the WSGI application with `WEB_THREADS` threads each instead.
+
+    The application is loaded once in the master before the workers are forked (`WEB_PRELOAD`),
+    so the imported code is shared copy-on-write and a broken deploy fails at start instead of in
+    every worker. `kill -HUP` on the master starts new workers and stops the old ones after their
+    requests; with the preload, a new version of the code needs a restart of the container.
+"""
+import multiprocessing
+import os
+
+cpus = multiprocessing.cpu_count()
+
+
+def from_env(name, default):
+    # docker compose passes the unset variables as empty strings
+    return os.environ.get(name) or default
+
+
+bind = from_env('WEB_BIND', '0.0.0.0:8000')
+
+worker_class = from_env('WEB_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+asgi = worker_class not in ('sync', 'gthread')
+wsgi_app = 'setup.asgi:application' if asgi else 'setup.wsgi:application'
+
+# an event loop per CPU is enough for the async workers, the threaded ones also wait on the database
+workers = int(from_env('WEB_CONCURRENCY', cpus if asgi else cpus * 2 + 1))
+# threads of each gthread worker, the uvicorn workers run the sync code of each request in its own thread
+threads = int(from_env('WEB_THREADS', 4))
+
+preload_app = from_env('WEB_PRELOAD', 'True').lower() in ('1', 'true', 'yes')
+
+# seconds without a heartbeat before the master kills and replaces a worker. The uvicorn workers beat from
+# their event loop and the gthread ones from their main thread, so this catches a blocked worker, not a slow
+# request: those are cut by the proxy_read_timeout of nginx
+timeout = int(from_env('WEB_TIMEOUT', 30))
+# seconds the workers get to finish their requests on a reload or a shutdown
+graceful_timeout = int(from_env('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(from_env('WEB_KEEPALIVE', 5))
+# recycle the workers now and then, so a slow leak does not grow forever
+max_requests = int(from_env('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# the heartbeat files of the workers, in memory instead of the container's overlay filesystem
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+forwarded_allow_ips = from_env('FORWARDED_ALLOW_IPS', '127.0.0.1')
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    # called in the master before the workers are forked: they must not share its connections
+    from django.db import connections
+
+    connections.close_all()
@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def install_search_triggers(sender, using, **kwargs):
+    from .search import ensure_search_triggers
+
+    ensure_search_triggers(connections[using])
 
 
 class MiniTwitterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mini_twitter'
+
+    def ready(self):
+        # register the handlers of the background jobs
+        from . import tasks  # noqa: F401
+        from .metrics import install_query_recorder
+
+        # migrations that rebuild the posts table on SQLite drop the full-text search triggers
+        post_migrate.connect(install_search_triggers, sender=self)
+        # count the queries of each request for the metrics
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,181 @@
+"""
+    Async implementations of the read-heavy endpoints: the feed, the post listing and the like toggle.
+
+    They are plain Django async views, served without a thread per request when the project runs
+    on an ASGI server, and are routed in place of the DRF views when `ASYNC_VIEWS` is enabled.
+    The responses are the same as the ones of the DRF views.
+
+    The database is read with the async ORM. The response cache backends are synchronous, so their
+    calls run on a thread pool that is not tied to the request; the like toggle needs a transaction,
+    which the async ORM does not support, so it runs as a single synchronous call.
+"""
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import likes, response_cache, throttling, timeline
+from .authentication import UserTwitterJWTAuthentication
+from .models import Post
+from .pagination import FeedPagination
+from .serializers import PostSerializer, wants_counts
+from .views import (
+    PostViewSet, get_cached_page, get_message_response, get_page_data, get_page_validators, set_validators,
+)
+
+run_cache = partial(sync_to_async, thread_sensitive=False)
+
+authentication = UserTwitterJWTAuthentication()
+
+post_list_sync = PostViewSet.as_view({'get': 'list', 'post': 'create'})
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    """
+        Render the data with the JSON renderer of the DRF views, the first of `DEFAULT_RENDERER_CLASSES`.
+    """
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    return HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+
+
+def error_response(exc):
+    """
+        Render an `APIException` the way the DRF exception handler does.
+    """
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = json_response(data, status=exc.status_code)
+    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+        response['WWW-Authenticate'] = authentication.authenticate_header(None)
+    if getattr(exc, 'wait', None):
+        response['Retry-After'] = '%d' % exc.wait
+    return response
+
+
+def jwt_required(view):
+    """
+        Authenticate the request with the JWT of its `Authorization` header before calling the async view.
+
+        The view receives a DRF `Request`, so it can use `query_params` and the paginators.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            if await authentication.aauthenticate(request) is None:
+                raise NotAuthenticated()
+            return await view(Request(request), *args, **kwargs)
+        except APIException as exc:
+            return error_response(exc)
+    return csrf_exempt(wrapper)
+
+
+async def aget_serialized_posts(ids, counts, tokens=None):
+    """
+        Async version of `views.get_serialized_posts`.
+    """
+    posts, keys = await run_cache(response_cache.get_posts)(ids, counts, tokens)
+    missing = [pk for pk in ids if pk not in posts]
+    if missing:
+        queryset = [post async for post in Post.objects.filter(pk__in=missing)]
+        queryset = await PostSerializer.asetup_eager_loading(queryset, counts)
+        loaded = {post['id']: post for post in PostSerializer(queryset, many=True, context={'counts': counts}).data}
+        await run_cache(response_cache.set_posts)(loaded, keys, tokens=tokens)
+        posts.update(loaded)
+    return [posts[pk] for pk in ids if pk in posts]
+
+
+async def aget_posts_page_response(request, listing, get_posts, message):
+    """
+        Async version of `views.get_posts_page_response`.
+
+        Args:
+            get_posts (coroutine function): Returns the posts of the listing, only awaited on a miss.
+    """
+    counts = wants_counts(request)
+    key = await run_cache(response_cache.page_key)(listing, request)
+    page = await run_cache(response_cache.get_page)(key)
+    if page is None:
+        # as in the sync view, the tokens are read before the page and its posts
+        listing_token = (await run_cache(response_cache.get_tokens)([listing]))[listing]
+        paginator = FeedPagination()
+        ids = [post.pk for post in await paginator.apaginate_queryset(await get_posts(), request)]
+        tokens, etag, last_modified = await run_cache(get_page_validators)(key, listing, ids, 'json', listing_token)
+        data = await aget_serialized_posts(ids, counts, tokens)
+        page = get_cached_page(paginator, data)
+        settled = response_cache.is_settled(listing_token)
+        if settled:
+            await run_cache(response_cache.set_page)(key, page)
+        response = get_conditional_response(request, etag, last_modified) or json_response(get_page_data(page, data, message))
+        response['X-Cache'] = 'MISS'
+        return set_validators(response, etag, last_modified) if settled else response
+
+    tokens, etag, last_modified = await run_cache(get_page_validators)(key, listing, page['ids'])
+    response = get_conditional_response(request, etag, last_modified)
+    if response is None:
+        response = json_response(get_page_data(page, await aget_serialized_posts(page['ids'], counts, tokens), message))
+    response['X-Cache'] = 'HIT'
+    return set_validators(response, etag, last_modified)
+
+
+@require_GET
+@jwt_required
+async def feed(request):
+    """
+        Async version of `FeedView.get`.
+    """
+    user_current = request.user_twitter
+    return await aget_posts_page_response(
+        request, f'feed:{user_current.pk}', partial(timeline.TimelineFeed.acreate, user_current), 'Feed retrieved successfully'
+    )
+
+
+@jwt_required
+async def post_list_get(request):
+    async def get_posts():
+        return Post.objects.active().filter(user_twitter=request.user_twitter)
+
+    return await aget_posts_page_response(
+        request, f'posts:{request.user_twitter.pk}', get_posts, 'Posts retrieved successfully'
+    )
+
+
+@csrf_exempt
+async def post_list(request):
+    """
+        Async version of `PostViewSet.list`, the other methods of the route go to `PostViewSet`.
+    """
+    if request.method == 'GET':
+        return await post_list_get(request)
+    return await sync_to_async(post_list_sync)(request)
+
+
+@require_POST
+@jwt_required
+async def post_like(request, pk):
+    """
+        Async version of `PostViewSet.like`.
+    """
+    wait = await run_cache(throttling.check_throttles)(request, 'like')
+    if wait is not None:
+        return error_response(Throttled(wait))
+    try:
+        post = await Post.objects.active().aget(pk=pk)
+    except Post.DoesNotExist:
+        return json_response(get_message_response('error', 'Post does not exist', 400), status=status.HTTP_400_BAD_REQUEST)
+
+    liked = await sync_to_async(likes.toggle_like)(post, request.user_twitter)
+    await run_cache(response_cache.invalidate_post)(post.pk)
+    await post.arefresh_from_db(fields=['likes'])
+    if likes.is_hot(post):
+        post.likes += await likes.apending_likes(post)
+    counts = wants_counts(request)
+    await PostSerializer.asetup_eager_loading([post], counts)
+    data_post = PostSerializer(post, context={'counts': counts}).data
+    message = 'Post liked successfully' if liked else 'Post unliked successfully'
+    return json_response(get_message_response('success', message, 200, data_post))
@@ -0,0 +1,163 @@
+"""
+    Stateless JWT authentication for the API.
+
+    The access token carries the `UserTwitter` id of its owner, so authenticated requests get
+    `request.user_twitter` without looking up the `User` and `UserTwitter` rows. The only check
+    that needs the database, that the user still exists and is active, is kept in a short-lived
+    in-process cache (`AUTH_CACHE_TTL` seconds).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import UserTwitter
+
+USER_TWITTER_CLAIM = 'user_twitter_id'
+MAX_CACHED_USERS = 10000
+
+
+class UserTwitterTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+        Token serializer that adds the `UserTwitter` id of the user to the token claims.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        user_twitter_id = UserTwitter.objects.filter(user=user).values_list('pk', flat=True).first()
+        if user_twitter_id is not None:
+            token[USER_TWITTER_CLAIM] = user_twitter_id
+        return token
+
+
+class ActiveUserCache:
+    """
+        Thread-safe in-process cache of the `UserTwitter` id of active users, by user id.
+
+        Inactive or deleted users are cached as None, so a revoked user is rejected for at most
+        `AUTH_CACHE_TTL` seconds after the change.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            return True, entry[0]
+        return False, None
+
+    def _store(self, user_id, user_twitter_id):
+        with self._lock:
+            if len(self._entries) >= MAX_CACHED_USERS:
+                self._entries.clear()
+            self._entries[user_id] = (user_twitter_id, time.monotonic() + settings.AUTH_CACHE_TTL)
+        return user_twitter_id
+
+    def _queries(self, user_id):
+        return (
+            User.objects.filter(pk=user_id, is_active=True),
+            UserTwitter.objects.filter(user_id=user_id, user__is_active=True).values_list('pk', flat=True),
+        )
+
+    def get(self, user_id, claimed_user_twitter_id=None):
+        found, user_twitter_id = self._cached(user_id)
+        if found:
+            return user_twitter_id
+
+        active_users, user_twitter_ids = self._queries(user_id)
+        if claimed_user_twitter_id is not None:
+            user_twitter_id = claimed_user_twitter_id if active_users.exists() else None
+        else:
+            user_twitter_id = user_twitter_ids.first()
+        return self._store(user_id, user_twitter_id)
+
+    async def aget(self, user_id, claimed_user_twitter_id=None):
+        """
+            Async version of `get`, for the async views.
+        """
+        found, user_twitter_id = self._cached(user_id)
+        if found:
+            return user_twitter_id
+
+        active_users, user_twitter_ids = self._queries(user_id)
+        if claimed_user_twitter_id is not None:
+            user_twitter_id = claimed_user_twitter_id if await active_users.aexists() else None
+        else:
+            user_twitter_id = await user_twitter_ids.afirst()
+        return self._store(user_id, user_twitter_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+active_users = ActiveUserCache()
+
+
+class UserTwitterJWTAuthentication(JWTAuthentication):
+    """
+        JWT authentication that resolves `request.user_twitter` once per request.
+
+        `request.user` is a `TokenUser` built from the claims and `request.user_twitter` is a
+        `UserTwitter` holding only its id and user id; any other field is loaded on first access.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            request.user_twitter = result[0].user_twitter
+            request._request.user_twitter = result[0].user_twitter
+        return result
+
+    def get_user(self, validated_token):
+        user_id, claimed = self.get_claims(validated_token)
+        return self.build_user(validated_token, user_id, active_users.get(user_id, claimed))
+
+    async def aauthenticate(self, request):
+        """
+            Async version of `authenticate` for plain Django async views.
+
+            Returns:
+                tuple or None: `(user, token)`, or None when the request has no token.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        user_id, claimed = self.get_claims(validated_token)
+        user = self.build_user(validated_token, user_id, await active_users.aget(user_id, claimed))
+        request.user = user
+        request.user_twitter = user.user_twitter
+        return user, validated_token
+
+    def get_claims(self, validated_token):
+        """
+            Get the user id and the claimed `UserTwitter` id (None for older tokens) of a token.
+        """
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidToken('Token contained no recognizable user identification')
+        return user_id, validated_token.get(USER_TWITTER_CLAIM)
+
+    def build_user(self, validated_token, user_id, user_twitter_id):
+        if user_twitter_id is None:
+            raise AuthenticationFailed('User not found or inactive', code='user_inactive')
+
+        user = TokenUser(validated_token)
+        user.user_twitter = UserTwitter.from_db(None, ['id', 'user_id'], [user_twitter_id, user_id])
+        return user
@@ -0,0 +1,216 @@
+"""
+    In-process benchmark of the main endpoints over a seeded graph (see mini_twitter/seed.py).
+
+    Each scenario sends requests through the Django test client as random seeded users and
+    records the latency and the number of SQL queries of every request, with the rate limits
+    turned off. The writes (likes, follows and registrations) run in a transaction that is rolled
+    back at the end, and the cached responses they changed are invalidated, so the benchmark can
+    be repeated on the same database.
+
+    The results can be saved as a baseline and later runs compared against it: a scenario
+    regresses when it makes more queries per request than the baseline, or when its p95 latency
+    or its throughput is worse than the baseline by more than the tolerance. Timings depend on
+    the machine, so a baseline should be compared on the machine that recorded it; the query
+    counts do not.
+"""
+import json
+import random
+import statistics
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from . import response_cache
+from .authentication import UserTwitterTokenObtainPairSerializer
+from .models import Follow, Post, UserTwitter
+
+SCENARIOS = ('feed', 'list', 'like', 'follow', 'registration')
+REGISTRATION_PASSWORD = 'Bench-password-1'
+
+
+def percentile(values, fraction):
+    """
+        Get the value below which `fraction` of the sorted `values` fall (nearest rank).
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies, queries, elapsed):
+    """
+        Get the statistics of a scenario from the latency (seconds) and query count of each request.
+    """
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries': statistics.median(queries) if queries else 0,
+        'max_queries': max(queries, default=0),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+class Benchmark:
+    """
+        Run the endpoint scenarios against the users of the database.
+
+        Args:
+            requests (int): Requests measured per scenario.
+            warmup (int): Requests sent before measuring, to fill the caches.
+            prefix (str): Only users whose username starts with it act in the scenarios.
+            seed (int or None): Seed of the random generator.
+    """
+
+    def __init__(self, requests=200, warmup=20, prefix='seed_', seed=None):
+        self.requests = requests
+        self.warmup = warmup
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.clients = {}
+        self.liked = set()
+        self.followers = set()
+
+    def get_user_ids(self, limit=100):
+        user_ids = list(
+            UserTwitter.objects.filter(user__username__startswith=self.prefix)
+            .order_by('pk').values_list('pk', flat=True)[:limit]
+        )
+        if len(user_ids) < 2:
+            raise ValueError(f"At least 2 users starting with '{self.prefix}' are needed, run seed_graph first")
+        return user_ids
+
+    def client_for(self, user_id):
+        """
+            Get a test client authenticated as the user, without going through the token endpoint.
+        """
+        if user_id not in self.clients:
+            user = UserTwitter.objects.select_related('user').get(pk=user_id).user
+            token = UserTwitterTokenObtainPairSerializer.get_token(user).access_token
+            self.clients[user_id] = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.clients[user_id]
+
+    def feed(self, user_id):
+        return self.client_for(user_id).get('/api/feed/')
+
+    def list(self, user_id):
+        return self.client_for(user_id).get('/api/posts/')
+
+    def like(self, user_id):
+        post_id = self.rng.choice(self.post_ids)
+        self.liked.add(post_id)
+        return self.client_for(user_id).post(f'/api/posts/{post_id}/like/')
+
+    def follow(self, user_id):
+        self.followers.add(user_id)
+        followee_id = self.rng.choice([pk for pk in self.followee_ids if pk != user_id])
+        return self.client_for(user_id).post(f'/api/users/follow/{followee_id}/')
+
+    def registration(self, user_id):
+        username = f'bench_{uuid.uuid4().hex[:12]}'
+        return Client().post(
+            '/api/users/registration/',
+            {'user': {'username': username, 'email': f'{username}@example.com', 'password': REGISTRATION_PASSWORD}},
+            content_type='application/json',
+        )
+
+    def run_scenario(self, name, user_ids):
+        send = getattr(self, name)
+        for _ in range(self.warmup):
+            send(self.rng.choice(user_ids))
+
+        latencies, queries = [], []
+        started = time.perf_counter()
+        for _ in range(self.requests):
+            user_id = self.rng.choice(user_ids)
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = send(user_id)
+                latencies.append(time.perf_counter() - request_started)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: {response.status_code} {response.content[:200]!r}')
+            queries.append(len(captured))
+        return summarize(latencies, queries, time.perf_counter() - started)
+
+    def run(self, scenarios=SCENARIOS):
+        """
+            Run the scenarios, rolling back everything they wrote.
+
+            Returns:
+                dict: The statistics of each scenario, the size of the dataset and the settings that change the results.
+        """
+        user_ids = self.get_user_ids()
+        self.post_ids = list(Post.objects.active().order_by('-pk').values_list('pk', flat=True)[:1000])
+        self.followee_ids = list(
+            UserTwitter.objects.filter(user__username__startswith=self.prefix)
+            .order_by('-followers_count').values_list('pk', flat=True)[:100]
+        )
+        results = {
+            'environment': {
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+                'async_views': settings.ASYNC_VIEWS,
+                'jobs_eager': settings.JOBS_EAGER,
+            },
+            'dataset': {
+                'users': UserTwitter.objects.count(),
+                'follows': Follow.objects.count(),
+                'posts': Post.objects.count(),
+            },
+            'scenarios': {},
+        }
+        # the benchmark measures the endpoints, not the rate limits of its few clients
+        with transaction.atomic(), override_settings(THROTTLE_ENABLED=False):
+            for name in scenarios:
+                results['scenarios'][name] = self.run_scenario(name, user_ids)
+            transaction.set_rollback(True)
+
+        # the cache is not rolled back with the database
+        for post_id in self.liked:
+            response_cache.invalidate_post(post_id)
+        response_cache.invalidate_feeds(self.followers)
+        return results
+
+
+def compare(results, baseline, tolerance=0.5):
+    """
+        Compare benchmark results with a baseline.
+
+        Args:
+            results (dict): The results of `Benchmark.run`.
+            baseline (dict): Results saved from a previous run.
+            tolerance (float): Allowed relative slowdown of the p95 latency and the throughput.
+
+        Returns:
+            list: The regressions found, as messages.
+    """
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        if current['max_queries'] > previous['max_queries']:
+            regressions.append(f"{name}: {current['max_queries']} queries per request, baseline {previous['max_queries']}")
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms, baseline {previous['p95_ms']} ms")
+        if current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['rps']} requests/s, baseline {previous['rps']}")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baseline(results, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write('\n')
@@ -0,0 +1,83 @@
+"""
+    Follow graph writes.
+
+    An edge is a single `Follow` row and `UserTwitter.followers_count`/`following_count` are
+    denormalized counters kept with `F()` updates in the same transaction.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, OuterRef, PositiveIntegerField, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Follow, UserTwitter
+
+
+def update_follow_counts(follower_id, followee_id, delta):
+    """
+        Add `delta` to the following counter of the follower and to the followers counter of the
+        followee with a single UPDATE.
+    """
+    UserTwitter.objects.filter(pk__in=[follower_id, followee_id]).update(
+        following_count=Case(
+            When(pk=follower_id, then=F('following_count') + delta),
+            default=F('following_count'),
+            output_field=PositiveIntegerField(),
+        ),
+        followers_count=Case(
+            When(pk=followee_id, then=F('followers_count') + delta),
+            default=F('followers_count'),
+            output_field=PositiveIntegerField(),
+        ),
+    )
+
+
+def toggle_follow(user_twitter, followee_id):
+    """
+        Follow or unfollow a user in a single transaction.
+
+        The unfollow is a conditional delete on the `Follow` edge and the follow an insert guarded
+        by its unique constraint, so concurrent requests never count the same edge twice.
+
+        Args:
+            user_twitter (UserTwitter): The user that follows.
+            followee_id (int): The primary key of the user to follow or unfollow.
+
+        Returns:
+            bool: True if the user now follows `followee_id`, False if it was unfollowed.
+    """
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(follower=user_twitter, followee_id=followee_id).delete()
+        if deleted:
+            update_follow_counts(user_twitter.pk, followee_id, -1)
+            return False
+        try:
+            with transaction.atomic():
+                Follow.objects.create(follower=user_twitter, followee_id=followee_id)
+        except IntegrityError:
+            # a concurrent request followed the user first
+            return True
+        update_follow_counts(user_twitter.pk, followee_id, 1)
+        return True
+
+
+def count_edges(field):
+    return Coalesce(
+        Subquery(
+            Follow.objects.filter(**{field: OuterRef('pk')})
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=PositiveIntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def recount_follows(user_ids):
+    """
+        Recompute the follow counters of the given users from the `Follow` edges, after edges were
+        written in bulk.
+    """
+    UserTwitter.objects.filter(pk__in=user_ids).update(
+        followers_count=count_edges('followee'),
+        following_count=count_edges('follower'),
+    )
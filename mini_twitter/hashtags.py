@@ -0,0 +1,194 @@
+"""
+    Hastag extraction and trending hastags.
+
+    The hastags of a post are parsed from its title and body when it is created or updated, and
+    stored lowercase without the '#'. Every tagged post also adds one to the `HastagBucket` of its
+    hastags for the hour it was created in, so the trending hastags are a sum over the buckets of
+    the last `HASHTAG_TRENDING_WINDOW` hours instead of a count over all the tagged posts.
+"""
+import re
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Hastag, HastagBucket, Post
+from .response_cache import get_cache
+
+PostHastag = Post.hastags.through
+
+BATCH_SIZE = 1000
+
+HASHTAG_RE = re.compile(r'(?<![\w#])#(\w*[^\W\d_]\w*)')
+MAX_LENGTH = Hastag._meta.get_field('name').max_length
+
+
+def normalize(name):
+    """
+        Get the stored form of a hastag name: lowercase and without the leading '#'.
+    """
+    return name.strip().lstrip('#').lower()[:MAX_LENGTH]
+
+
+def extract_hashtags(*texts):
+    """
+        Get the normalized hastags found in the given texts, at least one letter is required after the '#'.
+
+        Returns:
+            set: The hastag names.
+    """
+    return {normalize(match) for text in texts if text for match in HASHTAG_RE.findall(text)}
+
+
+def get_or_create_hashtags(names):
+    """
+        Get the hastags with the given normalized names, creating the missing ones in one query.
+    """
+    if not names:
+        return []
+    Hastag.objects.bulk_create([Hastag(name=name) for name in names], ignore_conflicts=True)
+    return list(Hastag.objects.filter(name__in=names))
+
+
+def get_bucket(created_at):
+    return created_at.replace(minute=0, second=0, microsecond=0)
+
+
+def add_to_buckets(hastag_ids, created_at, delta):
+    """
+        Add `delta` to the hourly counts of the hastags for the hour of `created_at`.
+    """
+    bucket = get_bucket(created_at)
+    add_bucket_counts({(pk, bucket): delta for pk in hastag_ids})
+
+
+def add_bucket_counts(counts):
+    """
+        Add to the hourly counts given as {(hastag id, bucket): delta}, with one UPDATE per
+        distinct (bucket, delta) pair.
+    """
+    if not counts:
+        return
+    new_buckets = [HastagBucket(hastag_id=pk, bucket=bucket) for (pk, bucket), delta in counts.items() if delta > 0]
+    HastagBucket.objects.bulk_create(new_buckets, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    groups = defaultdict(list)
+    for (pk, bucket), delta in counts.items():
+        if delta:
+            groups[(bucket, delta)].append(pk)
+    for (bucket, delta), hastag_ids in groups.items():
+        HastagBucket.objects.filter(hastag_id__in=hastag_ids, bucket=bucket).update(count=F('count') + delta)
+
+
+def set_post_hashtags(post):
+    """
+        Sync the hastags of a post with the ones written in its title and body.
+
+        Args:
+            post (Post): The post that was just created or updated.
+
+        Returns:
+            set: The names of the hastags added to or removed from the post.
+    """
+    names = extract_hashtags(post.title, post.body)
+    current = dict(PostHastag.objects.filter(post_id=post.pk).values_list('hastag__name', 'hastag_id'))
+    added = names - current.keys()
+    removed = current.keys() - names
+    if not added and not removed:
+        return set()
+
+    with transaction.atomic():
+        if removed:
+            removed_ids = [current[name] for name in removed]
+            PostHastag.objects.filter(post_id=post.pk, hastag_id__in=removed_ids).delete()
+            add_to_buckets(removed_ids, post.created_at, -1)
+        if added:
+            added_ids = [hastag.pk for hastag in get_or_create_hashtags(added)]
+            PostHastag.objects.bulk_create(
+                [PostHastag(post_id=post.pk, hastag_id=pk) for pk in added_ids],
+                ignore_conflicts=True,
+            )
+            add_to_buckets(added_ids, post.created_at, 1)
+    return added | removed
+
+
+def tag_posts(posts):
+    """
+        Batch version of `set_post_hashtags` for new posts, such as an import.
+
+        Returns:
+            set: The names of the hastags used by the posts.
+    """
+    tags = {post.pk: extract_hashtags(post.title, post.body) for post in posts}
+    names = set().union(*tags.values())
+    if not names:
+        return set()
+
+    hastag_ids = {hastag.name: hastag.pk for hastag in get_or_create_hashtags(names)}
+    PostHastag.objects.bulk_create(
+        [PostHastag(post_id=post.pk, hastag_id=hastag_ids[name]) for post in posts for name in tags[post.pk]],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    add_bucket_counts(Counter(
+        (hastag_ids[name], get_bucket(post.created_at)) for post in posts for name in tags[post.pk]
+    ))
+    return names
+
+
+def remove_post_hashtags(post):
+    """
+        Take a post out of the hourly counts of its hastags, when it is deleted.
+
+        Returns:
+            set: The names of the hastags of the post.
+    """
+    current = dict(PostHastag.objects.filter(post_id=post.pk).values_list('hastag__name', 'hastag_id'))
+    add_to_buckets(list(current.values()), post.created_at, -1)
+    return set(current)
+
+
+def trending_hashtags(limit=None):
+    """
+        Get the hastags with the most posts in the last `HASHTAG_TRENDING_WINDOW` hours.
+
+        The result is cached for `HASHTAG_TRENDING_CACHE_TTL` seconds.
+
+        Returns:
+            list: Dicts with the `name` of the hastag and its post `count`, most used first.
+    """
+    limit = limit or settings.HASHTAG_TRENDING_LIMIT
+    key = f'trending:{limit}'
+    trending = get_cache().get(key) if settings.HASHTAG_TRENDING_CACHE_TTL else None
+    if trending is not None:
+        return trending
+
+    since = get_bucket(timezone.now()) - timedelta(hours=settings.HASHTAG_TRENDING_WINDOW - 1)
+    trending = list(
+        HastagBucket.objects.filter(bucket__gte=since)
+        .values('hastag__name')
+        .annotate(total=Sum('count'))
+        .filter(total__gt=0)
+        .order_by('-total', 'hastag__name')
+        .values_list('hastag__name', 'total')[:limit]
+    )
+    trending = [{'name': name, 'count': total} for name, total in trending]
+    if settings.HASHTAG_TRENDING_CACHE_TTL:
+        get_cache().set(key, trending, settings.HASHTAG_TRENDING_CACHE_TTL)
+    return trending
+
+
+def prune_buckets(hours=None):
+    """
+        Delete the hourly counts older than the trending window.
+
+        Returns:
+            int: The number of deleted buckets.
+    """
+    hours = hours or settings.HASHTAG_TRENDING_WINDOW
+    before = get_bucket(timezone.now()) - timedelta(hours=hours - 1)
+    deleted, _ = HastagBucket.objects.filter(bucket__lt=before).delete()
+    return deleted
@@ -0,0 +1,131 @@
+"""
+    Resized variants of the post images.
+
+    Uploads are streamed to a temporary file (see `FILE_UPLOAD_HANDLERS`) and saved as the original
+    `Post.image`. An `images.variants` job (see mini_twitter/tasks.py) then decodes the original
+    in the worker and writes one copy per width of `IMAGE_VARIANT_WIDTHS` and format of
+    `IMAGE_VARIANT_FORMATS`, recorded in `Post.image_variants`.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from . import jobs, response_cache
+from .models import Post
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_name(image_name, width, extension):
+    """
+        Get the storage name of a variant: `posts/photo.png` -> `posts/variants/photo_320w.webp`.
+    """
+    directory, filename = os.path.split(image_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{width}w.{extension}')
+
+
+def render_variants(source, widths, formats):
+    """
+        Resize an image to the given widths and encode each size in the given formats.
+
+        Widths larger than the image are skipped, except the smallest one, so every image has
+        at least one variant.
+
+        Returns:
+            dict: The encoded bytes as {width: {format: bytes}}.
+    """
+    with Image.open(source) as image:
+        widths = sorted(widths)
+        # let the JPEG decoder downscale while decoding, keeping both sides above the largest width
+        image.draft('RGB', (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        variants = {}
+        for width in widths:
+            if width >= image.width and variants:
+                break
+            resized = image
+            if width < image.width:
+                resized = image.resize((width, max(1, image.height * width // image.width)), Image.LANCZOS, reducing_gap=3.0)
+            variants[width] = {}
+            for extension in formats:
+                pil_format, options = FORMATS[extension]
+                frame = resized.convert('RGB') if pil_format == 'JPEG' and resized.mode != 'RGB' else resized
+                buffer = io.BytesIO()
+                frame.save(buffer, pil_format, **options)
+                variants[width][extension] = buffer.getvalue()
+        return variants
+
+
+def generate_variants(post_id):
+    """
+        Write the variants of the image of a post and record them in `Post.image_variants`.
+
+        The variants of a previous image of the post that are no longer used are deleted.
+
+        Returns:
+            int: The number of files written.
+    """
+    post = Post.objects.only('id', 'image', 'image_variants').filter(pk=post_id).first()
+    if post is None or not post.image:
+        return 0
+
+    storage = post.image.storage
+    with post.image.open('rb') as source:
+        rendered = render_variants(source, settings.IMAGE_VARIANT_WIDTHS, settings.IMAGE_VARIANT_FORMATS)
+
+    variants = {}
+    for width, encoded in rendered.items():
+        variants[str(width)] = {}
+        for extension, content in encoded.items():
+            name = variant_name(post.image.name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            variants[str(width)][extension] = storage.save(name, ContentFile(content))
+
+    # the image may have been replaced while the variants were rendered, only record them for this one
+    updated = Post.objects.filter(pk=post_id, image=post.image.name).update(image_variants=variants)
+    if not updated:
+        return 0
+    response_cache.invalidate_post(post_id)
+
+    kept = {name for formats in variants.values() for name in formats.values()}
+    for formats in (post.image_variants or {}).values():
+        for name in formats.values():
+            if name not in kept:
+                storage.delete(name)
+    return sum(len(formats) for formats in variants.values())
+
+
+def schedule_variants(post):
+    """
+        Enqueue the generation of the variants of the image of a post.
+    """
+    if not post.image:
+        return
+    jobs.enqueue('images.variants', {'post': post.pk}, key=f'images.variants:{post.pk}')
+
+
+def get_variant_urls(post):
+    """
+        Get the URLs of the variants of a post image as {width: {format: url}}.
+
+        Variants left from a previous image of the post, not regenerated yet, are not returned.
+    """
+    if not post.image or not post.image_variants:
+        return {}
+    storage = post.image.storage
+    return {
+        width: {extension: storage.url(name) for extension, name in formats.items()}
+        for width, formats in post.image_variants.items()
+        if all(name == variant_name(post.image.name, width, extension) for extension, name in formats.items())
+    }
@@ -0,0 +1,259 @@
+"""
+    Bulk import of users, follows and posts from NDJSON (one JSON object per line).
+
+    The input is read as a stream and written in chunks of `batch_size` lines, each chunk in its
+    own transaction with `bulk_create`. The side effects of the single-row endpoints are done once
+    per chunk: follow counters, hastags and their hourly counts, timelines and cache invalidation.
+
+    Each line has a `type`:
+
+        {"type": "user", "username": "alice", "email": "a@x.com", "password": "secret"}
+        {"type": "follow", "follower": "alice", "followee": "bob"}
+        {"type": "post", "user": "alice", "title": "Hi", "body": "#hello", "created_at": "2024-01-01T10:00:00Z"}
+
+    Users and follows already in the database are skipped, so an import can be replayed; posts
+    have no natural key and are always added. Users are referenced by username. `password` is hashed with the project hasher, which is slow
+    by design; imports of many users should send `password_hash` (an already hashed password) or
+    no password at all (unusable password).
+"""
+import json
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import follows, hashtags, response_cache, streams, timeline
+from .models import Follow, Post, UserTwitter
+from .serializers import PostImportSerializer
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+def iter_ndjson(lines):
+    """
+        Parse NDJSON lines (str or bytes), skipping the blank ones.
+
+        Yields:
+            tuple: `(line number, record, error)`, with `record` None when the line is not a JSON object.
+    """
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield number, None, f'Invalid JSON: {exc}'
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Each line must be a JSON object'
+            continue
+        yield number, record, None
+
+
+class Importer:
+    """
+        Write NDJSON records in chunked transactions and keep the import statistics.
+
+        Args:
+            batch_size (int): Lines written per transaction.
+            author (UserTwitter or None): When set, only posts are accepted and they all belong to
+                this user (the `POST /api/posts/bulk/` endpoint). They are also published to the feed
+                streams of the followers, as the posts created one by one.
+            max_records (int or None): Stop with an error after this many records.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, author=None, max_records=None):
+        self.batch_size = batch_size
+        self.author = author
+        self.max_records = max_records
+        self.user_ids = {}
+        self.written = Counter()
+        self.records = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def rows_per_second(self):
+        return sum(self.written.values()) / max(time.monotonic() - self.started, 1e-9)
+
+    def add_error(self, line, error):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': error})
+
+    def run(self, lines, on_chunk=None):
+        """
+            Import all the lines.
+
+            Args:
+                lines (iterable): The NDJSON lines, read lazily.
+                on_chunk (callable or None): Called with the importer after each chunk, to report progress.
+
+            Returns:
+                Importer: self, with the statistics of the import.
+        """
+        chunk = []
+        for number, record, error in iter_ndjson(lines):
+            if error:
+                self.add_error(number, error)
+                continue
+            if self.max_records is not None and self.records >= self.max_records:
+                self.add_error(number, f'Too many records, the limit is {self.max_records}')
+                break
+            self.records += 1
+            chunk.append((number, record))
+            if len(chunk) >= self.batch_size:
+                self.write_chunk(chunk)
+                chunk = []
+                if on_chunk:
+                    on_chunk(self)
+        if chunk:
+            self.write_chunk(chunk)
+            if on_chunk:
+                on_chunk(self)
+        return self
+
+    def write_chunk(self, chunk):
+        """
+            Write one chunk in a transaction, the users first so the follows and posts of the same
+            chunk can reference them.
+        """
+        by_type = {'user': [], 'follow': [], 'post': []}
+        for number, record in chunk:
+            kind = record.get('type', 'post' if self.author is not None else None)
+            if self.author is not None and kind != 'post':
+                self.add_error(number, 'Only posts can be imported here')
+            elif kind not in by_type:
+                self.add_error(number, "Unknown type, expected 'user', 'follow' or 'post'")
+            else:
+                by_type[kind].append((number, record))
+
+        with transaction.atomic():
+            self.write_users(by_type['user'])
+            followers = self.write_follows(by_type['follow'])
+            posts, tags = self.write_posts(by_type['post'])
+
+        # the caches are not transactional, invalidate them once the chunk is committed
+        if by_type['user'] or by_type['follow']:
+            response_cache.invalidate_users()
+        if followers:
+            response_cache.invalidate_feeds(followers)
+        if posts:
+            response_cache.invalidate_authors({post.user_twitter_id for post in posts})
+            response_cache.invalidate_hashtags(tags)
+
+    def resolve_users(self, usernames):
+        """
+            Load the `UserTwitter` ids of the usernames not seen yet.
+        """
+        missing = {name for name in usernames if isinstance(name, str) and name not in self.user_ids}
+        if missing:
+            self.user_ids.update(
+                UserTwitter.objects.filter(user__username__in=missing).values_list('user__username', 'pk')
+            )
+
+    def get_user_id(self, username):
+        return self.user_ids.get(username) if isinstance(username, str) else None
+
+    def write_users(self, records):
+        users = {}
+        for number, record in records:
+            username = record.get('username')
+            if not isinstance(username, str) or not username or len(username) > 150:
+                self.add_error(number, 'username is required (at most 150 characters)')
+                continue
+            if 'password_hash' in record:
+                password = record['password_hash']
+            else:
+                password = make_password(record.get('password'))
+            users[username] = User(username=username, email=record.get('email', ''), password=password)
+        if not users:
+            return
+
+        # `ignore_conflicts` does not tell which rows were skipped, count the new ones beforehand
+        existing = User.objects.filter(username__in=users).count()
+        User.objects.bulk_create(users.values(), batch_size=self.batch_size, ignore_conflicts=True)
+        user_ids = User.objects.filter(username__in=users).values_list('pk', flat=True)
+        UserTwitter.objects.bulk_create(
+            [UserTwitter(user_id=pk) for pk in user_ids],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        self.resolve_users(users)
+        self.written['users'] += len(users) - existing
+
+    def write_follows(self, records):
+        """
+            Write the follow edges and recount the follow counters of the users involved.
+
+            Returns:
+                set: The ids of the followers, whose timelines were rebuilt.
+        """
+        self.resolve_users([record.get(field) for _, record in records for field in ('follower', 'followee')])
+        edges = set()
+        for number, record in records:
+            follower, followee = self.get_user_id(record.get('follower')), self.get_user_id(record.get('followee'))
+            if follower is None or followee is None:
+                self.add_error(number, 'follower and followee must be existing usernames')
+            elif follower == followee:
+                self.add_error(number, 'A user cannot follow themselves')
+            else:
+                edges.add((follower, followee))
+        if not edges:
+            return set()
+
+        followers = {follower for follower, _ in edges}
+        # as for the users, count the edges actually added rather than the ones skipped as duplicates
+        before = Follow.objects.filter(follower_id__in=followers).count()
+        Follow.objects.bulk_create(
+            [Follow(follower_id=follower, followee_id=followee) for follower, followee in edges],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        follows.recount_follows(followers | {followee for _, followee in edges})
+        timeline.rebuild_timelines(followers)
+        self.written['follows'] += Follow.objects.filter(follower_id__in=followers).count() - before
+        return followers
+
+    def write_posts(self, records):
+        """
+            Write the posts, tag them and push them to the followers' timelines.
+
+            Returns:
+                tuple: The posts written and the names of the hastags they used.
+        """
+        if self.author is None:
+            self.resolve_users([record.get('user') for _, record in records])
+        posts = []
+        for number, record in records:
+            author_id = self.author.pk if self.author is not None else self.get_user_id(record.get('user'))
+            if author_id is None:
+                self.add_error(number, 'user must be an existing username')
+                continue
+            serializer = PostImportSerializer(data=record)
+            if not serializer.is_valid():
+                self.add_error(number, '; '.join(
+                    f"{field}: {' '.join(str(message) for message in messages)}"
+                    for field, messages in serializer.errors.items()
+                ))
+                continue
+            posts.append(Post(user_twitter_id=author_id, **serializer.validated_data))
+        if not posts:
+            return posts, set()
+
+        Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        tags = hashtags.tag_posts(posts)
+        timeline.fan_out_posts(posts)
+        if self.author is not None:
+            # sent once the chunk is committed; the graph imports are not streamed
+            for post in posts:
+                streams.publish_post(post)
+        self.written['posts'] += len(posts)
+        return posts, tags
@@ -0,0 +1,223 @@
+"""
+    Database-backed job queue for the side effects of the API writes.
+
+    A view enqueues a `Job` row in the same transaction as its write and returns; a worker
+    (`manage.py run_worker`) claims the pending jobs, runs their handler and records the result.
+    No broker is needed and a job is only visible to the workers once the write is committed.
+
+        - handlers are registered by kind with `@register('kind')`; a handler registered with
+          `batch=True` receives the payloads of all the jobs of its kind claimed together
+        - a failed job is retried `max_attempts` times with exponential backoff and jitter
+        - `enqueue(..., key=...)` skips the job while a pending job has the same idempotency key
+        - a job whose worker died is claimed again after `JOBS_LOCK_TIMEOUT` seconds
+
+    With `JOBS_EAGER` the handlers run inline when the job is enqueued, for development and tests.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job, JobStatusEnum
+
+logger = logging.getLogger(__name__)
+
+PENDING = JobStatusEnum.PENDING.value
+RUNNING = JobStatusEnum.RUNNING.value
+DONE = JobStatusEnum.DONE.value
+FAILED = JobStatusEnum.FAILED.value
+
+MAX_BACKOFF = 3600
+
+_handlers = {}
+
+
+def register(kind, batch=False):
+    """
+        Register the decorated function as the handler of a kind of job.
+
+        Args:
+            kind (str): The name of the job kind.
+            batch (bool): Call the handler once with the list of payloads of the claimed jobs,
+                instead of once per payload.
+    """
+    def decorator(handler):
+        _handlers[kind] = (handler, batch)
+        return handler
+    return decorator
+
+
+def run_handler(kind, payloads):
+    handler, batch = _handlers[kind]
+    if batch:
+        handler(payloads)
+    else:
+        for payload in payloads:
+            handler(payload)
+
+
+def enqueue(kind, payload, key=None, delay=0, max_attempts=None):
+    """
+        Enqueue a job, in the transaction of the caller.
+
+        Args:
+            kind (str): The registered kind of the job.
+            payload (dict): The JSON arguments of the handler.
+            key (str or None): Idempotency key, the job is skipped if a pending job has this key.
+            delay (int): Seconds before the job can run.
+            max_attempts (int or None): Attempts before the job fails for good, `JOBS_MAX_ATTEMPTS` by default.
+
+        Returns:
+            Job or None: The enqueued job, None when it ran inline or was a duplicate.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"No handler registered for the job kind '{kind}'")
+
+    if settings.JOBS_EAGER:
+        try:
+            with transaction.atomic():
+                run_handler(kind, [payload])
+        except Exception:
+            logger.exception('Job %s failed', kind)
+        return None
+
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                kind=kind,
+                payload=payload,
+                idempotency_key=key,
+                max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+    except IntegrityError:
+        # a pending job with the same idempotency key will do the work
+        return None
+
+
+def get_backoff(attempts):
+    """
+        Seconds to wait before the next attempt: exponential on `JOBS_RETRY_BACKOFF` with jitter.
+    """
+    backoff = min(MAX_BACKOFF, settings.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1))
+    return backoff * random.uniform(0.5, 1.0)
+
+
+def new_worker_id():
+    return f'{socket.gethostname()[:32]}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def claim(worker_id, limit):
+    """
+        Claim up to `limit` jobs that are ready to run, including jobs of dead workers.
+
+        A job is claimed with a conditional UPDATE on its status, so two workers never run the same job.
+
+        Returns:
+            list: The claimed jobs.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    ready = Job.objects.filter(
+        Q(status=PENDING, run_at__lte=now) | Q(status=RUNNING, locked_at__lt=stale)
+    ).order_by('run_at')
+    ids = list(ready.values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    Job.objects.filter(
+        Q(status=PENDING) | Q(status=RUNNING, locked_at__lt=stale), pk__in=ids,
+    ).update(status=RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(pk__in=ids, status=RUNNING, locked_by=worker_id, locked_at=now))
+
+
+def finish(jobs, error=None):
+    """
+        Mark jobs as done, or schedule their retry when the handler raised `error`.
+    """
+    now = timezone.now()
+    if error is None:
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(status=DONE, finished_at=now, locked_by='')
+        return
+
+    message = ''.join(traceback.format_exception(error))[-5000:]
+    for job in jobs:
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(status=FAILED, finished_at=now, locked_by='', last_error=message)
+            logger.error('Job %s #%s failed for good after %s attempts', job.kind, job.pk, job.attempts)
+        else:
+            retry = {
+                'status': PENDING,
+                'locked_by': '',
+                'last_error': message,
+                'run_at': now + timedelta(seconds=get_backoff(job.attempts)),
+            }
+            try:
+                with transaction.atomic():
+                    Job.objects.filter(pk=job.pk).update(**retry)
+            except IntegrityError:
+                # a job with the same key was enqueued while this one ran, retry without the key
+                Job.objects.filter(pk=job.pk).update(idempotency_key=None, **retry)
+
+
+def run_jobs(jobs):
+    """
+        Run claimed jobs, the jobs of a batch kind together.
+
+        Returns:
+            tuple: The number of jobs that succeeded and failed.
+    """
+    by_kind = defaultdict(list)
+    for job in jobs:
+        by_kind[job.kind].append(job)
+
+    succeeded = failed = 0
+    for kind, kind_jobs in by_kind.items():
+        groups = [kind_jobs] if kind in _handlers and _handlers[kind][1] else [[job] for job in kind_jobs]
+        for group in groups:
+            try:
+                if kind not in _handlers:
+                    raise LookupError(f"No handler registered for the job kind '{kind}'")
+                with transaction.atomic():
+                    run_handler(kind, [job.payload for job in group])
+            except Exception as exc:
+                logger.exception('Job %s failed', kind)
+                finish(group, exc)
+                failed += len(group)
+            else:
+                finish(group)
+                succeeded += len(group)
+    return succeeded, failed
+
+
+def run_pending(worker_id=None, limit=None):
+    """
+        Claim and run one batch of jobs.
+
+        Returns:
+            tuple: The number of jobs that succeeded and failed, (0, 0) when nothing was ready.
+    """
+    jobs = claim(worker_id or new_worker_id(), limit or settings.JOBS_BATCH_SIZE)
+    if not jobs:
+        return 0, 0
+    return run_jobs(jobs)
+
+
+def prune(hours=None):
+    """
+        Delete the finished jobs older than `JOBS_RETENTION_HOURS`, which frees their idempotency keys.
+
+        Returns:
+            int: The number of deleted jobs.
+    """
+    before = timezone.now() - timedelta(hours=hours or settings.JOBS_RETENTION_HOURS)
+    deleted, _ = Job.objects.filter(status__in=[DONE, FAILED], finished_at__lt=before).delete()
+    return deleted
@@ -0,0 +1,157 @@
+"""
+    Race-free like counter.
+
+    A like is a row in the `Post.likes_users` through table and `Post.likes` is a denormalized
+    counter kept with `F()` updates inside the same transaction. Hot posts (see
+    `LIKE_HOT_THRESHOLD`) can spread their increments over `LIKE_COUNTER_SHARDS` rows of
+    `LikeCounterShard`, so simultaneous likes do not wait on the post row lock; the shards are
+    folded back into `Post.likes` by `flush_like_shards`, run by a `likes.flush` job (at most one
+    pending per post) `LIKE_FLUSH_DELAY` seconds after a like is counted on the shards.
+"""
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import jobs
+from .models import LikeCounterShard, Post
+
+PostLike = Post.likes_users.through
+
+
+def is_hot(post):
+    """
+        Check if the likes of the post are counted on the sharded counter.
+    """
+    return settings.LIKE_COUNTER_SHARDS > 0 and post.likes >= settings.LIKE_HOT_THRESHOLD
+
+
+def add_likes(post, delta):
+    """
+        Add `delta` to the like counter of the post without reading it first.
+    """
+    if not is_hot(post):
+        Post.objects.filter(pk=post.pk).update(likes=F('likes') + delta)
+        return
+
+    shard = random.randrange(settings.LIKE_COUNTER_SHARDS)
+    shards = LikeCounterShard.objects.filter(post_id=post.pk, shard=shard)
+    if not shards.update(count=F('count') + delta):
+        # first like counted on the shards, create all of them so the update cannot miss again
+        LikeCounterShard.objects.bulk_create(
+            [LikeCounterShard(post_id=post.pk, shard=i) for i in range(settings.LIKE_COUNTER_SHARDS)],
+            ignore_conflicts=True,
+        )
+        shards.update(count=F('count') + delta)
+    schedule_flush(post)
+
+
+def schedule_flush(post):
+    """
+        Enqueue the flush of the shards of a post, unless one is already pending.
+    """
+    jobs.enqueue('likes.flush', {'post': post.pk}, key=f'likes.flush:{post.pk}', delay=settings.LIKE_FLUSH_DELAY)
+
+
+def pending_likes(post):
+    """
+        Get the likes accumulated on the shards of the post and not yet folded into `Post.likes`.
+    """
+    return LikeCounterShard.objects.filter(post_id=post.pk).aggregate(total=Sum('count'))['total'] or 0
+
+
+async def apending_likes(post):
+    return (await LikeCounterShard.objects.filter(post_id=post.pk).aaggregate(total=Sum('count')))['total'] or 0
+
+
+def toggle_like(post, user_twitter):
+    """
+        Like or unlike a post in a single transaction.
+
+        The unlike is a conditional delete on the through table and the like a conditional insert
+        guarded by its unique constraint, so concurrent requests never count the same like twice.
+
+        Args:
+            post (Post): The post to like or unlike.
+            user_twitter (UserTwitter): The user that likes the post.
+
+        Returns:
+            bool: True if the post is now liked by the user, False if it was unliked.
+    """
+    with transaction.atomic():
+        deleted, _ = PostLike.objects.filter(post_id=post.pk, usertwitter_id=user_twitter.pk).delete()
+        if deleted:
+            add_likes(post, -1)
+            return False
+        try:
+            with transaction.atomic():
+                PostLike.objects.create(post_id=post.pk, usertwitter_id=user_twitter.pk)
+        except IntegrityError:
+            # a concurrent request liked the post first
+            return True
+        add_likes(post, 1)
+        return True
+
+
+def flush_like_shards(post_ids=None):
+    """
+        Fold the likes accumulated on the shards into `Post.likes`.
+
+        Each shard is decremented by the value that was read instead of being deleted, so likes
+        counted while the flush runs are kept for the next one.
+
+        Args:
+            post_ids (list or None): Only flush these posts, all posts with shards by default.
+
+        Returns:
+            int: The number of likes folded into the posts.
+    """
+    shards = LikeCounterShard.objects.exclude(count=0)
+    if post_ids is not None:
+        shards = shards.filter(post_id__in=post_ids)
+
+    folded = 0
+    for pk, post_id, count in shards.values_list('pk', 'post_id', 'count').iterator():
+        with transaction.atomic():
+            LikeCounterShard.objects.filter(pk=pk).update(count=F('count') - count)
+            Post.objects.filter(pk=post_id).update(likes=F('likes') + count)
+        folded += count
+    return folded
+
+
+def reconcile_likes(post_ids=None):
+    """
+        Recompute `Post.likes` from the `likes_users` rows and drop the counter shards.
+
+        The shard rows are locked before the likes are counted, so a like cannot be added to a
+        shard between the count and the delete: it waits for the reconcile and lands on a new shard.
+        Only the shards that were locked are deleted.
+
+        Returns:
+            int: The number of posts whose counter was wrong.
+    """
+    posts = Post.objects.all()
+    shards = LikeCounterShard.objects.select_for_update()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+        shards = shards.filter(post_id__in=post_ids)
+
+    real_likes = Coalesce(
+        Subquery(
+            PostLike.objects.filter(post_id=OuterRef('pk'))
+            .values('post_id')
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+    with transaction.atomic():
+        locked = list(shards.values_list('pk', flat=True))
+        drifted = posts.annotate(real_likes=real_likes).exclude(likes=F('real_likes')).values_list('pk', flat=True)
+        drifted = list(drifted)
+        Post.objects.filter(pk__in=drifted).update(likes=real_likes)
+        LikeCounterShard.objects.filter(pk__in=locked).delete()
+    return len(drifted)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_twitter.models import UserTwitter
+from mini_twitter.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    """
+        Rebuild the materialized home timelines of existing users.
+
+        Usage:
+            python manage.py backfill_timelines
+            python manage.py backfill_timelines --username alice
+    """
+    help = 'Rebuild the materialized home timelines from the follow graph and existing posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Only rebuild the timeline of this user.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Users loaded per query.')
+
+    def handle(self, *args, **options):
+        users = UserTwitter.objects.order_by('pk')
+        if options['username']:
+            users = users.filter(user__username=options['username'])
+            if not users.exists():
+                raise CommandError(f"User '{options['username']}' does not exist")
+
+        total_users = total_entries = 0
+        for user in users.iterator(chunk_size=options['chunk_size']):
+            total_entries += rebuild_timeline(user)
+            total_users += 1
+            if total_users % options['chunk_size'] == 0:
+                self.stdout.write(f'{total_users} timelines rebuilt...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total_users} timelines rebuilt with {total_entries} entries'
+        ))
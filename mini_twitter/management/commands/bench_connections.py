@@ -0,0 +1,120 @@
+import copy
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from mini_twitter.benchmark import percentile
+
+MODES = ('new', 'persistent', 'pool')
+
+
+class Command(BaseCommand):
+    """
+        Measure the cost of opening the database connections under concurrent requests.
+
+        Each thread plays a server thread: every simulated request opens the connection if needed,
+        runs the query and hands the connection back the way Django does at the end of a request.
+
+            - new: CONN_MAX_AGE=0, a connection is opened and closed by every request
+            - persistent: the connection of each thread is kept open between requests
+            - pool: the connections come from a psycopg 3 pool shared by the threads (PostgreSQL only)
+
+        Usage:
+            python manage.py bench_connections
+            python manage.py bench_connections --threads 32 --requests 200 --mode new --mode pool
+    """
+    help = 'Compare new, persistent and pooled database connections under concurrent requests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent threads.')
+        parser.add_argument('--requests', type=int, default=100, help='Requests sent by each thread.')
+        parser.add_argument('--mode', action='append', choices=MODES, dest='modes', help='Only this mode.')
+        parser.add_argument('--query', default='SELECT 1', help='SQL run by each request.')
+
+    def get_settings(self, mode):
+        database = copy.deepcopy(connections.settings['default'])
+        options = database.setdefault('OPTIONS', {})
+        options.pop('pool', None)
+        database['CONN_HEALTH_CHECKS'] = False
+        database['CONN_MAX_AGE'] = None if mode == 'persistent' else 0
+        if mode == 'pool':
+            # sized so no thread waits for a connection: only the setup cost is measured
+            options['pool'] = {'min_size': self.threads, 'max_size': self.threads, 'timeout': 30}
+        return database
+
+    def run_mode(self, mode):
+        database = self.get_settings(mode)
+        backend = load_backend(database['ENGINE'])
+        alias = f'bench_{mode}'
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.threads + 1)
+
+        def work():
+            connection = backend.DatabaseWrapper(database, alias)
+            timings = []
+            try:
+                start.wait()
+                for _ in range(self.requests):
+                    started = time.perf_counter()
+                    connection.ensure_connection()
+                    with connection.cursor() as cursor:
+                        cursor.execute(self.query)
+                        cursor.fetchall()
+                    # what the request_finished signal does
+                    connection.close_if_unusable_or_obsolete()
+                    timings.append(time.perf_counter() - started)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(timings)
+
+        owner = backend.DatabaseWrapper(database, alias)
+        if mode == 'pool':
+            # fill the pool before the clock starts, as a server does when it boots
+            owner.pool.open(wait=True)
+        threads = [threading.Thread(target=work) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if mode == 'pool':
+            owner.close_pool()
+        if errors:
+            raise CommandError(f'{mode}: {errors[0]}')
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'rps': len(latencies) / elapsed if elapsed else 0.0,
+        }
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['requests'] < 1:
+            raise CommandError('--threads and --requests must be positive')
+        self.threads = options['threads']
+        self.requests = options['requests']
+        self.query = options['query']
+        modes = options['modes'] or [mode for mode in MODES if mode != 'pool' or connections['default'].vendor == 'postgresql']
+        if 'pool' in modes and connections['default'].vendor != 'postgresql':
+            raise CommandError('--mode pool needs PostgreSQL and psycopg 3 with psycopg-pool')
+
+        self.stdout.write(f"{connections['default'].vendor}, {self.threads} threads x {self.requests} requests")
+        self.stdout.write(f"{'mode':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>10}")
+        for mode in modes:
+            stats = self.run_mode(mode)
+            self.stdout.write(
+                f"{mode:<12}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['rps']:>10.1f}"
+            )
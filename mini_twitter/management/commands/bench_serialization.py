@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from mini_twitter.benchmark import percentile
+from mini_twitter.models import Post
+from mini_twitter.pagination import FeedPagination
+from mini_twitter.renderers import ORJSONRenderer, orjson
+from mini_twitter.serializers import PostSerializer
+from mini_twitter.views import get_message_response
+
+RENDERERS = {'json': JSONRenderer, 'orjson': ORJSONRenderer}
+
+
+class Command(BaseCommand):
+    """
+        Measure the time spent turning a page of posts into a response body.
+
+        The posts of each page are loaded once; then, for each page, the serializer builds the
+        data and each renderer encodes it, as the listing views do on a cache miss.
+
+        Usage:
+            python manage.py bench_serialization
+            python manage.py bench_serialization --page-size 50 --pages 200 --counts
+    """
+    help = 'Compare the serialization and the JSON rendering time of a page of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=FeedPagination.max_page_size, help='Posts per page.')
+        parser.add_argument('--pages', type=int, default=100, help='Pages measured.')
+        parser.add_argument('--counts', action='store_true', help='Serialize in counts mode, without the id lists.')
+
+    def handle(self, *args, **options):
+        if options['page_size'] < 1 or options['pages'] < 1:
+            raise CommandError('--page-size and --pages must be positive')
+        if orjson is None:
+            raise CommandError('orjson is not installed')
+        size, counts = options['page_size'], options['counts']
+        posts = list(Post.objects.active().order_by('-created_at', '-id')[:size * options['pages']])
+        pages = [posts[start:start + size] for start in range(0, len(posts), size)]
+        if not pages:
+            raise CommandError('There are no posts, seed some with seed_graph')
+        PostSerializer.setup_eager_loading(posts, counts)
+
+        timings = {'serialize': []}
+        timings.update({name: [] for name in RENDERERS})
+        sizes = {}
+        for page in pages:
+            started = time.perf_counter()
+            data = PostSerializer(page, many=True, context={'counts': counts}).data
+            timings['serialize'].append(time.perf_counter() - started)
+            body = get_message_response('success', 'Posts retrieved successfully', 200, data)
+            for name, renderer in RENDERERS.items():
+                started = time.perf_counter()
+                content = renderer().render(body)
+                timings[name].append(time.perf_counter() - started)
+                sizes[name] = sizes.get(name, 0) + len(content)
+
+        self.stdout.write(f'{len(pages)} pages of up to {size} posts')
+        self.stdout.write(f"{'step':<12}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}{'KB/page':>9}")
+        for name, values in timings.items():
+            values.sort()
+            kilobytes = f'{sizes[name] / len(pages) / 1024:>9.1f}' if name in sizes else f"{'':>9}"
+            self.stdout.write(
+                f'{name:<12}{percentile(values, 0.50) * 1000:>9.3f}{percentile(values, 0.95) * 1000:>9.3f}'
+                f'{sum(values) / len(values) * 1000:>9.3f}{kilobytes}'
+            )
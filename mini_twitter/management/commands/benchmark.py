@@ -0,0 +1,81 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from mini_twitter.benchmark import SCENARIOS, Benchmark, compare, load_baseline, save_baseline
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+class Command(BaseCommand):
+    """
+        Benchmark the feed, post listing, like, follow and registration endpoints over the seeded
+        users and fail when the results regress from the committed baseline.
+
+        Usage:
+            python manage.py seed_graph --users 2000 --posts 50000 --seed 1
+            python manage.py benchmark
+            python manage.py benchmark --scenario feed --scenario like -n 500
+            python manage.py benchmark --save-baseline
+    """
+    help = 'Measure p50/p95/p99 latency, queries per request and throughput of the main endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--requests', type=int, default=200, help='Requests measured per scenario.')
+        parser.add_argument('--warmup', type=int, default=20, help='Requests sent before measuring.')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, dest='scenarios', help='Only this scenario.')
+        parser.add_argument('--prefix', default='seed_', help='Username prefix of the users acting in the scenarios.')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed of the requests.')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed relative slowdown of p95 and throughput.')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline.')
+        parser.add_argument('--output', help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        benchmark = Benchmark(
+            requests=options['requests'],
+            warmup=options['warmup'],
+            prefix=options['prefix'],
+            seed=options['seed'],
+        )
+        # the test client sends its requests to 'testserver'
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            try:
+                results = benchmark.run(options['scenarios'] or SCENARIOS)
+            except (ValueError, RuntimeError) as exc:
+                raise CommandError(str(exc))
+
+        dataset = results['dataset']
+        self.stdout.write(f"{dataset['users']} users, {dataset['follows']} follows, {dataset['posts']} posts")
+        self.stdout.write(f"{'scenario':<14}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'req/s':>9}")
+        for name, stats in results['scenarios'].items():
+            self.stdout.write(
+                f"{name:<14}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+                f"{stats['max_queries']:>9}{stats['rps']:>9.1f}"
+            )
+
+        if options['output']:
+            save_baseline(results, options['output'])
+        if options['save_baseline']:
+            save_baseline(results, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
+            return
+
+        try:
+            baseline = load_baseline(options['baseline'])
+        except FileNotFoundError:
+            self.stdout.write(f"No baseline at {options['baseline']}, nothing to compare")
+            return
+        except (OSError, json.JSONDecodeError) as exc:
+            raise CommandError(f"Could not read the baseline '{options['baseline']}': {exc}")
+
+        for key in ('dataset', 'environment'):
+            if baseline.get(key) != results[key]:
+                self.stderr.write(f'The baseline was recorded with another {key}: {baseline.get(key)}')
+        regressions = compare(results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Regressions from the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regression from the baseline'))
@@ -0,0 +1,48 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_twitter.ingest import BATCH_SIZE, Importer
+
+
+class Command(BaseCommand):
+    """
+        Import users, follows and posts from an NDJSON file, see `mini_twitter/ingest.py` for the format.
+
+        Usage:
+            python manage.py import_graph graph.ndjson
+            cat graph.ndjson | python manage.py import_graph - --batch-size 5000
+    """
+    help = 'Bulk import users, follows and posts from NDJSON, in chunked transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file to import, '-' reads the standard input.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Lines written per transaction.')
+
+    def report(self, importer):
+        written = ', '.join(f'{count} {kind}' for kind, count in sorted(importer.written.items())) or 'nothing'
+        self.stdout.write(
+            f'{importer.records} records read: {written} written, {importer.error_count} errors '
+            f'({importer.rows_per_second:.0f} rows/s)'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        importer = Importer(batch_size=options['batch_size'])
+        if options['path'] == '-':
+            importer.run(sys.stdin, on_chunk=self.report)
+        else:
+            try:
+                with open(options['path'], encoding='utf-8') as lines:
+                    importer.run(lines, on_chunk=self.report)
+            except OSError as exc:
+                raise CommandError(f"Could not read '{options['path']}': {exc}")
+
+        for error in importer.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        if importer.error_count > len(importer.errors):
+            self.stderr.write(f'... and {importer.error_count - len(importer.errors)} more errors')
+        self.stdout.write(self.style.SUCCESS('Import finished'))
+        self.report(importer)
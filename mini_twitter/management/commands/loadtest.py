@@ -0,0 +1,91 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_twitter.benchmark import percentile
+
+
+class Command(BaseCommand):
+    """
+        Send concurrent requests to a running server and report its throughput and latency.
+
+        Run it against the same server with `ASYNC_VIEWS` on and off, at the same number of
+        workers, to compare the async and the sync read paths.
+
+        Usage:
+            python manage.py loadtest http://localhost:8000/api/feed/ --username alice --password secret
+            python manage.py loadtest http://localhost:8000/api/posts/1/like/ --method POST --token <jwt> -c 50 -n 5000
+    """
+    help = 'Measure the requests per second and the latency percentiles of an API endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='URL of the endpoint.')
+        parser.add_argument('--method', default='GET', help='HTTP method, GET by default.')
+        parser.add_argument('-c', '--concurrency', type=int, default=20, help='Number of concurrent clients.')
+        parser.add_argument('-n', '--requests', type=int, default=1000, help='Total number of requests.')
+        parser.add_argument('--token', help='JWT access token sent as a Bearer token.')
+        parser.add_argument('--username', help='Get the access token from /api/token/ with these credentials.')
+        parser.add_argument('--password', help='Password of --username.')
+        parser.add_argument('--timeout', type=float, default=30, help='Timeout of each request in seconds.')
+
+    def get_token(self, url, username, password):
+        body = json.dumps({'username': username, 'password': password}).encode()
+        request = Request(urljoin(url, '/api/token/'), data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request) as response:
+                return json.load(response)['access']
+        except (HTTPError, URLError, KeyError) as exc:
+            raise CommandError(f'Could not get a token for {username}: {exc}')
+
+    def handle(self, *args, **options):
+        token = options['token']
+        if token is None and options['username']:
+            token = self.get_token(options['url'], options['username'], options['password'])
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+
+        latencies = []
+        errors = {}
+        lock = threading.Lock()
+
+        def send(_):
+            request = Request(options['url'], method=options['method'], headers=headers)
+            started = time.perf_counter()
+            try:
+                with urlopen(request, timeout=options['timeout']) as response:
+                    response.read()
+                    result = None
+            except HTTPError as exc:
+                result = exc.code
+            except (URLError, OSError) as exc:
+                result = type(exc).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                if result is None:
+                    latencies.append(elapsed)
+                else:
+                    errors[result] = errors.get(result, 0) + 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(send, range(options['requests'])))
+        duration = time.perf_counter() - started
+
+        latencies.sort()
+        ms = [value * 1000 for value in latencies]
+        self.stdout.write(f'{options["method"]} {options["url"]}')
+        self.stdout.write(f'  requests:    {options["requests"]} ({options["concurrency"]} concurrent) in {duration:.2f}s')
+        self.stdout.write(f'  throughput:  {len(latencies) / duration:.1f} req/s')
+        if ms:
+            self.stdout.write(
+                f'  latency ms:  mean {statistics.fmean(ms):.1f}  p50 {percentile(ms, 0.50):.1f}  '
+                f'p95 {percentile(ms, 0.95):.1f}  p99 {percentile(ms, 0.99):.1f}  max {ms[-1]:.1f}'
+            )
+        if errors:
+            self.stdout.write(self.style.WARNING(f'  errors:      {errors}'))
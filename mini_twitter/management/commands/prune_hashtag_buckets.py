@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from mini_twitter.hashtags import prune_buckets
+
+
+class Command(BaseCommand):
+    """
+        Delete the hourly hastag counts that are out of the trending window.
+
+        Usage:
+            python manage.py prune_hashtag_buckets
+            python manage.py prune_hashtag_buckets --hours 48
+    """
+    help = 'Delete the hourly hastag counts older than the trending window.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, help='Keep this many hours instead of HASHTAG_TRENDING_WINDOW.')
+
+    def handle(self, *args, **options):
+        deleted = prune_buckets(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} hastag buckets deleted'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_twitter.suggestions import BATCH_SIZE, rebuild_all_suggestions
+
+
+class Command(BaseCommand):
+    """
+        Recompute the who-to-follow suggestions of every user from the follow graph.
+
+        Meant to run periodically: between two runs the suggestions are only updated by the
+        `suggestions.follow` jobs of the follow toggles.
+
+        Usage:
+            python manage.py rebuild_suggestions
+            python manage.py rebuild_suggestions --batch-size 1000
+    """
+    help = 'Recompute the who-to-follow suggestions of every user from the follow graph.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Users recomputed per query.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        users = written = 0
+        for users, written in rebuild_all_suggestions(options['batch_size']):
+            self.stdout.write(f'{users} users done...')
+        self.stdout.write(self.style.SUCCESS(f'{users} users with {written} suggestions'))
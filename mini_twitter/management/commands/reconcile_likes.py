@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from mini_twitter.likes import flush_like_shards, reconcile_likes
+
+
+class Command(BaseCommand):
+    """
+        Repair the denormalized like counters of the posts.
+
+        Usage:
+            python manage.py reconcile_likes
+            python manage.py reconcile_likes --post 10 --post 12
+            python manage.py reconcile_likes --flush-only
+    """
+    help = 'Recompute Post.likes from the likes_users rows, or only fold the sharded counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='posts', help='Only repair this post id.')
+        parser.add_argument(
+            '--flush-only',
+            action='store_true',
+            help='Only fold the sharded counters of hot posts into Post.likes.',
+        )
+
+    def handle(self, *args, **options):
+        if options['flush_only']:
+            folded = flush_like_shards(options['posts'])
+            self.stdout.write(self.style.SUCCESS(f'{folded} likes folded from the counter shards'))
+            return
+
+        drifted = reconcile_likes(options['posts'])
+        self.stdout.write(self.style.SUCCESS(f'{drifted} posts had their likes counter repaired'))
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mini_twitter.images import generate_variants
+from mini_twitter.models import Post
+
+
+class Command(BaseCommand):
+    """
+        Render the resized variants of the images of existing posts.
+
+        Usage:
+            python manage.py regenerate_image_variants
+            python manage.py regenerate_image_variants --missing --workers 4
+            python manage.py regenerate_image_variants --post 10 --post 12
+    """
+    help = 'Render the resized variants of the post images, with IMAGE_VARIANT_WIDTHS and IMAGE_VARIANT_FORMATS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='posts', help='Only this post id.')
+        parser.add_argument('--missing', action='store_true', help='Only posts without variants.')
+        parser.add_argument('--workers', type=int, default=2, help='Images rendered in parallel.')
+
+    def render(self, post_id):
+        try:
+            return post_id, generate_variants(post_id), None
+        except Exception as exc:
+            return post_id, 0, exc
+
+    def render_in_thread(self, post_id):
+        close_old_connections()
+        try:
+            return self.render(post_id)
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True).order_by('pk')
+        if options['posts']:
+            posts = posts.filter(pk__in=options['posts'])
+        if options['missing']:
+            posts = posts.filter(image_variants={})
+
+        post_ids = list(posts.values_list('pk', flat=True))
+        if options['workers'] > 1:
+            executor = ThreadPoolExecutor(max_workers=options['workers'])
+            results = executor.map(self.render_in_thread, post_ids)
+        else:
+            executor = None
+            results = map(self.render, post_ids)
+
+        done = files = failed = 0
+        for post_id, written, error in results:
+            done += 1
+            files += written
+            if error is not None:
+                failed += 1
+                self.stderr.write(f'post {post_id}: {error}')
+            if done % 100 == 0:
+                self.stdout.write(f'{done} posts processed...')
+        if executor is not None:
+            executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'{done} posts processed, {files} variants written, {failed} failed'))
@@ -0,0 +1,103 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from mini_twitter import jobs
+
+PRUNE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    """
+        Run the background jobs enqueued by the API, see `mini_twitter/jobs.py`.
+
+        Each thread claims its own jobs, so several workers (threads, processes or containers)
+        can run against the same database.
+
+        Usage:
+            python manage.py run_worker
+            python manage.py run_worker --concurrency 4 --poll-interval 0.5
+            python manage.py run_worker --once
+    """
+    help = 'Run the background jobs stored in the database until stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Threads claiming and running jobs.')
+        parser.add_argument('--batch-size', type=int, default=None, help='Jobs claimed at once, JOBS_BATCH_SIZE by default.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when no job is ready.')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is ready.')
+
+    def prune(self):
+        with self.lock:
+            if time.monotonic() - self.pruned_at < PRUNE_INTERVAL:
+                return
+            self.pruned_at = time.monotonic()
+        deleted = jobs.prune()
+        if deleted:
+            self.stdout.write(f'{deleted} finished jobs deleted')
+
+    def work(self, options, threaded=False):
+        worker_id = jobs.new_worker_id()
+        while not self.stopping.is_set():
+            if threaded:
+                # drop the connection if it broke or outlived CONN_MAX_AGE, as at the end of a request
+                close_old_connections()
+            try:
+                self.prune()
+                succeeded, failed = jobs.run_pending(worker_id, options['batch_size'])
+            except Exception as exc:
+                # the database is unreachable, wait for it like for an empty queue
+                self.stderr.write(f'{worker_id}: {exc}')
+                succeeded = failed = 0
+            with self.lock:
+                self.succeeded += succeeded
+                self.failed += failed
+            if not succeeded and not failed:
+                if options['once']:
+                    break
+                self.stopping.wait(options['poll_interval'])
+
+    def work_in_thread(self, options):
+        close_old_connections()
+        try:
+            self.work(options, threaded=True)
+        finally:
+            close_old_connections()
+
+    def stop(self, signum, frame):
+        self.stdout.write('Stopping after the running jobs...')
+        self.stopping.set()
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be positive')
+        if settings.JOBS_EAGER:
+            self.stderr.write('JOBS_EAGER is set, the API runs its jobs inline and does not enqueue them')
+
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.succeeded = self.failed = 0
+        self.pruned_at = -PRUNE_INTERVAL
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.stdout.write(f"Worker started, concurrency {options['concurrency']}")
+        if options['concurrency'] == 1 and options['once']:
+            self.work(options)
+        else:
+            threads = [
+                threading.Thread(target=self.work_in_thread, args=(options,), name=f'worker-{i}', daemon=True)
+                for i in range(options['concurrency'])
+            ]
+            for thread in threads:
+                thread.start()
+            # join with a timeout so the signals are handled by the main thread
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+
+        self.stdout.write(self.style.SUCCESS(f'{self.succeeded} jobs done, {self.failed} failed'))
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_twitter.seed import BATCH_SIZE, DEFAULT_PASSWORD, GraphSeeder
+
+
+class Command(BaseCommand):
+    """
+        Generate a power-law social graph with a post history, see `mini_twitter/seed.py`.
+
+        Usage:
+            python manage.py seed_graph --users 2000 --posts 50000 --seed 1
+            python manage.py seed_graph --users 100000 --posts 10000000 --avg-following 80 --no-timelines
+    """
+    help = 'Bulk generate users, a power-law follow graph and posts for load tests and benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to create.')
+        parser.add_argument('--posts', type=int, default=20000, help='Posts to create.')
+        parser.add_argument('--avg-following', type=int, default=50, help='Mean number of users followed by a user.')
+        parser.add_argument('--alpha', type=float, default=1.1, help='Zipf exponent of the user popularity.')
+        parser.add_argument('--days', type=int, default=30, help='Days of post history.')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed, the same seed gives the same graph.')
+        parser.add_argument('--prefix', default='seed_', help='Prefix of the usernames.')
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Password of all the seeded users.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows written per transaction.')
+        parser.add_argument('--no-timelines', action='store_true', help='Do not build the materialized timelines.')
+
+    def report(self, seeder, message):
+        self.stdout.write(f'{message} ({seeder.elapsed:.0f}s)')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['posts'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--users must be at least 2, --posts positive and --batch-size positive')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f"Users starting with '{options['prefix']}' already exist, use another --prefix")
+
+        seeder = GraphSeeder(
+            users=options['users'],
+            posts=options['posts'],
+            avg_following=options['avg_following'],
+            alpha=options['alpha'],
+            days=options['days'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+            password=options['password'],
+            batch_size=options['batch_size'],
+            timelines=not options['no_timelines'],
+            on_progress=self.report,
+        )
+        written = seeder.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {written['users']} users, {written['follows']} follows and {written['posts']} posts "
+            f'in {seeder.elapsed:.0f}s'
+        ))
@@ -0,0 +1,271 @@
+"""
+    Per-endpoint request metrics, exposed in the Prometheus text format at `/api/metrics/`.
+
+    `MetricsMiddleware` records, for each request, under the URL name of the route it resolved to
+    (`feed`, `follow-toggle`, `post-detail`, ...):
+
+        - the wall time of the request
+        - the number of SQL queries and the time spent in the database
+        - the size of the response body
+
+    The queries are counted by a wrapper installed on every database connection when it is
+    opened (see apps.py), which adds to the stats of the request held in a context variable. The
+    context is copied into `sync_to_async` threads, so the queries of the async views count too.
+
+    The values are aggregated into histograms with fixed buckets, in memory: recording a request
+    is a few additions under a lock. Each server process keeps its own metrics, so with several
+    workers every scrape reads the process that served it.
+
+    With `METRICS_SLOW_REQUEST_MS` set, the requests slower than it are logged with their SQL on
+    the `mini_twitter.slow_requests` logger.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+logger = logging.getLogger('mini_twitter.slow_requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+MAX_LOGGED_QUERIES = 100
+UNMATCHED = 'unmatched'
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """
+        The database activity of the request being served.
+    """
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.capture_sql = capture_sql
+        self.sql = []
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+        Database execute wrapper adding each query to the stats of the current request.
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.capture_sql and len(stats.sql) < MAX_LOGGED_QUERIES:
+            stats.sql.append((elapsed, sql))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+        Wrap the queries of a new database connection, connected to `connection_created` when the app is ready.
+    """
+    # the wrappers outlive a reconnection of the same connection object
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+class Histogram:
+    """
+        Cumulative histogram with fixed upper bounds, in the Prometheus format.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class Registry:
+    """
+        The metrics of this process: histograms and counters keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms.setdefault(key, Histogram(buckets))
+        histogram.observe(value)
+
+    def record_request(self, view, method, status, duration, stats, size):
+        labels = (('view', view), ('method', method))
+        with self.lock:
+            key = ('http_requests_total', labels + (('status', str(status)),))
+            self.counters[key] = self.counters.get(key, 0) + 1
+            self.observe('http_request_duration_seconds', labels, duration, DURATION_BUCKETS)
+            self.observe('http_request_db_queries', labels, stats.queries, QUERY_BUCKETS)
+            self.observe('http_request_db_duration_seconds', labels, stats.db_time, DURATION_BUCKETS)
+            if size is not None:
+                self.observe('http_response_size_bytes', labels, size, SIZE_BUCKETS)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+registry = Registry()
+
+HELP = {
+    'http_requests_total': ('counter', 'Requests served, by view, method and status code.'),
+    'http_request_duration_seconds': ('histogram', 'Wall time of the requests.'),
+    'http_request_db_queries': ('histogram', 'SQL queries made by each request.'),
+    'http_request_db_duration_seconds': ('histogram', 'Time spent in the database by each request.'),
+    'http_response_size_bytes': ('histogram', 'Size of the response bodies, streaming responses excluded.'),
+    'response_cache_requests_total': ('counter', 'Response cache lookups, by kind and result.'),
+    'background_jobs': ('gauge', 'Background jobs in the queue, by status.'),
+}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(extra_samples=()):
+    """
+        Render the metrics in the Prometheus text exposition format.
+
+        Args:
+            extra_samples (iterable): More `(name, labels, value)` samples, such as gauges read at scrape time.
+
+        Returns:
+            str: The exposition text.
+    """
+    with registry.lock:
+        counters = sorted(registry.counters.items())
+        histograms = sorted(
+            (key, list(histogram.cumulative_counts()), histogram.sum, histogram.count, histogram.buckets)
+            for key, histogram in registry.histograms.items()
+        )
+
+    samples = {}
+    for (name, labels), value in counters:
+        samples.setdefault(name, []).append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), cumulative, total, count, buckets in histograms:
+        lines = samples.setdefault(name, [])
+        for bound, value in zip([*buckets, '+Inf'], cumulative):
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {value}')
+        lines.append(f'{name}_sum{format_labels(labels)} {format_number(total)}')
+        lines.append(f'{name}_count{format_labels(labels)} {count}')
+    for name, labels, value in extra_samples:
+        samples.setdefault(name, []).append(f'{name}{format_labels(labels)} {format_number(value)}')
+
+    output = []
+    for name, lines in samples.items():
+        kind, description = HELP.get(name, ('untyped', name))
+        output.append(f'# HELP {name} {description}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(lines)
+    return '\n'.join(output) + '\n'
+
+
+class MetricsMiddleware:
+    """
+        Record the wall time, SQL queries, database time and response size of each request.
+
+        Works under WSGI and ASGI; it should be first in `MIDDLEWARE` so the time spent in the
+        other middleware is counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    def start(self):
+        stats = RequestStats(capture_sql=settings.METRICS_SLOW_REQUEST_MS > 0)
+        return stats, _request_stats.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else UNMATCHED
+        size = None if response.streaming else len(response.content)
+        registry.record_request(view, request.method, response.status_code, duration, stats, size)
+
+        if stats.capture_sql and duration * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            queries = '\n'.join(f'  {elapsed * 1000:.1f} ms: {sql}' for elapsed, sql in stats.sql)
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms\n%s',
+                request.method, request.get_full_path(), view, duration * 1000,
+                stats.queries, stats.db_time * 1000, queries,
+            )
+
+
+class PrometheusRenderer(BaseRenderer):
+    """
+        Render the exposition text as is, and the error responses as their message.
+    """
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = f"{data.get('message', data.get('detail', ''))}\n"
+        return data.encode(self.charset)
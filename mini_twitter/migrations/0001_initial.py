@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 16:23
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hastag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserTwitter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=datetime.datetime(2026, 10, 18, 13, 28, 31, 185825))),
+                ('followers', models.ManyToManyField(blank=True, related_name='users_following', to='mini_twitter.usertwitter')),
+                ('following', models.ManyToManyField(blank=True, related_name='users_followers', to='mini_twitter.usertwitter')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Post',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('image', models.ImageField(blank=True, null=True, upload_to='posts')),
+                ('body', models.TextField()),
+                ('status', models.IntegerField(choices=[(1, 'ACTIVE'), (2, 'INACTIVE')], default=1)),
+                ('created_at', models.DateTimeField(default=datetime.datetime(2026, 10, 18, 13, 28, 31, 187343))),
+                ('likes', models.IntegerField(default=0)),
+                ('hastags', models.ManyToManyField(blank=True, related_name='posts', to='mini_twitter.hastag')),
+                ('likes_users', models.ManyToManyField(blank=True, related_name='likes', to='mini_twitter.usertwitter')),
+                ('user_twitter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mini_twitter.usertwitter')),
+            ],
+        ),
+    ]
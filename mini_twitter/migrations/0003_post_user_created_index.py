@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0002_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user_twitter', '-created_at', '-id'], name='post_user_created_idx'),
+        ),
+    ]
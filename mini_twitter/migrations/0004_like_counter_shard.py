@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 16:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0003_post_user_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='like_shards', to='mini_twitter.post')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'shard'), name='unique_like_counter_shard')],
+            },
+        ),
+    ]
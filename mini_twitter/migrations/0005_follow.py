@@ -0,0 +1,39 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0004_like_counter_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Follow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('followee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follower_edges', to='mini_twitter.usertwitter')),
+                ('follower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='following_edges', to='mini_twitter.usertwitter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['followee', 'follower'], name='follow_followee_idx')],
+                'constraints': [
+                    models.UniqueConstraint(fields=('follower', 'followee'), name='unique_follow'),
+                    models.CheckConstraint(condition=models.Q(('follower', models.F('followee')), _negated=True), name='follow_not_self'),
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name='usertwitter',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usertwitter',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,65 @@
+"""
+    Copy the edges of the legacy `followers` and `following` tables into `Follow`.
+
+    Both tables were written by the follow toggle, so the same edge usually appears in both of
+    them; the unique constraint on `Follow` drops the duplicates. The copy is idempotent and can
+    be run again against a database that kept receiving writes on the legacy tables.
+"""
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+def copy_edges(Follow, rows):
+    batch = []
+    for follower_id, followee_id in rows:
+        if follower_id == followee_id:
+            continue
+        batch.append(Follow(follower_id=follower_id, followee_id=followee_id))
+        if len(batch) >= BATCH_SIZE:
+            Follow.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    Follow.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def count_edges(Follow, field):
+    return Coalesce(
+        Subquery(
+            Follow.objects.filter(**{field: OuterRef('pk')})
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def merge_follow_tables(apps, schema_editor):
+    UserTwitter = apps.get_model('mini_twitter', 'UserTwitter')
+    Follow = apps.get_model('mini_twitter', 'Follow')
+
+    # user.following holds (user -> followed user)
+    following = UserTwitter.following.through.objects.values_list('from_usertwitter_id', 'to_usertwitter_id')
+    copy_edges(Follow, following.iterator(chunk_size=BATCH_SIZE))
+
+    # user.followers holds (user <- follower), stored the other way around
+    followers = UserTwitter.followers.through.objects.values_list('to_usertwitter_id', 'from_usertwitter_id')
+    copy_edges(Follow, followers.iterator(chunk_size=BATCH_SIZE))
+
+    UserTwitter.objects.update(
+        followers_count=count_edges(Follow, 'followee'),
+        following_count=count_edges(Follow, 'follower'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0005_follow'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_follow_tables, migrations.RunPython.noop),
+    ]
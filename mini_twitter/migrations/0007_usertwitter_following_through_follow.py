@@ -0,0 +1,36 @@
+"""
+    Point `UserTwitter.following` at the `Follow` edges filled by 0006.
+
+    Only the model state changes: the legacy `followers` and `following` tables are kept, so the
+    instances of the previous release that still read and write them keep working during the
+    rollout. They are dropped by 0016, once no instance uses them anymore.
+"""
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0006_merge_follow_tables'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='usertwitter',
+                    name='followers',
+                ),
+                migrations.RemoveField(
+                    model_name='usertwitter',
+                    name='following',
+                ),
+                migrations.AddField(
+                    model_name='usertwitter',
+                    name='following',
+                    field=models.ManyToManyField(blank=True, related_name='followers', through='mini_twitter.Follow', through_fields=('follower', 'followee'), to='mini_twitter.usertwitter'),
+                ),
+            ],
+            database_operations=[],
+        ),
+    ]
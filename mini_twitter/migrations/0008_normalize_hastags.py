@@ -0,0 +1,37 @@
+"""
+    Normalize the existing hastag names (lowercase, without the '#') and merge the duplicates,
+    so the unique constraint of the next migration can be added.
+"""
+from django.db import migrations
+
+
+def normalize_hastags(apps, schema_editor):
+    Hastag = apps.get_model('mini_twitter', 'Hastag')
+    PostHastag = apps.get_model('mini_twitter', 'Post').hastags.through
+
+    kept = {}
+    for hastag in Hastag.objects.order_by('pk').iterator():
+        name = hastag.name.strip().lstrip('#').lower()[:255]
+        if name not in kept:
+            kept[name] = hastag.pk
+            if hastag.name != name:
+                Hastag.objects.filter(pk=hastag.pk).update(name=name)
+            continue
+        # duplicate: move its posts to the kept hastag and drop it
+        post_ids = PostHastag.objects.filter(hastag_id=hastag.pk).values_list('post_id', flat=True)
+        PostHastag.objects.bulk_create(
+            [PostHastag(post_id=post_id, hastag_id=kept[name]) for post_id in post_ids],
+            ignore_conflicts=True,
+        )
+        hastag.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0007_usertwitter_following_through_follow'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_hastags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 16:40
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0008_normalize_hastags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HastagBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='hastag',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='hastag',
+            constraint=models.CheckConstraint(condition=models.Q(('name', django.db.models.functions.text.Lower('name'))), name='hastag_name_lowercase'),
+        ),
+        migrations.AddField(
+            model_name='hastagbucket',
+            name='hastag',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='mini_twitter.hastag'),
+        ),
+        migrations.AddIndex(
+            model_name='hastagbucket',
+            index=models.Index(fields=['bucket'], name='hastag_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hastagbucket',
+            constraint=models.UniqueConstraint(fields=('hastag', 'bucket'), name='unique_hastag_bucket'),
+        ),
+    ]
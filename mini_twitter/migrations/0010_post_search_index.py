@@ -0,0 +1,90 @@
+"""
+    Full-text index over the title and body of the posts, see `mini_twitter/search.py`.
+
+    - PostgreSQL: a generated `search_vector` tsvector column (title weighted above body) with a
+      GIN index, the database keeps it in sync with every insert and update.
+    - SQLite: an FTS5 external content table over the posts table, kept in sync by triggers.
+
+    The index is created for the database the migration runs on, other backends fall back to
+    `icontains` lookups.
+"""
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE mini_twitter_post ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(body, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX post_search_vector_idx ON mini_twitter_post USING GIN (search_vector)',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS post_search_vector_idx',
+    'ALTER TABLE mini_twitter_post DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE mini_twitter_post_fts USING fts5(
+        title, body, content='mini_twitter_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER mini_twitter_post_fts_insert AFTER INSERT ON mini_twitter_post BEGIN
+        INSERT INTO mini_twitter_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER mini_twitter_post_fts_delete AFTER DELETE ON mini_twitter_post BEGIN
+        INSERT INTO mini_twitter_post_fts (mini_twitter_post_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER mini_twitter_post_fts_update AFTER UPDATE OF title, body ON mini_twitter_post BEGIN
+        INSERT INTO mini_twitter_post_fts (mini_twitter_post_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO mini_twitter_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    # index the posts that already exist
+    "INSERT INTO mini_twitter_post_fts (mini_twitter_post_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS mini_twitter_post_fts_insert',
+    'DROP TRIGGER IF EXISTS mini_twitter_post_fts_delete',
+    'DROP TRIGGER IF EXISTS mini_twitter_post_fts_update',
+    'DROP TABLE IF EXISTS mini_twitter_post_fts',
+]
+
+STATEMENTS = {
+    'postgresql': (POSTGRES_FORWARD, POSTGRES_BACKWARD),
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+}
+
+
+def create_search_index(apps, schema_editor):
+    forward, _ = STATEMENTS.get(schema_editor.connection.vendor, ([], []))
+    for statement in forward:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    _, backward = STATEMENTS.get(schema_editor.connection.vendor, ([], []))
+    for statement in backward:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0009_hastag_unique_name_buckets'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0012_job'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='post_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('status', 1)), fields=['user_twitter', '-created_at', '-id'], name='post_active_user_created_idx'),
+        ),
+    ]
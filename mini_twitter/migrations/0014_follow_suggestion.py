@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 17:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0013_post_active_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mutuals', models.PositiveIntegerField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follow_suggestions', to='mini_twitter.usertwitter')),
+                ('suggested', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mini_twitter.usertwitter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-mutuals', 'suggested'], name='suggestion_owner_mutuals_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'suggested'), name='unique_follow_suggestion')],
+            },
+        ),
+    ]
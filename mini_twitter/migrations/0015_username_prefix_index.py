@@ -0,0 +1,49 @@
+"""
+    Index for the case-insensitive username prefix search of the user directory, see `UserDirectoryView`.
+
+    `user__username__istartswith` compiles to a `LIKE 'prefix%'` that the unique index on the
+    usernames cannot serve, so each backend gets an index matching its own SQL:
+
+    - PostgreSQL: `UPPER(username::text) LIKE UPPER('prefix%')`, served by a `text_pattern_ops`
+      index on the same expression, which compares the characters one by one whatever the
+      collation of the database, as `LIKE` does.
+    - SQLite: `username LIKE 'prefix%'`, case-insensitive by default, served by a `NOCASE` index.
+
+    Other backends keep the plain username index.
+"""
+from django.db import migrations
+
+STATEMENTS = {
+    'postgresql': (
+        'CREATE INDEX auth_user_username_upper_like_idx ON auth_user (UPPER(username::text) text_pattern_ops)',
+        'DROP INDEX IF EXISTS auth_user_username_upper_like_idx',
+    ),
+    'sqlite': (
+        'CREATE INDEX auth_user_username_nocase_idx ON auth_user (username COLLATE NOCASE)',
+        'DROP INDEX IF EXISTS auth_user_username_nocase_idx',
+    ),
+}
+
+
+def create_username_index(apps, schema_editor):
+    forward, _ = STATEMENTS.get(schema_editor.connection.vendor, (None, None))
+    if forward:
+        schema_editor.execute(forward)
+
+
+def drop_username_index(apps, schema_editor):
+    _, backward = STATEMENTS.get(schema_editor.connection.vendor, (None, None))
+    if backward:
+        schema_editor.execute(backward)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('mini_twitter', '0014_follow_suggestion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_username_index, drop_username_index),
+    ]
@@ -0,0 +1,75 @@
+"""
+    Drop the legacy `followers` and `following` tables kept by 0007.
+
+    Apply it in the release after the one that brought the `Follow` edges, once no instance of the
+    older code is running: the edges those instances wrote to the legacy tables during the rollout
+    are copied into `Follow` again (the copy of 0006 is idempotent) and the counters recomputed
+    before the tables are dropped. Databases where the tables are already gone are left as they are.
+"""
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# table: (follower column, followee column)
+LEGACY_TABLES = {
+    # user.following holds (user -> followed user)
+    'mini_twitter_usertwitter_following': ('from_usertwitter_id', 'to_usertwitter_id'),
+    # user.followers holds (user <- follower), stored the other way around
+    'mini_twitter_usertwitter_followers': ('to_usertwitter_id', 'from_usertwitter_id'),
+}
+
+
+def count_edges(Follow, field):
+    return Coalesce(
+        Subquery(
+            Follow.objects.filter(**{field: OuterRef('pk')})
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def drop_legacy_follow_tables(apps, schema_editor):
+    UserTwitter = apps.get_model('mini_twitter', 'UserTwitter')
+    Follow = apps.get_model('mini_twitter', 'Follow')
+    connection = schema_editor.connection
+    existing = set(connection.introspection.table_names())
+    legacy = [table for table in LEGACY_TABLES if table in existing]
+    if not legacy:
+        return
+
+    edges = connection.ops.quote_name(Follow._meta.db_table)
+    with connection.cursor() as cursor:
+        for table in legacy:
+            follower, followee = LEGACY_TABLES[table]
+            cursor.execute(
+                f"""
+                INSERT INTO {edges} (follower_id, followee_id, created_at)
+                SELECT legacy.{follower}, legacy.{followee}, %s FROM {connection.ops.quote_name(table)} legacy
+                WHERE legacy.{follower} <> legacy.{followee} AND NOT EXISTS (
+                    SELECT 1 FROM {edges} edge
+                    WHERE edge.follower_id = legacy.{follower} AND edge.followee_id = legacy.{followee}
+                )
+                """,
+                [timezone.now()],
+            )
+    UserTwitter.objects.update(
+        followers_count=count_edges(Follow, 'followee'),
+        following_count=count_edges(Follow, 'follower'),
+    )
+    for table in legacy:
+        schema_editor.execute(f'DROP TABLE {connection.ops.quote_name(table)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mini_twitter', '0015_username_prefix_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_legacy_follow_tables, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
-from datetime import datetime
+from django.utils import timezone
 from enum import Enum
 
 class StatusEnum(Enum):
@@ -23,10 +24,15 @@ class StatusEnum(Enum):
 class Hastag(models.Model):
     """
         class for hastag
-        - name is a CharField that stores the name of the hastag
+        - name is a CharField that stores the name of the hastag, lowercase and without the '#' (unique)
     """
-    name = models.CharField(max_length=255)
-    
+    name = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(condition=models.Q(name=Lower('name')), name='hastag_name_lowercase'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -35,23 +41,68 @@ class UserTwitter(models.Model):
         class for user
         - user is a OneToOneField to the User model from django
         - created_at is a DateTimeField that stores the date and time when the user was created
-        - followers is a ManyToManyField to the UserTwitter model that stores the followers of the user
-        - following is a ManyToManyField to the UserTwitter model that stores the users that the user is following
+        - following is a ManyToManyField, through the Follow model, to the users that the user is following
+          (the reverse accessor `followers` gives the followers of the user)
+        - followers_count is a PositiveIntegerField with the number of followers of the user
+        - following_count is a PositiveIntegerField with the number of users that the user is following
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(default=datetime.now())
-    followers = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='users_following')
-    following = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='users_followers')
+    created_at = models.DateTimeField(default=timezone.now)
+    following = models.ManyToManyField(
+        'self',
+        through='Follow',
+        through_fields=('follower', 'followee'),
+        symmetrical=False,
+        blank=True,
+        related_name='followers',
+    )
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
 
+class Follow(models.Model):
+    """
+        class for the follow graph, one row per edge
+        - follower is a ForeignKey to the UserTwitter that follows
+        - followee is a ForeignKey to the UserTwitter that is followed
+        - created_at is a DateTimeField that stores the date and time when the follow happened
+    """
+    follower = models.ForeignKey(UserTwitter, on_delete=models.CASCADE, related_name='following_edges')
+    followee = models.ForeignKey(UserTwitter, on_delete=models.CASCADE, related_name='follower_edges')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # also the index used to walk the users followed by someone
+            models.UniqueConstraint(fields=['follower', 'followee'], name='unique_follow'),
+            models.CheckConstraint(condition=~models.Q(follower=models.F('followee')), name='follow_not_self'),
+        ]
+        indexes = [
+            models.Index(fields=['followee', 'follower'], name='follow_followee_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.follower} -> {self.followee}'
+
+class PostQuerySet(models.QuerySet):
+
+    def active(self):
+        """
+            - filter the posts that can be seen by other users
+        """
+        return self.filter(status=StatusEnum.ACTIVE.value)
+
+
 class Post(models.Model):
     """
         class for post
         - title is a CharField that stores the title of the post
+        - image is a ImageField with the original image of the post
+        - image_variants is a JSONField with the resized copies of the image, {width: {format: file name}}
         - body is a TextField that stores the body of the post
-        - status is a IntegerField that stores the status of the post
+        - status is a IntegerField that stores the status of the post, a deleted post becomes INACTIVE
         - created_at is a DateTimeField that stores the date and time when the post was created
         - user_twitter is a ForeignKey to the UserTwitter model that stores the user that created the post
         - likes is a IntegerField that stores the number of likes of the post
@@ -60,14 +111,28 @@ class Post(models.Model):
     """
     title = models.CharField(max_length=255)
     image = models.ImageField(upload_to='posts', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     body = models.TextField()
     status = models.IntegerField(choices=StatusEnum.choices(), default=StatusEnum.ACTIVE.value)
-    created_at = models.DateTimeField(default=datetime.now())
+    created_at = models.DateTimeField(default=timezone.now)
     user_twitter = models.ForeignKey(UserTwitter, on_delete=models.CASCADE)
     likes = models.IntegerField(default=0)
     likes_users = models.ManyToManyField(UserTwitter, related_name='likes', blank=True)
     hastags = models.ManyToManyField(Hastag, blank=True, related_name='posts')
 
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # backs the keyset pagination on (created_at, id) of a user's active posts, the inactive ones
+            # are left out of the index so it does not grow with the deleted history
+            models.Index(
+                fields=['user_twitter', '-created_at', '-id'],
+                condition=models.Q(status=StatusEnum.ACTIVE.value),
+                name='post_active_user_created_idx',
+            ),
+        ]
+
     @property
     def count_likes(self):
         """
@@ -76,4 +141,155 @@ class Post(models.Model):
         return self.likes.count()
     
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+class LikeCounterShard(models.Model):
+    """
+        class for the sharded like counter of hot posts
+        - post is a ForeignKey to the Post whose likes are counted
+        - shard is a PositiveSmallIntegerField with the number of the shard
+        - count is a IntegerField with the likes accumulated in the shard, not yet folded into Post.likes
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='like_shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'shard'], name='unique_like_counter_shard'),
+        ]
+
+    def __str__(self):
+        return f'{self.post} #{self.shard}: {self.count}'
+
+class TimelineEntry(models.Model):
+    """
+        class for the materialized home timeline (fan-out-on-write)
+        - owner is a ForeignKey to the UserTwitter whose home timeline holds the entry
+        - post is a ForeignKey to the Post delivered to the timeline
+        - author is a ForeignKey to the UserTwitter that wrote the post (copied from the post)
+        - created_at is a DateTimeField copied from the post, so the timeline is read already sorted
+    """
+    owner = models.ForeignKey(UserTwitter, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(UserTwitter, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='timeline_owner_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner} <- {self.post}'
+
+class FollowSuggestion(models.Model):
+    """
+        class for the precomputed who-to-follow suggestions (see mini_twitter/suggestions.py)
+        - owner is a ForeignKey to the UserTwitter that gets the suggestion
+        - suggested is a ForeignKey to the suggested UserTwitter, followed by users that the owner follows
+        - mutuals is a PositiveIntegerField with the number of users followed by the owner that follow the suggested user
+    """
+    owner = models.ForeignKey(UserTwitter, on_delete=models.CASCADE, related_name='follow_suggestions')
+    suggested = models.ForeignKey(UserTwitter, on_delete=models.CASCADE, related_name='+')
+    mutuals = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'suggested'], name='unique_follow_suggestion'),
+        ]
+        indexes = [
+            # the suggestions of a user are read as one slice of this index
+            models.Index(fields=['owner', '-mutuals', 'suggested'], name='suggestion_owner_mutuals_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner} ?-> {self.suggested} ({self.mutuals})'
+
+class HastagBucket(models.Model):
+    """
+        class for the number of posts tagged with a hastag in one hour, used by the trending hastags
+        - hastag is a ForeignKey to the counted Hastag
+        - bucket is a DateTimeField with the start of the hour
+        - count is a IntegerField with the number of posts created in that hour with the hastag
+    """
+    hastag = models.ForeignKey(Hastag, on_delete=models.CASCADE, related_name='buckets')
+    bucket = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hastag', 'bucket'], name='unique_hastag_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket'], name='hastag_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.hastag} @ {self.bucket}: {self.count}'
+
+class JobStatusEnum(Enum):
+    """
+        - Enum for the status of a background job
+            1. PENDING -> waiting to run at `run_at`
+            2. RUNNING -> claimed by a worker
+            3. DONE -> ran successfully
+            4. FAILED -> failed `max_attempts` times, it will not run again
+    """
+    PENDING = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+    @classmethod
+    def choices(cls):
+        return [(i.value, i.name) for i in cls]
+
+class Job(models.Model):
+    """
+        class for the database-backed job queue (see mini_twitter/jobs.py)
+        - kind is a CharField with the name of the handler that runs the job
+        - payload is a JSONField with the arguments of the handler
+        - idempotency_key is a CharField, a job is not enqueued while a pending job has the same key
+        - status is a IntegerField with the JobStatusEnum of the job
+        - attempts is a PositiveIntegerField with the number of times the job ran
+        - max_attempts is a PositiveIntegerField with the number of attempts before the job is marked as failed
+        - run_at is a DateTimeField with the earliest date the job can run, pushed back after each failure
+        - locked_by is a CharField with the claim of the worker running the job
+        - locked_at is a DateTimeField with the date the job was claimed
+        - last_error is a TextField with the error of the last failed attempt
+        - created_at is a DateTimeField with the date the job was enqueued
+        - finished_at is a DateTimeField with the date the job finished or failed for good
+    """
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    status = models.IntegerField(choices=JobStatusEnum.choices(), default=JobStatusEnum.PENDING.value)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # once a job runs, the work enqueued after it needs a new job with the same key
+            models.UniqueConstraint(
+                fields=['idempotency_key'],
+                condition=models.Q(status=JobStatusEnum.PENDING.value),
+                name='unique_pending_job_key',
+            ),
+        ]
+        indexes = [
+            # the workers poll the pending jobs in run_at order
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({JobStatusEnum(self.status).name})'
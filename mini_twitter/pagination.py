@@ -1,9 +1,315 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
 
-class FeedPagination(PageNumberPagination):
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_filter(queryset, position, reverse=False, created_field='created_at', id_field='id'):
+    """
+        Restrict a queryset to the rows that come after `position` in `(created_at, id)` order.
+
+        Args:
+            queryset (QuerySet): The queryset to filter.
+            position (tuple): The `(created_at, id)` key of the last row already seen.
+            reverse (bool): Walk towards newer rows instead of older ones.
+            created_field (str): Name of the creation date field in the queryset.
+            id_field (str): Name of the id field used to break ties in the queryset.
+
+        Returns:
+            QuerySet: The filtered queryset.
+    """
+    created_at, pk = position
+    lookup = 'gt' if reverse else 'lt'
+    # the first condition is a plain range on the index, the second one breaks the ties
+    return queryset.filter(
+        Q(**{f'{created_field}__{lookup}e': created_at}),
+        Q(**{f'{created_field}__{lookup}': created_at}) | Q(**{f'{id_field}__{lookup}': pk}),
+    )
+
+
+def keyset_ordering(reverse=False, created_field='created_at', id_field='id'):
+    """
+        Get the `order_by` arguments matching `keyset_filter`.
+    """
+    if reverse:
+        return (created_field, id_field)
+    return (f'-{created_field}', f'-{id_field}')
+
+
+class PageSizeMixin:
+    """
+        Page size asked with the `page_size` query parameter, capped by `max_page_size`.
+    """
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 5
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+
+class KeysetPagination(PageSizeMixin, BasePagination):
+    """
+        Keyset (cursor) pagination keyed on `(created_at, id)`, newest first.
+
+        Pages are fetched with an indexed range condition instead of `OFFSET`, so deep pages cost the
+        same as the first one and posts created between requests do not shift the pages. Cursors
+        are opaque strings, and the total count is only computed when asked with `?count=true`.
+
+        Besides querysets, it accepts any object implementing `keyset_slice(position, reverse, limit)`.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.start(request)
+        if self.count is not None:
+            self.count = queryset.count()
+        return self.finish(self.fetch(queryset, self.position, self.reverse, self.page_size + 1))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+            Async version of `paginate_queryset`, the source may implement `akeyset_slice` and `acount`.
+        """
+        self.start(request)
+        if self.count is not None:
+            self.count = await queryset.acount()
+        return self.finish(await self.afetch(queryset, self.position, self.reverse, self.page_size + 1))
+
+    def start(self, request):
+        """
+            Read the page size, the cursor and the count flag of the request.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            # replaced by the total once the rows are counted
+            self.count = 0
+
+    def finish(self, rows):
+        """
+            Keep the rows of the page, fetched with one extra row to know if there are more.
+        """
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+
+        self.page = rows
+        return rows
+
+    def fetch(self, queryset, position, reverse, limit):
+        """
+            Fetch up to `limit` rows after `position`.
+        """
+        if hasattr(queryset, 'keyset_slice'):
+            return list(queryset.keyset_slice(position, reverse, limit))
+        return list(self.slice_queryset(queryset, position, reverse, limit))
+
+    async def afetch(self, queryset, position, reverse, limit):
+        if hasattr(queryset, 'akeyset_slice'):
+            return await queryset.akeyset_slice(position, reverse, limit)
+        return [row async for row in self.slice_queryset(queryset, position, reverse, limit)]
+
+    def slice_queryset(self, queryset, position, reverse, limit):
+        queryset = queryset.order_by(*keyset_ordering(reverse))
+        if position is not None:
+            queryset = keyset_filter(queryset, position, reverse)
+        return queryset[:limit]
+
+    def get_position(self, row):
+        """
+            Get the cursor payload of the position of a row.
+        """
+        return {'t': row.created_at.isoformat(), 'i': row.pk}
+
+    def parse_position(self, payload):
+        """
+            Get the position of a cursor payload, raising ValueError when it is not a valid one.
+        """
+        created_at = parse_datetime(payload['t'])
+        if created_at is None:
+            raise ValueError(payload['t'])
+        return created_at, int(payload['i'])
+
+    def encode_cursor(self, row, reverse):
+        payload = self.get_position(row)
+        if reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        """
+            Decode the cursor of the request into a position and a direction.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            payload = json.loads(raw)
+            return self.parse_position(payload), bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1], False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[0], True))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['count', 'next', 'previous', 'results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Set to true to include the total number of results.',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+
+
+class FeedPagination(KeysetPagination):
     """
         Custom pagination class for the feed endpoint.
     """
     page_size = 5
     page_size_query_param = 'page_size'
-    max_page_size = 5
\ No newline at end of file
+    max_page_size = 5
+
+
+class UserDirectoryPagination(KeysetPagination):
+    """
+        Keyset pagination of the user directory, keyed on the unique username in alphabetical order,
+        so each page is a range of the username index.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    username_field = 'user__username'
+
+    def slice_queryset(self, queryset, position, reverse, limit):
+        queryset = queryset.order_by(f'-{self.username_field}' if reverse else self.username_field)
+        if position is not None:
+            queryset = queryset.filter(**{f"{self.username_field}__{'lt' if reverse else 'gt'}": position})
+        return queryset[:limit]
+
+    def get_position(self, row):
+        return {'u': row.user.username}
+
+    def parse_position(self, payload):
+        if not isinstance(payload['u'], str):
+            raise ValueError(payload['u'])
+        return payload['u']
+
+
+class SearchPagination(PageSizeMixin, BasePagination):
+    """
+        Offset pagination for ranked search results, which have no `(created_at, id)` order to
+        build keyset cursors on. The depth is capped by `max_offset` so deep pages stay cheap.
+    """
+    offset_query_param = 'offset'
+    max_offset = 1000
+
+    def paginate_ids(self, search, request):
+        """
+            Get the ids of the requested page.
+
+            Args:
+                search (callable): Called with `(limit, offset)`, returns the ids of the results in rank order.
+                request (Request): The request, with the optional `offset` and `page_size` parameters.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        try:
+            self.offset = min(_positive_int(request.query_params.get(self.offset_query_param, 0)), self.max_offset)
+        except ValueError:
+            self.offset = 0
+        ids = search(self.page_size + 1, self.offset)
+        self.has_next = len(ids) > self.page_size and self.offset + self.page_size <= self.max_offset
+        return ids[:self.page_size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.offset_query_param, self.offset + self.page_size)
+
+    def get_previous_link(self):
+        if self.offset <= 0:
+            return None
+        url = self.request.build_absolute_uri()
+        offset = self.offset - self.page_size
+        if offset <= 0:
+            return remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.offset_query_param, offset)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': None,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,31 @@
+"""
+    JSON renderer backed by orjson, selected by `FAST_JSON_RENDERER` in `REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES']`.
+
+    orjson encodes the serialized pages several times faster than the `json` module used by DRF's
+    `JSONRenderer` (`manage.py bench_serialization` measures both on the current data). The output
+    is the same compact UTF-8 JSON; the values orjson does not know (lazy translations, decimals,
+    querysets, ...) go through DRF's own encoder.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+        Render JSON with orjson, or with DRF's renderer when orjson is missing or an indent was asked.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        # the dates go through DRF's encoder too, for its 'Z' suffix of UTC
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
@@ -0,0 +1,123 @@
+"""
+    Read replica routing.
+
+    With `DATABASE_REPLICA_URL` set, the reads of the GET, HEAD and OPTIONS requests (the feed,
+    the post and user listings, ...) go to the `replica` database and every write goes to the
+    primary (`default`). Everything else reads from the primary: the requests that write, the
+    background jobs, the management commands and the reads made inside a transaction.
+
+    A replica lags behind the primary, so a client that just posted, liked or followed could read
+    a state without its write. After a successful write, the reads of that client go to the
+    primary for `REPLICA_STICKY_SECONDS`. The client is recognized by its access token (the pin is
+    kept in the cache, shared by the processes with Redis) and by a cookie, for the clients
+    authenticated by session.
+"""
+import hashlib
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'read_primary'
+PIN_KEY = 'replica-pin:{}'
+
+_read_replica = ContextVar('read_replica', default=False)
+
+
+def reads_from_replica():
+    """
+        Check whether the reads of the current request may go to the replica.
+    """
+    return _read_replica.get()
+
+
+class ReplicaRouter:
+    """
+        Send the reads allowed by `ReplicaMiddleware` to the replica and everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = settings.REPLICA_DATABASE_ALIAS
+        # a transaction reads its own writes
+        if alias and _read_replica.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+
+def pin_key(request):
+    """
+        Get the cache key of the pin of the access token of the request, or None without a token.
+    """
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        return None
+    return PIN_KEY.format(hashlib.sha256(authorization.encode()).hexdigest()[:32])
+
+
+class ReplicaMiddleware:
+    """
+        Let the reads of the safe requests go to the replica, unless the client wrote recently.
+
+        Works under WSGI and ASGI and does nothing without a replica.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.REPLICA_DATABASE_ALIAS:
+            return self.get_response(request)
+
+        key = pin_key(request)
+        pinned = request.COOKIES.get(PIN_COOKIE) or (key is not None and cache.get(key))
+        token = _read_replica.set(request.method in SAFE_METHODS and not pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_replica.reset(token)
+        if self.wrote(request, response):
+            if key is not None:
+                cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+            self.pin(response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.REPLICA_DATABASE_ALIAS:
+            return await self.get_response(request)
+
+        key = pin_key(request)
+        pinned = request.COOKIES.get(PIN_COOKIE) or (key is not None and await cache.aget(key))
+        token = _read_replica.set(request.method in SAFE_METHODS and not pinned)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_replica.reset(token)
+        if self.wrote(request, response):
+            if key is not None:
+                await cache.aset(key, True, settings.REPLICA_STICKY_SECONDS)
+            self.pin(response)
+        return response
+
+    def wrote(self, request, response):
+        # a failed request rolled back its writes
+        return request.method not in SAFE_METHODS and response.status_code < 400
+
+    def pin(self, response):
+        response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax')
@@ -0,0 +1,248 @@
+"""
+    Response cache for the feed and the post listing.
+
+    A page is cached as the ids of its posts plus its pagination links, under a key that embeds
+    the version token of the listing (`feed` of a user or `posts` of an author) and the request
+    URL. Serialized posts are cached apart, under the version token of each post. Invalidation
+    bumps tokens instead of deleting keys, so it is precise and costs one cache write per token:
+
+        - a post is created or deleted: the author's `posts` and the followers' `feed` tokens
+        - a post is updated or liked: the post token
+        - a user follows or unfollows: the user's `feed` token
+        - the hastags of a post change: the `hashtag` token of each added or removed hastag
+        - a user registers, follows or unfollows: the `users` token of the user listing
+
+    The same tokens are the validators of the conditional GETs: the ETag of a page hashes its key
+    and the tokens of its posts, and its Last-Modified is the newest of those tokens, which are
+    timestamps. A client that already has the page gets a 304 without any post being read or
+    serialized.
+
+    With a read replica, a read made right after a write may miss it (see mini_twitter/replicas.py)
+    while the tokens already changed: what it built is not stored nor validated under tokens
+    bumped less than `REPLICA_STICKY_SECONDS` ago, or it would be served once the replica caught up.
+
+    Entries left behind under old tokens are never read again and are evicted by the backend
+    (LRU in memory, `maxmemory-policy allkeys-lru` on Redis) or by `RESPONSE_CACHE_TTL`.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import replicas
+from .models import Follow
+
+BATCH_SIZE = 1000
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def record(kind, result):
+    """
+        Count a cache hit or miss, `result` is 'hit' or 'miss'.
+    """
+    with _stats_lock:
+        _stats[(kind, result)] += 1
+
+
+def stats():
+    """
+        Get the hit/miss counters of this process as {(kind, 'hit'|'miss'): count}.
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _new_token():
+    return str(time.time_ns())
+
+
+def get_tokens(names):
+    """
+        Get the current version token of each name, creating the missing ones.
+
+        Args:
+            names (list): The version names, for example 'feed:1' or 'post:10'.
+
+        Returns:
+            dict: The token of each name.
+    """
+    cache = get_cache()
+    keys = {f'v:{name}': name for name in names}
+    found = cache.get_many(list(keys))
+    tokens = {keys[key]: token for key, token in found.items()}
+    missing = {key: _new_token() for key, name in keys.items() if name not in tokens}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        tokens.update({keys[key]: token for key, token in missing.items()})
+    return tokens
+
+
+def bump(names):
+    """
+        Give a new version token to each name, invalidating everything cached under the old ones.
+    """
+    token = _new_token()
+    names = list(names)
+    for start in range(0, len(names), BATCH_SIZE):
+        get_cache().set_many({f'v:{name}': token for name in names[start:start + BATCH_SIZE]}, timeout=None)
+
+
+def is_settled(token):
+    """
+        Check whether the reads of the current request see the write that set a version token.
+
+        Always true on the primary; a replica may lag behind it for `REPLICA_STICKY_SECONDS`.
+    """
+    if not replicas.reads_from_replica():
+        return True
+    return time.time_ns() - int(token) >= settings.REPLICA_STICKY_SECONDS * 10 ** 9
+
+
+def page_key(listing, request):
+    """
+        Get the cache key of the page requested for a listing, such as 'feed:1' or 'posts:1'.
+    """
+    token = get_tokens([listing])[listing]
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'page:{listing}:{token}:{url}'
+
+
+def post_tokens(ids):
+    return get_tokens([f'post:{pk}' for pk in ids])
+
+
+def get_validators(key, tokens):
+    """
+        Get the validators of a response from the version tokens it was built from.
+
+        Args:
+            key (str): Everything else the body depends on, such as the page key and the format.
+            tokens (dict): The version tokens of the response, by name.
+
+        Returns:
+            tuple: The strong ETag and the Last-Modified time, as a timestamp in seconds.
+    """
+    versions = '|'.join(f'{name}={token}' for name, token in sorted(tokens.items()))
+    etag = f'"{hashlib.md5(f"{key}|{versions}".encode()).hexdigest()}"'
+    return etag, max(int(token) for token in tokens.values()) // 10 ** 9
+
+
+def get_page(key):
+    page = get_cache().get(key) if settings.RESPONSE_CACHE_ENABLED else None
+    record('page', 'miss' if page is None else 'hit')
+    return page
+
+
+def set_page(key, page):
+    if settings.RESPONSE_CACHE_ENABLED:
+        get_cache().set(key, page, settings.RESPONSE_CACHE_TTL)
+
+
+def _post_keys(ids, counts, tokens=None):
+    tokens = tokens or post_tokens(ids)
+    return {pk: f'post:{pk}:{tokens[f"post:{pk}"]}:{int(counts)}' for pk in ids}
+
+
+def get_posts(ids, counts, tokens=None):
+    """
+        Get the serialized posts cached for the given ids, `tokens` are their version tokens if
+        they were already read.
+
+        Returns:
+            tuple: The posts found as {id: data} and the keys to store the missing ones with `set_posts`.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return {}, {}
+    keys = _post_keys(ids, counts, tokens)
+    found = get_cache().get_many(list(keys.values()))
+    posts = {pk: found[key] for pk, key in keys.items() if key in found}
+    with _stats_lock:
+        _stats[('post', 'hit')] += len(posts)
+        _stats[('post', 'miss')] += len(ids) - len(posts)
+    return posts, keys
+
+
+def set_posts(posts, keys=None, counts=False, tokens=None):
+    """
+        Store serialized posts given as {id: data}, under `keys` when they were read before the
+        posts were loaded from the database.
+
+        The posts read from a replica that may not have their last write yet are not stored.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED or not posts:
+        return
+    if replicas.reads_from_replica():
+        tokens = tokens or post_tokens(list(posts))
+        posts = {pk: data for pk, data in posts.items() if is_settled(tokens[f'post:{pk}'])}
+        if not posts:
+            return
+    keys = keys or _post_keys(list(posts), counts, tokens)
+    get_cache().set_many({keys[pk]: data for pk, data in posts.items()}, settings.RESPONSE_CACHE_TTL)
+
+
+def invalidate_post(post_id):
+    """
+        Invalidate the cached payload of a post, after it was updated or liked.
+    """
+    bump([f'post:{post_id}'])
+
+
+def invalidate_post_lists(post):
+    """
+        Invalidate the listings that contain a post, after it was created or deleted.
+    """
+    invalidate_authors([post.user_twitter_id])
+
+
+def invalidate_author_posts(author_ids):
+    """
+        Invalidate the post listings of the given authors only, their followers' feeds are
+        invalidated by the fan-out job.
+    """
+    bump([f'posts:{pk}' for pk in author_ids])
+
+
+def invalidate_authors(author_ids):
+    """
+        Invalidate the post listings and the followers' feeds of the given authors, after they
+        created or deleted posts.
+    """
+    followers = Follow.objects.filter(followee_id__in=author_ids).values_list('follower_id', flat=True).distinct()
+    bump(
+        [f'posts:{pk}' for pk in author_ids]
+        + [f'feed:{pk}' for pk in followers.iterator(chunk_size=BATCH_SIZE)]
+    )
+
+
+def invalidate_feed(user_twitter_id):
+    """
+        Invalidate the cached feed of a user, after they followed or unfollowed someone.
+    """
+    invalidate_feeds([user_twitter_id])
+
+
+def invalidate_feeds(user_twitter_ids):
+    bump([f'feed:{pk}' for pk in user_twitter_ids])
+
+
+def invalidate_users():
+    """
+        Invalidate the user listing, after a user registered, followed or unfollowed someone.
+    """
+    bump(['users'])
+
+
+def invalidate_hashtags(names):
+    """
+        Invalidate the cached post listings of hastags, after posts were tagged or untagged with them.
+    """
+    bump([f'hashtag:{name}' for name in names])
@@ -0,0 +1,124 @@
+"""
+    Ranked full-text search over the title and body of the posts.
+
+    The inverted index is created by the `0010_post_search_index` migration and maintained by the
+    database itself on every insert, update and delete:
+
+        - PostgreSQL: the generated `search_vector` column and its GIN index, ranked with `ts_rank_cd`
+        - SQLite: the `mini_twitter_post_fts` FTS5 table, ranked with `bm25`
+
+    On other backends the search falls back to `icontains` lookups ordered by date.
+
+    SQLite drops the triggers of a table when a migration rebuilds it, so they are recreated
+    after every `migrate` by `ensure_search_triggers`.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Post, StatusEnum
+
+TITLE_WEIGHT = 2.0
+BODY_WEIGHT = 1.0
+
+TOKEN_RE = re.compile(r'\w+')
+
+POSTGRES_SEARCH = """
+    SELECT id FROM mini_twitter_post, websearch_to_tsquery('simple', %s) AS query
+    WHERE search_vector @@ query AND status = %s
+    ORDER BY ts_rank_cd(search_vector, query) DESC, id DESC
+    LIMIT %s OFFSET %s
+"""
+
+SQLITE_SEARCH = f"""
+    SELECT mini_twitter_post.id FROM mini_twitter_post_fts
+    JOIN mini_twitter_post ON mini_twitter_post.id = mini_twitter_post_fts.rowid
+    WHERE mini_twitter_post_fts MATCH %s AND mini_twitter_post.status = %s
+    ORDER BY bm25(mini_twitter_post_fts, {TITLE_WEIGHT}, {BODY_WEIGHT}), mini_twitter_post.id DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+SQLITE_TRIGGERS = {
+    'mini_twitter_post_fts_insert': """
+        CREATE TRIGGER IF NOT EXISTS mini_twitter_post_fts_insert AFTER INSERT ON mini_twitter_post BEGIN
+            INSERT INTO mini_twitter_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+        END
+    """,
+    'mini_twitter_post_fts_delete': """
+        CREATE TRIGGER IF NOT EXISTS mini_twitter_post_fts_delete AFTER DELETE ON mini_twitter_post BEGIN
+            INSERT INTO mini_twitter_post_fts (mini_twitter_post_fts, rowid, title, body)
+            VALUES ('delete', old.id, old.title, old.body);
+        END
+    """,
+    'mini_twitter_post_fts_update': """
+        CREATE TRIGGER IF NOT EXISTS mini_twitter_post_fts_update AFTER UPDATE OF title, body ON mini_twitter_post BEGIN
+            INSERT INTO mini_twitter_post_fts (mini_twitter_post_fts, rowid, title, body)
+            VALUES ('delete', old.id, old.title, old.body);
+            INSERT INTO mini_twitter_post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+        END
+    """,
+}
+
+
+def ensure_search_triggers(connection):
+    """
+        Recreate the SQLite FTS5 triggers missing from the posts table and reindex the posts.
+
+        Returns:
+            list: The names of the triggers that were recreated.
+    """
+    if connection.vendor != 'sqlite':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT type, name FROM sqlite_master WHERE name LIKE 'mini_twitter_post_fts%'")
+        existing = {name for _, name in cursor.fetchall()}
+        if 'mini_twitter_post_fts' not in existing:
+            # the search index migration was not applied yet
+            return []
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        if missing:
+            cursor.execute("INSERT INTO mini_twitter_post_fts (mini_twitter_post_fts) VALUES ('rebuild')")
+    return missing
+
+
+def fts5_query(query):
+    """
+        Turn free text into an FTS5 query that matches all its words, quoting them so the
+        FTS5 operators typed by the user are searched as plain words.
+    """
+    return ' '.join(f'"{token}"' for token in TOKEN_RE.findall(query))
+
+
+def search_post_ids(query, limit, offset=0):
+    """
+        Get the ids of the active posts matching a free text query, best match first.
+
+        Args:
+            query (str): The words to search, all of them must match.
+            limit (int): The maximum number of ids to return.
+            offset (int): The number of best matches to skip.
+
+        Returns:
+            list: The ids of the matching posts.
+    """
+    if not TOKEN_RE.search(query):
+        return []
+
+    if connection.vendor == 'postgresql':
+        sql, params = POSTGRES_SEARCH, [query, StatusEnum.ACTIVE.value, limit, offset]
+    elif connection.vendor == 'sqlite':
+        sql, params = SQLITE_SEARCH, [fts5_query(query), StatusEnum.ACTIVE.value, limit, offset]
+    else:
+        condition = Q()
+        for token in TOKEN_RE.findall(query):
+            condition &= Q(title__icontains=token) | Q(body__icontains=token)
+        posts = Post.objects.active().filter(condition).order_by('-created_at', '-id')
+        return list(posts.values_list('pk', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
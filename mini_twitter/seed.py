@@ -0,0 +1,193 @@
+"""
+    Synthetic social graphs for load tests and benchmarks.
+
+    Real follow graphs are heavy-tailed: a few accounts have most of the followers and most users
+    follow a few dozen accounts. `GraphSeeder` reproduces that shape with Zipf weights: the user
+    of popularity rank `r` is picked as a followee with a weight of `1 / r ** alpha`, and posts are
+    spread over the authors with the same kind of weights, so the celebrity and the fan-out paths of
+    the feed are both exercised.
+
+    Everything is written with `bulk_create` in chunks of `batch_size` rows, each chunk in its own
+    transaction, and all the users share one password hash, so a graph of 100k users and 10M posts
+    is written in minutes instead of hours. The same `seed` always gives the same graph.
+"""
+import random
+import time
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import follows, hashtags, timeline
+from .models import Follow, Post, UserTwitter
+
+BATCH_SIZE = 5000
+DEFAULT_PASSWORD = 'seed-password'
+
+WORDS = (
+    'api async cache coffee data deploy django docker feed follow graph index latency like load '
+    'monday news night python query queue redis release search server shard sql team test timeline '
+    'tweet update weekend work'
+).split()
+HASHTAGS = ('python', 'django', 'news', 'music', 'football', 'travel', 'food', 'tech', 'photo', 'art')
+HASHTAG_PROBABILITY = 0.1
+
+
+class ZipfSampler:
+    """
+        Draw indexes in `range(size)` with a probability proportional to `1 / (index + 1) ** alpha`.
+    """
+
+    def __init__(self, size, alpha, rng):
+        self.rng = rng
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** alpha for rank in range(size)))
+
+    def sample(self):
+        return bisect_left(self.cum_weights, self.rng.random() * self.cum_weights[-1])
+
+
+class GraphSeeder:
+    """
+        Write users, a power-law follow graph and a post history in chunked transactions.
+
+        Args:
+            users (int): Number of users to create.
+            posts (int): Number of posts to create.
+            avg_following (int): Mean number of users followed by a user.
+            alpha (float): Zipf exponent of the popularity of the users, higher is more skewed.
+            days (int): The posts are spread over this many days before now.
+            seed (int or None): Seed of the random generator.
+            prefix (str): Prefix of the usernames, `seed_0`, `seed_1`, ...
+            password (str): Password of all the seeded users.
+            batch_size (int): Rows written per transaction.
+            timelines (bool): Build the materialized timelines once the posts are written.
+            on_progress (callable or None): Called with the seeder and a message after each step.
+    """
+
+    def __init__(self, users, posts, avg_following=50, alpha=1.1, days=30, seed=None, prefix='seed_',
+                 password=DEFAULT_PASSWORD, batch_size=BATCH_SIZE, timelines=True, on_progress=None):
+        self.users = users
+        self.posts = posts
+        self.avg_following = avg_following
+        self.alpha = alpha
+        self.days = days
+        self.rng = random.Random(seed)
+        self.prefix = prefix
+        self.password = password
+        self.batch_size = batch_size
+        self.timelines = timelines
+        self.on_progress = on_progress
+        self.user_ids = []
+        self.written = {'users': 0, 'follows': 0, 'posts': 0, 'timelines': 0}
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def progress(self, message):
+        if self.on_progress:
+            self.on_progress(self, message)
+
+    def run(self):
+        """
+            Write the whole graph.
+
+            Returns:
+                dict: The number of users, follows, posts and timelines written.
+        """
+        self.write_users()
+        # shuffle the ranks so the celebrities are not the first users created
+        self.by_rank = self.user_ids[:]
+        self.rng.shuffle(self.by_rank)
+        self.popularity = ZipfSampler(len(self.by_rank), self.alpha, self.rng)
+        self.write_follows()
+        self.write_posts()
+        if self.timelines:
+            self.write_timelines()
+        return self.written
+
+    def chunks(self, total):
+        for start in range(0, total, self.batch_size):
+            yield range(start, min(start + self.batch_size, total))
+
+    def write_users(self):
+        password = make_password(self.password)
+        now = timezone.now()
+        for chunk in self.chunks(self.users):
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(username=f'{self.prefix}{i}', email=f'{self.prefix}{i}@example.com', password=password, date_joined=now)
+                    for i in chunk
+                ])
+                profiles = UserTwitter.objects.bulk_create([UserTwitter(user_id=user.pk, created_at=now) for user in users])
+            self.user_ids.extend(profile.pk for profile in profiles)
+            self.written['users'] += len(profiles)
+            self.progress(f"{self.written['users']} users")
+
+    def following_count(self):
+        """
+            Draw the number of users a user follows: heavy-tailed, with a mean close to `avg_following`.
+        """
+        return min(len(self.user_ids) - 1, int(self.rng.paretovariate(2) * self.avg_following / 2))
+
+    def write_follows(self):
+        edges = []
+        for follower in self.user_ids:
+            followees = {self.by_rank[self.popularity.sample()] for _ in range(self.following_count())}
+            followees.discard(follower)
+            edges.extend(Follow(follower_id=follower, followee_id=followee) for followee in followees)
+            if len(edges) >= self.batch_size:
+                self.write_edges(edges)
+                edges = []
+        self.write_edges(edges)
+
+        for chunk in self.chunks(len(self.user_ids)):
+            follows.recount_follows(self.user_ids[chunk.start:chunk.stop])
+
+    def write_edges(self, edges):
+        if not edges:
+            return
+        Follow.objects.bulk_create(edges, batch_size=self.batch_size, ignore_conflicts=True)
+        self.written['follows'] += len(edges)
+        self.progress(f"{self.written['follows']} follows")
+
+    def post_text(self):
+        words = self.rng.choices(WORDS, k=self.rng.randint(5, 25))
+        if self.rng.random() < HASHTAG_PROBABILITY:
+            words.insert(self.rng.randrange(len(words) + 1), f'#{self.rng.choice(HASHTAGS)}')
+        return ' '.join(words[:self.rng.randint(2, 6)]).capitalize(), ' '.join(words)
+
+    def write_posts(self):
+        now = timezone.now()
+        period = self.days * 24 * 3600
+        # the most followed users also post the most
+        authors = ZipfSampler(len(self.by_rank), self.alpha / 2, self.rng)
+        for chunk in self.chunks(self.posts):
+            posts = []
+            for _ in chunk:
+                title, body = self.post_text()
+                posts.append(Post(
+                    user_twitter_id=self.by_rank[authors.sample()],
+                    title=title,
+                    body=body,
+                    created_at=now - timedelta(seconds=self.rng.random() * period),
+                ))
+            with transaction.atomic():
+                Post.objects.bulk_create(posts)
+                hashtags.tag_posts(posts)
+            self.written['posts'] += len(posts)
+            self.progress(f"{self.written['posts']} posts")
+
+    def write_timelines(self):
+        # each owner gets up to TIMELINE_MAX_LENGTH entries, so fewer owners are written per transaction
+        for start in range(0, len(self.user_ids), timeline.BATCH_SIZE):
+            owner_ids = self.user_ids[start:start + timeline.BATCH_SIZE]
+            with transaction.atomic():
+                timeline.rebuild_timelines(owner_ids)
+            self.written['timelines'] += len(owner_ids)
+            self.progress(f"{self.written['timelines']} timelines")
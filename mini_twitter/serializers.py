@@ -1,7 +1,58 @@
 from mini_twitter.models import UserTwitter, Post
+from mini_twitter.images import get_variant_urls
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Prefetch, QuerySet, aprefetch_related_objects, prefetch_related_objects
 from rest_framework import serializers
 
+def wants_counts(request):
+    """
+        Check if the request asked for counts instead of id lists with `?counts=true`.
+    """
+    if request is None:
+        return False
+    return request.query_params.get('counts', '').lower() in ('1', 'true')
+
+def eager_load(instances, *lookups):
+    """
+        Prefetch the given lookups on a queryset or on a list of already loaded instances.
+    """
+    if isinstance(instances, QuerySet):
+        return instances.prefetch_related(*lookups)
+    prefetch_related_objects(instances, *lookups)
+    return instances
+
+async def aeager_load(instances, *lookups):
+    """
+        Async version of `eager_load` for a list of already loaded instances.
+    """
+    await aprefetch_related_objects(instances, *lookups)
+    return instances
+
+class CountsModeMixin:
+    """
+        Replace unbounded id lists with their counts when the serializer runs in counts mode.
+
+        Counts mode is enabled with the `counts` context flag or, when the flag is missing,
+        with `?counts=true` on the request. `count_fields` maps each list field to its count field.
+    """
+    count_fields = {}
+
+    @property
+    def counts_mode(self):
+        counts = self.context.get('counts')
+        if counts is None:
+            counts = wants_counts(self.context.get('request'))
+        return counts
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.counts_mode:
+            for list_field, count_field in self.count_fields.items():
+                fields.pop(list_field, None)
+                fields[count_field] = serializers.SerializerMethodField()
+        return fields
+
 class UserSerializer(serializers.ModelSerializer):
     """
         Serializer for Django's built-in User model.
@@ -14,11 +65,12 @@ class UserSerializer(serializers.ModelSerializer):
 
     # aplicando as validações nos dados enviados
 
-class UserTwitterSerializer(serializers.ModelSerializer):
+class UserTwitterSerializer(CountsModeMixin, serializers.ModelSerializer):
     """
         Serializer for the UserTwitter model.
     """
     user = UserSerializer()
+    count_fields = {'followers': 'followers_count', 'following': 'following_count'}
 
     class Meta:
         model = UserTwitter
@@ -29,17 +81,60 @@ class UserTwitterSerializer(serializers.ModelSerializer):
             'following': {'read_only': True}
         }
 
+    @staticmethod
+    def setup_eager_loading(users, counts=False):
+        """
+            Load everything the serializer reads in a fixed number of queries.
+        """
+        if counts:
+            return users.select_related('user')
+        only_ids = UserTwitter.objects.only('id')
+        return users.select_related('user').prefetch_related(
+            Prefetch('followers', queryset=only_ids),
+            Prefetch('following', queryset=only_ids),
+        )
+
+    def get_followers_count(self, obj):
+        return obj.followers_count
+
+    def get_following_count(self, obj):
+        return obj.following_count
+
     # aplicando as validações nos dados enviados
     
 
-class PostSerializer(serializers.ModelSerializer):
+class UserSummarySerializer(serializers.ModelSerializer):
+    """
+        Compact serializer of the users in the directory, with the counts instead of the id lists.
+    """
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = UserTwitter
+        fields = ['id', 'username', 'created_at', 'followers_count', 'following_count']
+        read_only_fields = fields
+
+    @staticmethod
+    def setup_eager_loading(users):
+        """
+            Load only the columns the serializer reads, in a single query.
+        """
+        return users.select_related('user').only(
+            'id', 'created_at', 'followers_count', 'following_count', 'user__username'
+        )
+
+
+class PostSerializer(CountsModeMixin, serializers.ModelSerializer):
     """
         Serializer for the Post model.
     """
+    count_fields = {'likes_users': 'likes_count'}
+    image_variants = serializers.SerializerMethodField()
+    thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'body','image', 'likes', 'status', 'created_at', 'likes_users']
+        fields = ['id', 'title', 'body','image', 'image_variants', 'thumbnail', 'likes', 'status', 'created_at', 'likes_users']
         extra_kwargs = {
             'created_at': {'read_only': True},
             'likes': {'read_only': True},
@@ -47,4 +142,65 @@ class PostSerializer(serializers.ModelSerializer):
             'likes_users': {'read_only': True}
         }
 
+    @staticmethod
+    def setup_eager_loading(posts, counts=False):
+        """
+            Load everything the serializer reads in a fixed number of queries.
+
+            Args:
+                posts (QuerySet or list): The posts to serialize.
+                counts (bool): Whether the serializer runs in counts mode.
+        """
+        if counts:
+            return posts
+        return eager_load(posts, PostSerializer.likes_users_prefetch())
+
+    @staticmethod
+    async def asetup_eager_loading(posts, counts=False):
+        """
+            Async version of `setup_eager_loading` for a list of posts.
+        """
+        if counts:
+            return posts
+        return await aeager_load(posts, PostSerializer.likes_users_prefetch())
+
+    @staticmethod
+    def likes_users_prefetch():
+        return Prefetch('likes_users', queryset=UserTwitter.objects.only('id'))
+
+    def get_likes_count(self, obj):
+        return obj.likes
+
+    def get_image_variants(self, obj):
+        return get_variant_urls(obj)
+
+    def get_thumbnail(self, obj):
+        """
+            URL of the smallest variant of the image, in the first format of `IMAGE_VARIANT_FORMATS`.
+        """
+        variants = get_variant_urls(obj)
+        if not variants:
+            return None
+        formats = variants[min(variants, key=int)]
+        return formats.get(settings.IMAGE_VARIANT_FORMATS[0]) or next(iter(formats.values()))
+
+    def validate_image(self, image):
+        if image and image.size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(f'The image must be at most {settings.IMAGE_MAX_UPLOAD_SIZE / (1024 * 1024):g} MB.')
+        return image
+
     # aplicando as validações nos dados enviados
+
+
+class PostImportSerializer(serializers.ModelSerializer):
+    """
+        Serializer for the posts of the bulk import, validated one NDJSON line at a time.
+        `created_at` is writable so imported posts keep their original date.
+    """
+
+    class Meta:
+        model = Post
+        fields = ['title', 'body', 'created_at']
+        extra_kwargs = {
+            'created_at': {'required': False},
+        }
@@ -0,0 +1,350 @@
+"""
+    Server-sent events stream of the new posts of the followed users, `GET /api/feed/stream/`.
+
+    The stream is a plain ASGI application mounted in front of Django by `setup/asgi.py`: an open
+    stream is a coroutine waiting on the event loop of the worker, without the thread, the request
+    object and the middleware that Django keeps for each request, so a worker holds thousands of
+    idle clients. The database is only read when a client connects and when it has to catch up.
+
+    A post created by `PostViewSet.perform_create` or by the bulk endpoint is published once its
+    transaction commits; the broker hands it to the streams of the followers of its author. The events only notify the
+    client, which reads the post itself from the API:
+
+        id: <post id>
+        event: post
+        data: {"id": <post id>, "author": <user id>, "created_at": "<ISO 8601>"}
+
+        - a comment line is sent every `STREAM_HEARTBEAT_SECONDS` so the proxies keep the
+          connection open and the dead clients are detected
+        - the events waiting for a slow client are bounded by `STREAM_QUEUE_SIZE`; past it they are
+          dropped and the client catches up from the database once it reads again
+        - a client that reconnects with the `Last-Event-ID` header gets the posts it missed, up to
+          `STREAM_REPLAY_LIMIT`; past it a `reset` event tells it to reload its feed
+        - a stream is closed after `STREAM_MAX_SECONDS`, so the follows made since it was opened
+          are picked up when the client reconnects
+
+    With `STREAM_BACKEND = 'memory'` the posts only reach the streams of the process that created
+    them, which is enough for a single worker. `STREAM_BACKEND = 'redis'` publishes them on a
+    channel of the Redis of the default cache, listened to by every worker.
+"""
+import asyncio
+import io
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, transaction
+from rest_framework.exceptions import APIException
+
+from .authentication import UserTwitterJWTAuthentication
+from .models import Follow, Post
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/api/feed/stream/'
+CHANNEL = 'feed-events'
+
+authentication = UserTwitterJWTAuthentication()
+
+
+def post_event(post_id, author_id, created_at):
+    return {'id': post_id, 'author': author_id, 'created_at': created_at.isoformat()}
+
+
+def format_event(event, kind='post'):
+    return f"id: {event['id']}\nevent: {kind}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+class Subscription:
+    """
+        Events waiting to be sent to one stream, filled from any thread and read on its event loop.
+    """
+
+    def __init__(self, authors, size):
+        self.authors = frozenset(authors)
+        self.size = size
+        self.loop = asyncio.get_running_loop()
+        self.events = deque()
+        self.ready = asyncio.Event()
+        self.overflowed = False
+        self.closed = False
+
+    def push(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, event)
+        except RuntimeError:
+            # the loop of the stream is closed
+            pass
+
+    def deliver(self, event):
+        if self.closed:
+            return
+        if len(self.events) >= self.size:
+            self.overflowed = True
+        else:
+            self.events.append(event)
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def wait(self, timeout):
+        """
+            Wait for an event or the end of the stream.
+
+            Returns:
+                bool: False when `timeout` seconds passed without any.
+        """
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.ready.clear()
+        return True
+
+
+class MemoryBroker:
+    """
+        Hand the published posts to the subscriptions of this process that follow their author.
+    """
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscription):
+        with self.lock:
+            for author_id in subscription.authors:
+                self.subscriptions[author_id].add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for author_id in subscription.authors:
+                subscriptions = self.subscriptions.get(author_id)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self.subscriptions[author_id]
+
+    def publish(self, event):
+        self.dispatch(event)
+
+    def dispatch(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(event['author'], ()))
+        for subscription in subscriptions:
+            subscription.push(event)
+
+
+class RedisBroker(MemoryBroker):
+    """
+        Publish the posts on a Redis channel and dispatch the posts of every process to the local
+        subscriptions, from one listener task per process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    @property
+    def channel(self):
+        return cache.make_key(CHANNEL)
+
+    def publish(self, event):
+        try:
+            # the redis-py client of the Django Redis cache backend
+            client = cache._cache.get_client(write=True)
+        except AttributeError:
+            raise ImproperlyConfigured("STREAM_BACKEND = 'redis' needs CACHE_URL to point to a Redis server")
+        try:
+            client.publish(self.channel, json.dumps(event))
+        except Exception:
+            # the streams of this process still get the post
+            logger.exception('Could not publish the post on Redis')
+            self.dispatch(event)
+
+    def subscribe(self, subscription):
+        super().subscribe(subscription)
+        loop = asyncio.get_running_loop()
+        if self.listener is None or self.listener.done() or self.listener.get_loop() is not loop:
+            self.listener = loop.create_task(self.listen())
+
+    async def listen(self):
+        from redis.asyncio import Redis
+
+        while True:
+            try:
+                async with Redis.from_url(settings.CACHE_URL) as client, client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.dispatch(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Lost the Redis channel of the feed streams, reconnecting')
+                await asyncio.sleep(1)
+
+
+memory_broker = MemoryBroker()
+redis_broker = RedisBroker()
+
+
+def get_broker():
+    return redis_broker if settings.STREAM_BACKEND == 'redis' else memory_broker
+
+
+def run_query(function):
+    """
+        Wrap a function reading the database to run it on a thread pool that is not tied to a request.
+
+        With the thread shared by the sync code, one slow catch-up would hold up every other stream and
+        request of the worker. Nothing closes the connections of the pool threads at the end of a request,
+        so they are closed after each call.
+    """
+    def call(*args):
+        try:
+            return function(*args)
+        finally:
+            connections.close_all()
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def publish_post(post):
+    """
+        Publish a new post to the streams of the followers of its author once it is committed.
+    """
+    event = post_event(post.pk, post.user_twitter_id, post.created_at)
+    transaction.on_commit(partial(get_broker().publish, event))
+
+
+def load_followed(user_twitter_id, last_event_id):
+    """
+        Get the ids of the users followed by a user and the id of the last event it has seen: the
+        `Last-Event-ID` of the client or, for a new client, the last post.
+    """
+    authors = list(Follow.objects.filter(follower_id=user_twitter_id).values_list('followee_id', flat=True))
+    if last_event_id is None:
+        last_event_id = Post.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    return authors, last_event_id
+
+
+def load_missed(authors, last_event_id):
+    """
+        Get the events of the posts created by `authors` after `last_event_id`.
+
+        Returns:
+            tuple: The events, oldest first, and None; or an empty list and the id of the last post
+                when more than `STREAM_REPLAY_LIMIT` posts were missed.
+    """
+    posts = Post.objects.active().filter(user_twitter_id__in=authors, pk__gt=last_event_id)
+    missed = list(
+        posts.order_by('pk').values_list('pk', 'user_twitter_id', 'created_at')[:settings.STREAM_REPLAY_LIMIT + 1]
+    )
+    if len(missed) > settings.STREAM_REPLAY_LIMIT:
+        return [], posts.order_by('-pk').values_list('pk', flat=True).first()
+    return [post_event(*post) for post in missed], None
+
+
+async def send_json(send, status, data):
+    headers = [(b'content-type', b'application/json')]
+    if status == 401:
+        headers.append((b'www-authenticate', authentication.authenticate_header(None).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
+
+
+class FeedStream:
+    """
+        ASGI application serving `STREAM_PATH` and passing the other requests to `application`.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != STREAM_PATH:
+            return await self.application(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await send_json(send, 405, {'detail': f"Method \"{scope['method']}\" not allowed."})
+
+        request = ASGIRequest(scope, io.BytesIO())
+        try:
+            if await authentication.aauthenticate(request) is None:
+                return await send_json(send, 401, {'detail': 'Authentication credentials were not provided.'})
+        except APIException as exc:
+            return await send_json(send, exc.status_code, {'detail': exc.detail})
+
+        last_event_id = request.headers.get('Last-Event-ID')
+        last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+        authors, last_event_id = await run_query(load_followed)(request.user_twitter.pk, last_event_id)
+        await self.stream(send, receive, authors, last_event_id)
+
+    async def stream(self, send, receive, authors, last_event_id):
+        broker = get_broker()
+        subscription = Subscription(authors, settings.STREAM_QUEUE_SIZE)
+        # subscribed before the catch-up, so no post falls between the two
+        broker.subscribe(subscription)
+        disconnect = asyncio.get_running_loop().create_task(self.wait_disconnect(receive, subscription))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # nginx would buffer the events otherwise
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        async def write(body):
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        async def catch_up():
+            nonlocal last_event_id, replayed
+            events, reset_id = await run_query(load_missed)(authors, last_event_id)
+            if reset_id is not None:
+                last_event_id = reset_id
+                await write(format_event({'id': reset_id}, 'reset'))
+            # the posts published during the query may also be waiting in the subscription
+            replayed = {event['id'] for event in events}
+            for event in events:
+                last_event_id = event['id']
+                await write(format_event(event))
+
+        replayed = set()
+        deadline = time.monotonic() + settings.STREAM_MAX_SECONDS
+        try:
+            await write(f'retry: {settings.STREAM_RETRY_MS}\n\n'.encode())
+            if authors:
+                await catch_up()
+            while not subscription.closed and time.monotonic() < deadline:
+                timeout = min(settings.STREAM_HEARTBEAT_SECONDS, deadline - time.monotonic())
+                if not await subscription.wait(timeout):
+                    await write(b': ping\n\n')
+                    continue
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    subscription.events.clear()
+                    await catch_up()
+                while subscription.events and not subscription.closed:
+                    event = subscription.events.popleft()
+                    if event['id'] not in replayed:
+                        last_event_id = max(last_event_id, event['id'])
+                        await write(format_event(event))
+            if not subscription.closed:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            broker.unsubscribe(subscription)
+            subscription.close()
+            disconnect.cancel()
+
+    async def wait_disconnect(self, receive, subscription):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        subscription.close()
@@ -0,0 +1,153 @@
+"""
+    Precomputed who-to-follow suggestions.
+
+    The candidates of a user are the users followed by the users they follow (the second degree of
+    the follow graph), ranked by the number of those mutual follows. With `A` the adjacency matrix
+    of the graph, the counts are the row of the user in the sparse product `A @ A`, without the
+    users already followed. The product is computed in the database as a self-join of the `Follow`
+    edges grouped by (owner, candidate), so no edge goes through Python, and the best
+    `SUGGESTIONS_PER_USER` of each user are stored as `FollowSuggestion` rows. The endpoint reads
+    them as one slice of the (owner, -mutuals) index.
+
+        - `manage.py rebuild_suggestions` recomputes the suggestions of every user, in batches; run
+          it periodically (e.g. nightly from cron)
+        - between two rebuilds, a follow or an unfollow enqueues a `suggestions.follow` job that
+          recomputes the suggestions of the follower and refreshes the count of the followed user
+          in the suggestions of the follower's followers. A user that becomes a candidate of those
+          followers only appears after the next rebuild.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, PositiveIntegerField, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import jobs
+from .models import Follow, FollowSuggestion, UserTwitter
+from .timeline import is_celebrity
+
+BATCH_SIZE = 500
+
+
+def rebuild_suggestions(owner_ids):
+    """
+        Recompute the stored suggestions of the given users with a single INSERT ... SELECT.
+
+        Returns:
+            int: The number of suggestions written.
+    """
+    owner_ids = list(owner_ids)
+    if not owner_ids:
+        return 0
+    placeholders = ', '.join(['%s'] * len(owner_ids))
+    edges = Follow._meta.db_table
+    sql = f"""
+        INSERT INTO {FollowSuggestion._meta.db_table} (owner_id, suggested_id, mutuals)
+        SELECT owner_id, suggested_id, mutuals FROM (
+            SELECT followed.follower_id AS owner_id, candidate.followee_id AS suggested_id, COUNT(*) AS mutuals,
+                ROW_NUMBER() OVER (
+                    PARTITION BY followed.follower_id ORDER BY COUNT(*) DESC, candidate.followee_id
+                ) AS position
+            FROM {edges} followed
+            JOIN {edges} candidate ON candidate.follower_id = followed.followee_id
+            WHERE followed.follower_id IN ({placeholders})
+                AND candidate.followee_id <> followed.follower_id
+                AND NOT EXISTS (
+                    SELECT 1 FROM {edges} known
+                    WHERE known.follower_id = followed.follower_id AND known.followee_id = candidate.followee_id
+                )
+            GROUP BY followed.follower_id, candidate.followee_id
+        ) ranked
+        WHERE position <= %s
+    """
+    # the readers see the old suggestions until the new ones are committed
+    with transaction.atomic(), connection.cursor() as cursor:
+        FollowSuggestion.objects.filter(owner_id__in=owner_ids).delete()
+        cursor.execute(sql, [*owner_ids, settings.SUGGESTIONS_PER_USER])
+        return cursor.rowcount
+
+
+def rebuild_all_suggestions(batch_size=BATCH_SIZE):
+    """
+        Recompute the suggestions of every user, `batch_size` users per query.
+
+        Yields:
+            tuple: The number of users and of suggestions written so far, after each batch.
+    """
+    users = written = 0
+    owner_ids = UserTwitter.objects.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for owner_id in owner_ids.iterator(chunk_size=batch_size):
+        batch.append(owner_id)
+        if len(batch) == batch_size:
+            written += rebuild_suggestions(batch)
+            users += len(batch)
+            batch = []
+            yield users, written
+    if batch:
+        written += rebuild_suggestions(batch)
+        users += len(batch)
+        yield users, written
+
+
+def schedule_suggestions_update(owner, author):
+    """
+        Enqueue the update of the suggestions after `owner` followed or unfollowed `author`.
+    """
+    jobs.enqueue(
+        'suggestions.follow',
+        {'owner': owner.pk, 'author': author.pk},
+        key=f'suggestions.follow:{owner.pk}:{author.pk}',
+    )
+
+
+def count_mutuals():
+    # users followed by the owner of the suggestion that follow the suggested user
+    return Coalesce(
+        Subquery(
+            Follow.objects
+            .filter(follower_id=OuterRef('owner_id'), followee__following_edges__followee_id=OuterRef('suggested_id'))
+            .values('follower_id')
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=PositiveIntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def update_suggestions(owner, author):
+    """
+        Update the suggestions changed by a follow or an unfollow of `author` by `owner`.
+
+        The counts are read from the edges instead of being incremented, so a job that runs late
+        or twice leaves the same suggestions.
+    """
+    rebuild_suggestions([owner.pk])
+    if is_celebrity(owner):
+        # too many followers to refresh on each follow, the next rebuild catches up
+        return
+    refreshed = FollowSuggestion.objects.filter(
+        suggested_id=author.pk,
+        owner_id__in=Follow.objects.filter(followee_id=owner.pk).values('follower_id'),
+    )
+    refreshed.update(mutuals=count_mutuals())
+    refreshed.filter(mutuals=0).delete()
+
+
+def get_suggestions(owner):
+    """
+        Get the stored suggestions of a user, most mutual follows first.
+
+        Returns:
+            list: Dicts with the `id`, `username` and `followers_count` of each suggested user and
+                its number of `mutuals`.
+    """
+    suggestions = (
+        FollowSuggestion.objects.filter(owner=owner)
+        .order_by('-mutuals', 'suggested_id')
+        .values_list('suggested_id', 'suggested__user__username', 'suggested__followers_count', 'mutuals')[:settings.SUGGESTIONS_PER_USER]
+    )
+    return [
+        {'id': pk, 'username': username, 'followers_count': followers_count, 'mutuals': mutuals}
+        for pk, username, followers_count, mutuals in suggestions
+    ]
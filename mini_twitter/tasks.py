@@ -0,0 +1,72 @@
+"""
+    Handlers of the background jobs (see mini_twitter/jobs.py), registered when the app is ready.
+
+    The payloads hold ids only: a handler reads the current state of the database, so a job that
+    runs late, twice or after a newer job with the same key still does the right thing.
+"""
+from . import images, likes, response_cache, suggestions, timeline
+from .jobs import register
+from .models import Follow, Post, UserTwitter
+
+
+@register('timeline.fan_out', batch=True)
+def fan_out(payloads):
+    """
+        Push new posts into their followers' timelines and invalidate the followers' feeds.
+    """
+    posts = list(
+        # a post deleted before the job ran is not pushed
+        Post.objects.active().filter(pk__in=[payload['post'] for payload in payloads])
+        .only('id', 'user_twitter_id', 'created_at')
+    )
+    timeline.fan_out_posts(posts)
+    response_cache.invalidate_authors({post.user_twitter_id for post in posts})
+
+
+@register('timeline.follow')
+def update_timeline(payload):
+    """
+        Add or remove the posts of a user in the timeline of a follower, after a follow toggle.
+    """
+    owner = UserTwitter.objects.only('id').filter(pk=payload['owner']).first()
+    author = UserTwitter.objects.only('id', 'followers_count').filter(pk=payload['author']).first()
+    if owner is None or author is None:
+        return
+    # the follow may have been toggled again since the job was enqueued
+    if Follow.objects.filter(follower=owner, followee=author).exists():
+        timeline.add_author_to_timeline(owner, author)
+    else:
+        timeline.remove_author_from_timeline(owner, author)
+    response_cache.invalidate_feed(owner.pk)
+
+
+@register('suggestions.follow')
+def update_suggestions(payload):
+    """
+        Update the who-to-follow suggestions after a follow toggle.
+    """
+    owner = UserTwitter.objects.only('id', 'followers_count').filter(pk=payload['owner']).first()
+    author = UserTwitter.objects.only('id').filter(pk=payload['author']).first()
+    if owner is None or author is None:
+        return
+    suggestions.update_suggestions(owner, author)
+
+
+@register('likes.flush', batch=True)
+def flush_likes(payloads):
+    """
+        Fold the like counter shards of hot posts into `Post.likes`.
+    """
+    post_ids = sorted({payload['post'] for payload in payloads})
+    likes.flush_like_shards(post_ids)
+    for post_id in post_ids:
+        response_cache.invalidate_post(post_id)
+
+
+@register('images.variants')
+def render_variants(payload):
+    """
+        Render the resized variants of the image of a post.
+    """
+    images.generate_variants(payload['post'])
+
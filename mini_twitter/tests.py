@@ -1,3 +1,1751 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import redirect_stderr
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import follows, hashtags, images, ingest, jobs, likes, metrics, replicas, response_cache, streams, throttling
+from .authentication import USER_TWITTER_CLAIM, UserTwitterTokenObtainPairSerializer, active_users
+from .benchmark import Benchmark, compare
+from .models import Follow, FollowSuggestion, HastagBucket, Job, LikeCounterShard, Post, StatusEnum, TimelineEntry, UserTwitter
+from .pagination import FeedPagination
+from .seed import DEFAULT_PASSWORD, GraphSeeder
+from .serializers import PostSerializer, UserTwitterSerializer
+from .suggestions import rebuild_all_suggestions, rebuild_suggestions
+from .timeline import rebuild_timeline
+
+
+class UsersTestCase(TestCase):
+    """
+        Tests over users created by the test, with the caches emptied before each test.
+    """
+    PASSWORD = 'Test-password-1'
+
+    def setUp(self):
+        cache.clear()
+        active_users.clear()
+        throttling.memory_buckets.clear()
+
+    @classmethod
+    def create_user(cls, username):
+        if not hasattr(UsersTestCase, 'hashed_password'):
+            # hashed once, the password hasher is slow by design
+            UsersTestCase.hashed_password = make_password(cls.PASSWORD)
+        user = User.objects.create(username=username, email=f'{username}@example.com', password=UsersTestCase.hashed_password)
+        return UserTwitter.objects.create(user=user)
+
+    def client_for(self, user_twitter):
+        """
+            Get an API client authenticated as the user, without going through the token endpoint.
+        """
+        token = UserTwitterTokenObtainPairSerializer.get_token(user_twitter.user).access_token
+        return APIClient(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+
+class TimelineTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.follower = self.create_user('follower')
+        self.stranger = self.create_user('stranger')
+        self.client = self.client_for(self.follower)
+        self.client.post(f'/api/users/follow/{self.author.pk}/')
+
+    def publish(self, user_twitter, title):
+        response = self.client_for(user_twitter).post('/api/posts/', {'title': title, 'body': 'A post'})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def feed_ids(self):
+        return [post['id'] for post in self.client.get('/api/feed/').json()['results']['data']]
+
+    def timeline_ids(self, owner):
+        return list(TimelineEntry.objects.filter(owner=owner).order_by('-created_at', '-post_id').values_list('post_id', flat=True))
+
+    def test_posts_are_pushed_to_the_followers_timelines(self):
+        first = self.publish(self.author, 'First')
+        second = self.publish(self.author, 'Second')
+        self.publish(self.stranger, 'Not followed')
+
+        self.assertEqual(self.timeline_ids(self.follower), [second, first])
+        self.assertEqual(self.timeline_ids(self.stranger), [])
+        self.assertEqual(self.feed_ids(), [second, first])
+
+    def test_celebrity_posts_are_merged_at_read_time(self):
+        celebrity = self.create_user('celebrity')
+        self.client.post(f'/api/users/follow/{celebrity.pk}/')
+        self.client_for(self.stranger).post(f'/api/users/follow/{celebrity.pk}/')
+
+        with self.settings(TIMELINE_CELEBRITY_THRESHOLD=2):
+            first = self.publish(self.author, 'Pushed')
+            second = self.publish(celebrity, 'Pulled')
+            third = self.publish(self.author, 'Pushed again')
+
+            self.assertEqual(self.timeline_ids(self.follower), [third, first])
+            self.assertEqual(self.feed_ids(), [third, second, first])
+
+    def test_follow_backfills_and_unfollow_removes_the_author(self):
+        post_id = self.publish(self.stranger, 'Before the follow')
+
+        self.client.post(f'/api/users/follow/{self.stranger.pk}/')
+        self.assertEqual(self.timeline_ids(self.follower), [post_id])
+        self.assertEqual(self.feed_ids(), [post_id])
+
+        self.client.post(f'/api/users/follow/{self.stranger.pk}/')
+        self.assertEqual(self.timeline_ids(self.follower), [])
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_timelines_keep_the_newest_entries(self):
+        with self.settings(TIMELINE_MAX_LENGTH=3):
+            post_ids = [self.publish(self.author, f'Post {i}') for i in range(5)]
+            self.assertEqual(self.timeline_ids(self.follower), post_ids[:1:-1])
+            self.assertEqual(rebuild_timeline(self.follower), 3)
+            self.assertEqual(self.timeline_ids(self.follower), post_ids[:1:-1])
+
+
+class KeysetPaginationTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.client = self.client_for(self.author)
+        created_at = timezone.now()
+        # the same creation date for some posts, so the pages must break the ties on the id
+        for i in range(5):
+            Post.objects.create(user_twitter=self.author, title=f'Post {i}', body='A post', created_at=created_at - timedelta(minutes=i // 2))
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [post['id'] for post in page['results']['data']]
+
+    def newest_first(self):
+        return list(Post.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+    def test_next_links_walk_every_post_once(self):
+        page = self.get('/api/posts/?page_size=2')
+        self.assertIsNone(page['previous'])
+        self.assertIsNone(page['count'])
+        seen = self.ids(page)
+        while page['next']:
+            page = self.get(page['next'])
+            seen += self.ids(page)
+        self.assertEqual(seen, self.newest_first())
+
+    def test_new_posts_do_not_shift_the_next_page(self):
+        first = self.get('/api/posts/?page_size=2')
+        Post.objects.create(user_twitter=self.author, title='Newer', body='A post')
+        cache.clear()
+        self.assertEqual(self.ids(self.get(first['next'])), self.newest_first()[3:5])
+
+    def test_previous_link_reads_backwards(self):
+        first = self.get('/api/posts/?page_size=2')
+        second = self.get(first['next'])
+        back = self.get(second['previous'])
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertEqual(self.get(back['next'])['results'], second['results'])
+
+    def test_count_is_opt_in(self):
+        self.assertEqual(self.get('/api/posts/?page_size=2&count=true')['count'], 5)
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ('not-base64!', 'e30', 'eyJ0IjoieCIsImkiOjF9', 'W10'):
+            self.assertEqual(self.client.get(f'/api/posts/?cursor={cursor}').status_code, 404, cursor)
+
+
+class EagerLoadingTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [self.create_user(f'user_{i}') for i in range(4)]
+        for user_twitter in self.users[1:]:
+            follows.toggle_follow(user_twitter, self.users[0].pk)
+        for i in range(4):
+            post = Post.objects.create(user_twitter=self.users[0], title=f'Post {i}', body='A post', likes=i)
+            post.likes_users.add(*self.users[:i])
+
+    def count_queries(self, serializer_class, queryset, counts):
+        with CaptureQueriesContext(connection) as captured:
+            data = serializer_class(serializer_class.setup_eager_loading(queryset, counts), many=True, context={'counts': counts}).data
+        return len(captured), data
+
+    def test_post_pages_take_the_same_queries_whatever_their_size(self):
+        for counts in (False, True):
+            small, _ = self.count_queries(PostSerializer, Post.objects.order_by('pk')[:1], counts)
+            large, data = self.count_queries(PostSerializer, Post.objects.order_by('pk'), counts)
+            self.assertEqual(small, large)
+        self.assertEqual(large, 1)
+
+    def test_user_pages_take_the_same_queries_whatever_their_size(self):
+        for counts in (False, True):
+            small, _ = self.count_queries(UserTwitterSerializer, UserTwitter.objects.order_by('pk')[:1], counts)
+            large, _ = self.count_queries(UserTwitterSerializer, UserTwitter.objects.order_by('pk'), counts)
+            self.assertEqual(small, large)
+        self.assertEqual(large, 1)
+
+    def test_counts_mode_replaces_the_id_lists(self):
+        _, posts = self.count_queries(PostSerializer, Post.objects.order_by('pk'), False)
+        self.assertEqual([sorted(post['likes_users']) for post in posts], [sorted(user.pk for user in self.users[:i]) for i in range(4)])
+        _, posts = self.count_queries(PostSerializer, Post.objects.order_by('pk'), True)
+        self.assertEqual([post['likes_count'] for post in posts], [0, 1, 2, 3])
+        self.assertNotIn('likes_users', posts[0])
+
+        response = self.client_for(self.users[1]).get('/api/users/registration/?counts=true')
+        author = next(user for user in response.json()['results'] if user['user']['username'] == 'user_0')
+        self.assertEqual((author['followers_count'], author['following_count']), (3, 0))
+        self.assertNotIn('followers', author)
+
+
+class LikeTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.users = [self.create_user(f'fan_{i}') for i in range(3)]
+        self.post = Post.objects.create(user_twitter=self.author, title='Liked', body='A post')
+
+    def like(self, user_twitter):
+        response = self.client_for(user_twitter).post(f'/api/posts/{self.post.pk}/like/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_toggle_keeps_the_counter_in_sync(self):
+        for user_twitter in self.users:
+            self.assertEqual(self.like(user_twitter)['message'], 'Post liked successfully')
+        response = self.like(self.users[0])
+        self.assertEqual(response['message'], 'Post unliked successfully')
+        self.assertEqual(response['data']['likes'], 2)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 2)
+        self.assertEqual(set(self.post.likes_users.values_list('pk', flat=True)), {self.users[1].pk, self.users[2].pk})
+
+    def test_a_like_lost_to_a_concurrent_request_is_not_counted(self):
+        with mock.patch.object(likes.PostLike.objects, 'create', side_effect=IntegrityError):
+            self.assertTrue(likes.toggle_like(self.post, self.users[0]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 0)
+
+    @override_settings(LIKE_COUNTER_SHARDS=4, LIKE_HOT_THRESHOLD=1, JOBS_EAGER=False)
+    def test_hot_posts_count_on_shards(self):
+        Post.objects.filter(pk=self.post.pk).update(likes=1)
+        self.assertEqual(self.like(self.users[0])['data']['likes'], 2)
+        self.assertEqual(self.like(self.users[1])['data']['likes'], 3)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+        self.assertEqual(likes.pending_likes(self.post), 2)
+        # one pending flush for the post, however many likes were counted on the shards
+        self.assertEqual(Job.objects.filter(kind='likes.flush').count(), 1)
+
+        self.assertEqual(likes.flush_like_shards([self.post.pk]), 2)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes, likes.pending_likes(self.post)), (3, 0))
+
+    def test_reconcile_repairs_the_counter(self):
+        self.like(self.users[0])
+        Post.objects.filter(pk=self.post.pk).update(likes=10)
+        output = StringIO()
+        call_command('reconcile_likes', stdout=output)
+        self.assertIn('1 posts', output.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+
+    @override_settings(LIKE_COUNTER_SHARDS=4, LIKE_HOT_THRESHOLD=1, JOBS_EAGER=False)
+    def test_reconcile_locks_the_shards_it_drops(self):
+        Post.objects.filter(pk=self.post.pk).update(likes=1)
+        self.like(self.users[0])
+        self.like(self.users[1])
+        shards = LikeCounterShard.objects.select_for_update
+        with mock.patch.object(LikeCounterShard.objects, 'select_for_update', wraps=shards) as lock:
+            self.assertEqual(likes.reconcile_likes([self.post.pk]), 1)
+        lock.assert_called_once_with()
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes, likes.pending_likes(self.post)), (2, 0))
+        # a like counted after the reconcile lands on new shards
+        self.like(self.users[2])
+        self.assertEqual(likes.flush_like_shards([self.post.pk]), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 3)
+
+
+class FollowTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [self.create_user(f'user_{i}') for i in range(3)]
+        self.client = self.client_for(self.users[0])
+
+    def counts(self):
+        return list(UserTwitter.objects.order_by('pk').values_list('followers_count', 'following_count'))
+
+    def test_toggle_keeps_the_edges_and_counters_in_sync(self):
+        self.assertEqual(self.client.post(f'/api/users/follow/{self.users[1].pk}/').json()['message'], 'User followed successfully')
+        self.client.post(f'/api/users/follow/{self.users[2].pk}/')
+        self.client_for(self.users[1]).post(f'/api/users/follow/{self.users[2].pk}/')
+        self.assertEqual(self.counts(), [(0, 2), (1, 1), (2, 0)])
+        self.assertEqual(set(self.users[2].followers.values_list('pk', flat=True)), {self.users[0].pk, self.users[1].pk})
+
+        response = self.client.post(f'/api/users/follow/{self.users[2].pk}/')
+        self.assertEqual(response.json()['message'], 'User unfollowed successfully')
+        self.assertEqual(self.counts(), [(0, 1), (1, 1), (1, 0)])
+        self.assertFalse(Follow.objects.filter(follower=self.users[0], followee=self.users[2]).exists())
+
+    def test_a_follow_lost_to_a_concurrent_request_is_not_counted(self):
+        with mock.patch.object(Follow.objects, 'create', side_effect=IntegrityError):
+            self.assertTrue(follows.toggle_follow(self.users[0], self.users[1].pk))
+        self.assertEqual(self.counts(), [(0, 0), (0, 0), (0, 0)])
+
+    def test_invalid_follows_are_rejected(self):
+        self.assertEqual(self.client.post(f'/api/users/follow/{self.users[0].pk}/').status_code, 400)
+        self.assertEqual(self.client.post('/api/users/follow/999999/').status_code, 400)
+        self.assertEqual(self.counts(), [(0, 0), (0, 0), (0, 0)])
+
+    def test_recount_repairs_the_counters(self):
+        Follow.objects.create(follower=self.users[1], followee=self.users[0])
+        follows.recount_follows([user.pk for user in self.users])
+        self.assertEqual(self.counts(), [(1, 0), (0, 1), (0, 0)])
+
+
+class ResponseCacheTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.follower = self.create_user('follower')
+        self.other = self.create_user('other')
+        self.author_client = self.client_for(self.author)
+        self.client = self.client_for(self.follower)
+        self.client.post(f'/api/users/follow/{self.author.pk}/')
+        self.post_id = self.author_client.post('/api/posts/', {'title': 'Cached', 'body': 'A #cached post'}).json()['id']
+
+    def get(self, client, url):
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache'], response.json()['results']['data']
+
+    def assertInvalidated(self, client, url, event):
+        """
+            Check that `url` is cached, then served again from the database after `event` ran.
+        """
+        self.get(client, url)
+        self.assertEqual(self.get(client, url)[0], 'HIT')
+        event()
+        result, data = self.get(client, url)
+        self.assertEqual(result, 'MISS')
+        return data
+
+    def test_new_post_invalidates_the_author_listing_and_the_followers_feeds(self):
+        def publish():
+            self.author_client.post('/api/posts/', {'title': 'Fresh', 'body': 'New post'})
+
+        self.assertEqual(self.assertInvalidated(self.client, '/api/feed/', publish)[0]['title'], 'Fresh')
+        self.assertEqual(self.assertInvalidated(self.author_client, '/api/posts/', publish)[0]['title'], 'Fresh')
+
+    def test_like_and_update_refresh_the_cached_post(self):
+        self.get(self.client, '/api/feed/')
+        self.client.post(f'/api/posts/{self.post_id}/like/')
+        result, data = self.get(self.client, '/api/feed/')
+        # the page itself is still cached, only the post is read again
+        self.assertEqual((result, data[0]['likes']), ('HIT', 1))
+
+        self.author_client.patch(f'/api/posts/{self.post_id}/', {'body': 'Edited'})
+        self.assertEqual(self.get(self.client, '/api/feed/')[1][0]['body'], 'Edited')
+
+    def test_post_updated_while_the_page_loads_is_not_cached_stale(self):
+        paginate = FeedPagination.paginate_queryset
+
+        def paginate_then_update(paginator, *args, **kwargs):
+            posts = paginate(paginator, *args, **kwargs)
+            # the post is edited after the page read it, before it is serialized and cached
+            self.author_client.patch(f'/api/posts/{self.post_id}/', {'body': 'Edited'})
+            return posts
+
+        with mock.patch.object(FeedPagination, 'paginate_queryset', paginate_then_update):
+            self.assertEqual(self.get(self.client, '/api/feed/')[1][0]['body'], 'Edited')
+        result, data = self.get(self.client, '/api/feed/')
+        self.assertEqual((result, data[0]['body']), ('HIT', 'Edited'))
+
+    def test_follow_and_unfollow_invalidate_the_feed(self):
+        self.assertEqual(self.assertInvalidated(
+            self.client, '/api/feed/', lambda: self.client.post(f'/api/users/follow/{self.author.pk}/'),
+        ), [])
+
+    def test_delete_invalidates_the_listings(self):
+        def delete():
+            self.author_client.delete(f'/api/posts/{self.post_id}/')
+
+        self.get(self.client, '/api/hashtags/cached/posts/')
+        self.assertEqual(self.assertInvalidated(self.client, '/api/feed/', delete), [])
+        self.assertEqual(self.get(self.client, '/api/hashtags/cached/posts/'), ('MISS', []))
+
+    def test_other_users_keep_their_cached_pages(self):
+        other = self.client_for(self.other)
+        self.get(other, '/api/feed/')
+        self.author_client.post('/api/posts/', {'title': 'Fresh', 'body': 'New post'})
+        self.assertEqual(self.get(other, '/api/feed/')[0], 'HIT')
+
+    def test_disabled(self):
+        with self.settings(RESPONSE_CACHE_ENABLED=False):
+            self.get(self.client, '/api/feed/')
+            self.assertEqual(self.get(self.client, '/api/feed/')[0], 'MISS')
+
+    @override_settings(REPLICA_STICKY_SECONDS=60)
+    def test_replica_reads_right_after_a_write_are_not_cached(self):
+        later = time.time_ns() + 61 * 10 ** 9
+        with mock.patch('mini_twitter.replicas.reads_from_replica', return_value=True):
+            # the post just bumped the feed and post tokens, the replica may not have it yet
+            response = self.client.get('/api/feed/')
+            self.assertEqual((response['X-Cache'], response.has_header('ETag')), ('MISS', False))
+            self.assertEqual(self.get(self.client, '/api/feed/')[0], 'MISS')
+            self.assertEqual(response_cache.get_posts([self.post_id], False)[0], {})
+
+            with mock.patch('mini_twitter.response_cache.time.time_ns', return_value=later):
+                response = self.client.get('/api/feed/')
+                self.assertTrue(response.has_header('ETag'))
+                self.assertEqual(self.get(self.client, '/api/feed/')[0], 'HIT')
+                self.assertEqual(list(response_cache.get_posts([self.post_id], False)[0]), [self.post_id])
+
+
+class JWTClaimsAuthenticationTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user_twitter = self.create_user('member')
+        self.client = self.client_for(self.user_twitter)
+
+    def user_queries(self, client):
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get('/api/users/suggestions/')
+        tables = (User._meta.db_table, UserTwitter._meta.db_table)
+        return response.status_code, sum(any(table in query['sql'] for table in tables) for query in captured)
+
+    def test_token_carries_the_user_twitter_id(self):
+        response = APIClient().post('/api/token/', {'username': 'member', 'password': self.PASSWORD})
+        token = AccessToken(response.json()['access'])
+        self.assertEqual(token[USER_TWITTER_CLAIM], self.user_twitter.pk)
+
+    def test_active_users_are_checked_once_per_ttl(self):
+        first, cached = self.user_queries(self.client), self.user_queries(self.client)
+        self.assertEqual((first[0], cached[0]), (200, 200))
+        self.assertEqual(first[1] - cached[1], 1)
+
+    def test_revoked_users_are_rejected_after_the_ttl(self):
+        self.user_queries(self.client)
+        User.objects.filter(pk=self.user_twitter.user_id).update(is_active=False)
+        # still cached as active
+        self.assertEqual(self.user_queries(self.client)[0], 200)
+
+        with self.settings(AUTH_CACHE_TTL=0):
+            active_users.clear()
+            self.assertEqual(self.user_queries(self.client)[0], 401)
+            User.objects.filter(pk=self.user_twitter.user_id).update(is_active=True)
+            self.assertEqual(self.user_queries(self.client)[0], 200)
+
+    def test_tokens_without_the_claim_look_the_user_up(self):
+        token = AccessToken.for_user(self.user_twitter.user)
+        client = APIClient(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertNotIn(USER_TWITTER_CLAIM, token)
+        response = client.get('/api/posts/')
+        self.assertEqual(response.status_code, 200)
+
+        self.user_twitter.delete()
+        active_users.clear()
+        self.assertEqual(client.get('/api/posts/').status_code, 401)
+
+
+class AsyncViewsTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.follower = self.create_user('follower')
+        self.client = self.client_for(self.follower)
+        self.client.post(f'/api/users/follow/{self.author.pk}/')
+        author = self.client_for(self.author)
+        self.post_ids = [author.post('/api/posts/', {'title': f'Post {i}', 'body': 'A post'}).json()['id'] for i in range(3)]
+
+    def call(self, view, method, path, *args, **headers):
+        request = getattr(RequestFactory(), method)(
+            path, HTTP_AUTHORIZATION=self.client.defaults['HTTP_AUTHORIZATION'], **headers,
+        )
+        return async_to_sync(view)(request, *args)
+
+    def test_responses_match_the_drf_views(self):
+        from .async_views import feed, post_list
+
+        for view, path in ((feed, '/api/feed/?page_size=2'), (post_list, '/api/posts/?page_size=2&counts=true')):
+            expected = self.client.get(path)
+            cache.clear()
+            response = self.call(view, 'get', path)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), expected.json())
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertEqual(self.call(view, 'get', path)['X-Cache'], 'HIT')
+
+    def test_post_updated_while_the_page_loads_is_not_cached_stale(self):
+        from .async_views import feed
+
+        paginate = FeedPagination.apaginate_queryset
+
+        def edit():
+            Post.objects.filter(pk=self.post_ids[-1]).update(body='Edited')
+            response_cache.invalidate_post(self.post_ids[-1])
+
+        async def paginate_then_update(paginator, *args, **kwargs):
+            posts = await paginate(paginator, *args, **kwargs)
+            # the post is edited after the page read it, before it is serialized and cached
+            await sync_to_async(edit)()
+            return posts
+
+        with mock.patch.object(FeedPagination, 'apaginate_queryset', paginate_then_update):
+            self.call(feed, 'get', '/api/feed/')
+        response = self.call(feed, 'get', '/api/feed/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(response.content)['results']['data'][0]['body'], 'Edited')
+
+    def test_middleware_runs_on_the_event_loop(self):
+        # a sync-only middleware would make Django run the async views in a thread
+        sync_only = [
+            path for path in settings.MIDDLEWARE
+            if not getattr(import_string(path), 'async_capable', False)
+        ]
+        self.assertEqual(sync_only, [])
+
+    def test_like_toggles(self):
+        from .async_views import post_like
+
+        path = f'/api/posts/{self.post_ids[0]}/like/'
+        self.assertEqual(json.loads(self.call(post_like, 'post', path, self.post_ids[0]).content)['data']['likes'], 1)
+        self.assertEqual(json.loads(self.call(post_like, 'post', path, self.post_ids[0]).content)['data']['likes'], 0)
+        self.assertEqual(self.call(post_like, 'post', '/api/posts/0/like/', 0).status_code, 400)
+
+    def test_requests_without_a_token_are_rejected(self):
+        from .async_views import feed
+
+        response = async_to_sync(feed)(RequestFactory().get('/api/feed/'))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+
+@override_settings(HASHTAG_TRENDING_CACHE_TTL=0, HASHTAG_TRENDING_WINDOW=24)
+class HashtagTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.client = self.client_for(self.author)
+
+    def publish(self, title, body, created_at=None):
+        post = Post.objects.create(user_twitter=self.author, title=title, body=body, created_at=created_at or timezone.now())
+        hashtags.set_post_hashtags(post)
+        return post
+
+    def trending(self):
+        return [(tag['name'], tag['count']) for tag in self.client.get('/api/hashtags/trending/').json()['data']]
+
+    def test_extraction(self):
+        self.assertEqual(
+            hashtags.extract_hashtags('#Django and #django_5, not a#tag, ##double or #2024', '(#Python) #'),
+            {'django', 'django_5', 'python'},
+        )
+
+    def test_posts_are_tagged_on_create_and_update(self):
+        post_id = self.client.post('/api/posts/', {'title': 'Tagged', 'body': '#One #Two'}).json()['id']
+        self.assertEqual(set(Post.objects.get(pk=post_id).hastags.values_list('name', flat=True)), {'one', 'two'})
+
+        self.client.patch(f'/api/posts/{post_id}/', {'body': '#two #three'})
+        self.assertEqual(set(Post.objects.get(pk=post_id).hastags.values_list('name', flat=True)), {'two', 'three'})
+        self.assertEqual(dict(self.trending()), {'two': 1, 'three': 1})
+
+        response = self.client.get('/api/hashtags/%23THREE/posts/')
+        self.assertEqual([post['id'] for post in response.json()['results']['data']], [post_id])
+
+    def test_trending_counts_the_window_only(self):
+        now = timezone.now()
+        for _ in range(3):
+            self.publish('Hot', '#hot')
+        self.publish('Warm', '#warm #hot', now - timedelta(hours=23))
+        self.publish('Old', '#old #old', now - timedelta(hours=30))
+        self.assertEqual(self.trending(), [('hot', 4), ('warm', 1)])
+
+        self.assertEqual(hashtags.prune_buckets(), 1)
+        self.assertFalse(HastagBucket.objects.filter(bucket__lt=now - timedelta(hours=24)).exists())
+
+    def test_deleted_posts_leave_the_trending_counts(self):
+        post_id = self.client.post('/api/posts/', {'title': 'Gone', 'body': '#gone'}).json()['id']
+        self.publish('Kept', '#kept')
+        self.client.delete(f'/api/posts/{post_id}/')
+        self.assertEqual(self.trending(), [('kept', 1)])
+
+    def test_imported_posts_are_counted_in_batch(self):
+        posts = [Post.objects.create(user_twitter=self.author, title=f'Post {i}', body='#bulk #Batch') for i in range(3)]
+        self.assertEqual(hashtags.tag_posts(posts), {'bulk', 'batch'})
+        self.assertEqual(self.trending(), [('batch', 3), ('bulk', 3)])
+
+
+class SearchTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.client = self.client_for(self.author)
+
+    def publish(self, title, body):
+        return Post.objects.create(user_twitter=self.author, title=title, body=body).pk
+
+    def search(self, query, **params):
+        response = self.client.get('/api/posts/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, query):
+        return [post['id'] for post in self.search(query)['results']['data']]
+
+    def test_title_matches_rank_first(self):
+        in_body = self.publish('Weekend', 'Hiking in the mountains')
+        in_title = self.publish('Mountains', 'A weekend away')
+        self.publish('Beach', 'Sun and sand')
+        self.assertEqual(self.ids('mountains'), [in_title, in_body])
+
+    def test_every_word_must_match(self):
+        both = self.publish('Django tips', 'Query optimization')
+        self.publish('Django news', 'A release')
+        self.assertEqual(self.ids('django optimization'), [both])
+        # the operators of the search syntax are searched as plain words
+        self.assertEqual(self.ids('django AND "optimization'), [])
+        self.assertEqual(self.ids('***'), [])
+
+    def test_updates_and_inactive_posts(self):
+        post_id = self.publish('Zebra', 'Stripes')
+        post = Post.objects.get(pk=post_id)
+        post.title = 'Okapi'
+        post.save()
+        self.assertEqual((self.ids('zebra'), self.ids('okapi')), ([], [post_id]))
+
+        Post.objects.filter(pk=post_id).update(status=StatusEnum.INACTIVE.value)
+        self.assertEqual(self.ids('okapi'), [])
+
+    def test_results_are_paginated_by_offset(self):
+        post_ids = {self.publish(f'Match {i}', 'paginated') for i in range(7)}
+        first = self.search('paginated', page_size=5)
+        second = self.client.get(first['next']).json()
+        self.assertIsNone(second['next'])
+        seen = [post['id'] for page in (first, second) for post in page['results']['data']]
+        self.assertEqual((len(seen), set(seen)), (7, post_ids))
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/api/posts/search/?q=%20').status_code, 400)
+
+
+class BulkImportTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.client = self.client_for(self.author)
+
+    def ndjson(self, *records):
+        return ''.join((record if isinstance(record, str) else json.dumps(record)) + '\n' for record in records)
+
+    def bulk(self, body):
+        return self.client.generic('POST', '/api/posts/bulk/', body, content_type='application/x-ndjson')
+
+    def test_invalid_lines_are_reported(self):
+        body = self.ndjson({'title': 'Kept', 'body': '#bulk'}, 'not json', '[1]', {'body': 'No title'}, '', {'title': 'Also kept', 'body': 'Text'})
+        response = self.bulk(body)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertEqual((data['created'], data['errors_count']), (2, 3))
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3, 4])
+        self.assertEqual(set(Post.objects.values_list('title', flat=True)), {'Kept', 'Also kept'})
+
+    def test_nothing_written_is_a_bad_request(self):
+        for body in ('', self.ndjson('not json'), self.ndjson({'type': 'user', 'username': 'eve'})):
+            with self.subTest(body=body):
+                response = self.bulk(body)
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(User.objects.filter(username='eve').exists())
+
+    @override_settings(BULK_MAX_RECORDS=2)
+    def test_records_are_limited(self):
+        data = self.bulk(self.ndjson(*({'title': f'Post {i}', 'body': 'Text'} for i in range(4)))).json()['data']
+        self.assertEqual((data['created'], data['errors_count']), (2, 1))
+
+    def test_graph_import_can_be_replayed(self):
+        lines = self.ndjson(
+            {'type': 'user', 'username': 'alice', 'password_hash': '!'},
+            {'type': 'user', 'username': 'bob', 'password_hash': '!'},
+            {'type': 'user', 'username': 'author'},
+            {'type': 'follow', 'follower': 'alice', 'followee': 'bob'},
+            {'type': 'follow', 'follower': 'alice', 'followee': 'alice'},
+            {'type': 'post', 'user': 'bob', 'title': 'Hello', 'body': '#replay'},
+        ).splitlines()
+
+        first = ingest.Importer(batch_size=2).run(lines)
+        self.assertEqual((first.written['users'], first.written['follows'], first.written['posts']), (2, 1, 1))
+        self.assertEqual(first.error_count, 1)
+        alice = UserTwitter.objects.get(user__username='alice')
+        self.assertEqual(list(TimelineEntry.objects.filter(owner=alice).values_list('post__title', flat=True)), ['Hello'])
+
+        # users and follows are skipped the second time, posts have no natural key and are added again
+        second = ingest.Importer(batch_size=2).run(lines)
+        self.assertEqual((second.written['users'], second.written['follows'], second.written['posts']), (0, 0, 1))
+        self.assertEqual((alice.following.count(), UserTwitter.objects.get(pk=alice.pk).following_count), (1, 1))
+        self.assertEqual(TimelineEntry.objects.filter(owner=alice).count(), 2)
+
+
+class ImageVariantsTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media.name, IMAGE_VARIANT_WIDTHS=[32, 64, 1000], IMAGE_VARIANT_FORMATS=['webp', 'jpeg'],
+        ))
+        self.author = self.create_user('author')
+        self.client = self.client_for(self.author)
+
+    def upload(self, name, size=(100, 50), mode='RGB'):
+        buffer = BytesIO()
+        Image.new(mode, size).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def variant_files(self, post):
+        return {name for formats in post.image_variants.values() for name in formats.values()}
+
+    def test_upload_writes_the_variants(self):
+        response = self.client.post('/api/posts/', {'title': 'Photo', 'body': 'Text', 'image': self.upload('photo.png')}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        post = Post.objects.get(pk=response.json()['id'])
+        # the widths larger than the image are skipped
+        self.assertEqual(post.image_variants, {
+            width: {extension: images.variant_name(post.image.name, width, extension) for extension in ('webp', 'jpeg')}
+            for width in ('32', '64')
+        })
+        for name in self.variant_files(post):
+            with post.image.storage.open(name) as file, Image.open(file) as image:
+                self.assertEqual(image.format, 'WEBP' if name.endswith('.webp') else 'JPEG')
+                self.assertEqual(image.width, int(name.rsplit('_', 1)[1].split('w.')[0]))
+
+        data = self.client.get(f'/api/posts/{post.pk}/').json()
+        self.assertEqual(set(data['image_variants']), {'32', '64'})
+        self.assertTrue(data['thumbnail'].endswith(images.variant_name(post.image.name, 32, 'webp')))
+
+    def test_small_images_keep_one_variant(self):
+        variants = images.render_variants(self.upload('tiny.png', size=(10, 10), mode='RGBA'), [32, 64], ['jpeg'])
+        self.assertEqual(list(variants), [32])
+        with Image.open(BytesIO(variants[32]['jpeg'])) as image:
+            self.assertEqual(image.size, (10, 10))
+
+    def test_replaced_image_drops_the_old_variants(self):
+        post = Post.objects.create(user_twitter=self.author, title='Photo', body='Text', image=self.upload('first.png'))
+        self.assertEqual(images.generate_variants(post.pk), 4)
+        post.refresh_from_db()
+        old = self.variant_files(post)
+
+        post.image = self.upload('second.png')
+        post.save()
+        # until the new variants are written, the old ones are not served for the new image
+        self.assertEqual(images.get_variant_urls(post), {})
+
+        self.assertEqual(images.generate_variants(post.pk), 4)
+        post.refresh_from_db()
+        storage = post.image.storage
+        self.assertFalse(any(storage.exists(name) for name in old))
+        self.assertTrue(all(storage.exists(name) for name in self.variant_files(post)))
+
+    def test_posts_without_image(self):
+        post = Post.objects.create(user_twitter=self.author, title='Text only', body='Text')
+        self.assertEqual(images.generate_variants(post.pk), 0)
+        self.assertEqual(images.generate_variants(0), 0)
+        self.assertEqual(images.get_variant_urls(post), {})
+
+
+@override_settings(JOBS_EAGER=False, JOBS_RETRY_BACKOFF=10, JOBS_LOCK_TIMEOUT=600)
+class JobQueueTest(UsersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        self.enterContext(mock.patch.dict(jobs._handlers))
+        # the failures are expected, keep their tracebacks out of the test output
+        self.enterContext(mock.patch.object(jobs, 'logger'))
+        jobs.register('test.record')(self.calls.append)
+        jobs.register('test.batch', batch=True)(self.calls.append)
+        jobs.register('test.fail')(self.fail_job)
+
+    def fail_job(self, payload):
+        raise RuntimeError(f'failed {payload}')
+
+    def make_ready(self):
+        Job.objects.filter(status=jobs.PENDING).update(run_at=timezone.now())
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        job = jobs.enqueue('test.fail', {'n': 1}, max_attempts=2)
+        before = timezone.now()
+        self.assertEqual(jobs.run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (jobs.PENDING, 1, ''))
+        self.assertIn("failed {'n': 1}", job.last_error)
+        self.assertTrue(before + timedelta(seconds=5) <= job.run_at <= timezone.now() + timedelta(seconds=10))
+        # not ready before its backoff
+        self.assertEqual(jobs.run_pending(), (0, 0))
+
+        self.make_ready()
+        self.assertEqual(jobs.run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (jobs.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+        self.make_ready()
+        self.assertEqual(jobs.run_pending(), (0, 0))
+
+    def test_backoff_is_exponential_and_capped(self):
+        with mock.patch('mini_twitter.jobs.random.uniform', return_value=1.0):
+            self.assertEqual([jobs.get_backoff(attempts) for attempts in (1, 2, 3, 20)], [10, 20, 40, jobs.MAX_BACKOFF])
+        self.assertTrue(5 <= jobs.get_backoff(1) <= 10)
+
+    def test_idempotency_key(self):
+        first = jobs.enqueue('test.record', {'n': 1}, key='record')
+        self.assertIsNone(jobs.enqueue('test.record', {'n': 2}, key='record'))
+        self.assertEqual(jobs.run_pending(), (1, 0))
+        self.assertEqual(self.calls, [{'n': 1}])
+
+        # the key is free again once the job ran
+        second = jobs.enqueue('test.record', {'n': 3}, key='record')
+        self.assertNotEqual(second.pk, first.pk)
+        self.assertEqual(jobs.run_pending(), (1, 0))
+        self.assertEqual(self.calls, [{'n': 1}, {'n': 3}])
+
+    def test_retried_job_gives_up_its_key_to_a_newer_job(self):
+        job = jobs.enqueue('test.fail', {'n': 1}, key='fail')
+        claimed = jobs.claim('worker', 10)
+        newer = jobs.enqueue('test.fail', {'n': 2}, key='fail')
+        jobs.run_jobs(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.idempotency_key), (jobs.PENDING, None))
+        self.assertEqual(Job.objects.get(pk=newer.pk).idempotency_key, 'fail')
+
+    def test_batch_handlers_run_once_per_batch(self):
+        for n in range(3):
+            jobs.enqueue('test.batch', {'n': n})
+            jobs.enqueue('test.record', {'n': n})
+        self.assertEqual(jobs.run_pending(limit=10), (6, 0))
+        self.assertEqual(self.calls.count([{'n': 0}, {'n': 1}, {'n': 2}]), 1)
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(Job.objects.filter(status=jobs.DONE).count(), 6)
+
+    def test_stale_locks_are_claimed_again(self):
+        job = jobs.enqueue('test.record', {'n': 1})
+        self.assertEqual([claimed.pk for claimed in jobs.claim('first', 10)], [job.pk])
+        self.assertEqual(jobs.claim('second', 10), [])
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=601))
+        claimed = jobs.claim('second', 10)
+        self.assertEqual([(claimed_job.pk, claimed_job.locked_by, claimed_job.attempts) for claimed_job in claimed], [(job.pk, 'second', 2)])
+
+    def test_unknown_kinds(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('test.unknown', {})
+        job = Job.objects.create(kind='test.unknown')
+        self.assertEqual(jobs.run_pending(), (0, 1))
+        self.assertIn('LookupError', Job.objects.get(pk=job.pk).last_error)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_run_inline(self):
+        self.assertIsNone(jobs.enqueue('test.record', {'n': 1}))
+        self.assertIsNone(jobs.enqueue('test.fail', {'n': 2}))
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertFalse(Job.objects.exists())
+
+    def test_posts_are_committed_with_their_jobs(self):
+        client = self.client_for(self.create_user('author'))
+        with mock.patch('mini_twitter.images.schedule_variants', side_effect=RuntimeError('storage down')):
+            with self.assertRaises(RuntimeError):
+                client.post('/api/posts/', {'title': 'Lost', 'body': 'Never committed'})
+        # the fan-out job enqueued before the failure is rolled back with the post
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+        self.assertEqual(client.post('/api/posts/', {'title': 'Kept', 'body': 'Committed'}).status_code, 201)
+        self.assertEqual(list(Job.objects.values_list('kind', flat=True)), ['timeline.fan_out'])
+
+    def test_prune_finished_jobs(self):
+        old = timezone.now() - timedelta(hours=80)
+        Job.objects.create(kind='test.record', status=jobs.DONE, finished_at=old)
+        Job.objects.create(kind='test.record', status=jobs.FAILED, finished_at=old)
+        recent = Job.objects.create(kind='test.record', status=jobs.DONE, finished_at=timezone.now())
+        pending = Job.objects.create(kind='test.record', created_at=old)
+        self.assertEqual(jobs.prune(), 2)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {recent.pk, pending.pk})
+
+
+class SeededGraphTestCase(UsersTestCase):
+    """
+        Tests over a small seeded graph, with the caches emptied before each test.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.written = GraphSeeder(users=60, posts=600, avg_following=8, seed=1, batch_size=50).run()
+
+
+class SeedGraphTest(SeededGraphTestCase):
+
+    def test_writes_the_requested_graph(self):
+        self.assertEqual(self.written['users'], 60)
+        self.assertEqual(self.written['posts'], 600)
+        self.assertEqual(UserTwitter.objects.count(), 60)
+        self.assertEqual(Post.objects.count(), 600)
+        self.assertEqual(Follow.objects.count(), self.written['follows'])
+        self.assertFalse(Follow.objects.filter(follower_id=F('followee_id')).exists())
+
+    def test_follow_counters_match_the_edges(self):
+        for user in UserTwitter.objects.all():
+            self.assertEqual(user.followers_count, Follow.objects.filter(followee=user).count())
+            self.assertEqual(user.following_count, Follow.objects.filter(follower=user).count())
+
+    def test_followers_are_heavy_tailed(self):
+        counts = sorted(UserTwitter.objects.values_list('followers_count', flat=True), reverse=True)
+        # the most followed user has several times the followers of the median user
+        self.assertGreater(counts[0], 4 * max(1, counts[len(counts) // 2]))
+
+    def test_timelines_match_a_rebuild(self):
+        owner = UserTwitter.objects.order_by('-following_count').first()
+        seeded = list(TimelineEntry.objects.filter(owner=owner).order_by('-created_at', '-post_id').values_list('post_id', flat=True))
+        self.assertTrue(seeded)
+        rebuild_timeline(owner)
+        rebuilt = list(TimelineEntry.objects.filter(owner=owner).order_by('-created_at', '-post_id').values_list('post_id', flat=True))
+        self.assertEqual(seeded, rebuilt)
+
+    def test_same_seed_gives_the_same_graph(self):
+        edges = sorted(Follow.objects.values_list('follower__user__username', 'followee__user__username'))
+        GraphSeeder(users=60, posts=0, avg_following=8, seed=1, prefix='again_', timelines=False).run()
+        again = sorted(
+            (follower.replace('again_', 'seed_'), followee.replace('again_', 'seed_'))
+            for follower, followee in Follow.objects.filter(follower__user__username__startswith='again_')
+            .values_list('follower__user__username', 'followee__user__username')
+        )
+        self.assertEqual(edges, again)
+
+    def test_command_refuses_an_existing_prefix(self):
+        with self.assertRaises(CommandError):
+            call_command('seed_graph', '--users', '2', '--posts', '0', stdout=StringIO())
+
+
+class BenchmarkTest(SeededGraphTestCase):
+
+    def run_benchmark(self, scenarios=('feed', 'list', 'like', 'follow')):
+        return Benchmark(requests=5, warmup=1, seed=1).run(scenarios)
+
+    def test_reports_every_scenario_and_rolls_back(self):
+        likes = sorted(Post.objects.values_list('pk', 'likes'))
+        follows = Follow.objects.count()
+
+        results = self.run_benchmark(('feed', 'list', 'like', 'follow', 'registration'))
+
+        self.assertEqual(set(results['scenarios']), {'feed', 'list', 'like', 'follow', 'registration'})
+        for stats in results['scenarios'].values():
+            self.assertEqual(stats['requests'], 5)
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+            self.assertGreater(stats['rps'], 0)
+        self.assertGreater(results['scenarios']['like']['max_queries'], 0)
+        self.assertEqual(sorted(Post.objects.values_list('pk', 'likes')), likes)
+        self.assertEqual(Follow.objects.count(), follows)
+        self.assertEqual(UserTwitter.objects.count(), 60)
+
+    def test_compare_flags_regressions(self):
+        results = self.run_benchmark(('feed', 'like'))
+        self.assertEqual(compare(results, results), [])
+
+        baseline = json.loads(json.dumps(results))
+        baseline['scenarios']['like']['max_queries'] -= 1
+        baseline['scenarios']['feed']['p95_ms'] = results['scenarios']['feed']['p95_ms'] / 10
+        regressions = compare(results, baseline, tolerance=0.5)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('feed: p95'))
+        self.assertTrue(regressions[1].startswith('like: '))
+
+    def test_command_fails_on_regression(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            options = ['--scenario', 'like', '-n', '5', '--warmup', '1', '--baseline', path]
+            call_command('benchmark', *options, '--save-baseline', stdout=StringIO())
+
+            call_command('benchmark', *options, '--tolerance', '100', stdout=StringIO(), stderr=StringIO())
+
+            with open(path) as file:
+                baseline = json.load(file)
+            baseline['scenarios']['like']['max_queries'] = 1
+            with open(path, 'w') as file:
+                json.dump(baseline, file)
+            with self.assertRaisesMessage(CommandError, 'like: '):
+                call_command('benchmark', *options, '--tolerance', '100', stdout=StringIO(), stderr=StringIO())
+
+
+class BenchConnectionsTest(TestCase):
+
+    def test_measures_each_mode(self):
+        output = StringIO()
+        call_command('bench_connections', '--threads', '2', '--requests', '5', stdout=output)
+        rows = {line.split()[0]: line.split()[1:] for line in output.getvalue().splitlines()[2:]}
+        self.assertEqual(set(rows), {'new', 'persistent'})
+        for values in rows.values():
+            self.assertGreater(float(values[-1]), 0)
+
+    def test_pool_needs_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('the pool is supported')
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            call_command('bench_connections', '--mode', 'pool', stdout=StringIO())
+
+
+@override_settings(REPLICA_DATABASE_ALIAS='replica', REPLICA_STICKY_SECONDS=60)
+class ReplicaTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.seen = []
+        self.status = 200
+        self.middleware = replicas.ReplicaMiddleware(self.respond)
+
+    def respond(self, request):
+        self.seen.append(replicas.ReplicaRouter().db_for_read(Post))
+        return HttpResponse(status=self.status)
+
+    def test_safe_requests_read_from_the_replica(self):
+        self.middleware(self.factory.get('/api/feed/', HTTP_AUTHORIZATION='Bearer a'))
+        self.middleware(self.factory.post('/api/posts/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertEqual(self.seen, ['replica', 'default'])
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Post), 'default')
+        self.assertEqual(replicas.ReplicaRouter().db_for_write(Post), 'default')
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        response = self.middleware(self.factory.post('/api/posts/1/like/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], 60)
+
+        self.middleware(self.factory.get('/api/feed/', HTTP_AUTHORIZATION='Bearer a'))
+        self.middleware(self.factory.get('/api/feed/', HTTP_AUTHORIZATION='Bearer b'))
+        cookie_request = self.factory.get('/api/feed/')
+        cookie_request.COOKIES[replicas.PIN_COOKIE] = '1'
+        self.middleware(cookie_request)
+        cache.clear()
+        self.middleware(self.factory.get('/api/feed/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertEqual(self.seen, ['default', 'default', 'replica', 'default', 'replica'])
+
+    def test_failed_writes_do_not_pin(self):
+        self.status = 400
+        response = self.middleware(self.factory.post('/api/posts/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+        self.middleware(self.factory.get('/api/feed/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertEqual(self.seen[-1], 'replica')
+
+    def test_without_replica(self):
+        with override_settings(REPLICA_DATABASE_ALIAS=''):
+            response = self.middleware(self.factory.get('/api/feed/', HTTP_AUTHORIZATION='Bearer a'))
+            self.middleware(self.factory.post('/api/posts/', HTTP_AUTHORIZATION='Bearer a'))
+        self.assertEqual(self.seen, ['default', 'default'])
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {
+    'like': '3/min', 'like_ip': '5/min', 'follow': '2/min', 'registration': '2/hour', 'bulk': '1/min',
+}})
+class ThrottleTest(SeededGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        benchmark = Benchmark()
+        self.user_ids = list(UserTwitter.objects.order_by('pk').values_list('pk', flat=True)[:3])
+        self.clients = [benchmark.client_for(pk) for pk in self.user_ids]
+        self.post_id = Post.objects.values_list('pk', flat=True).first()
+
+    def like(self, client):
+        return client.post(f'/api/posts/{self.post_id}/like/')
+
+    def test_user_bucket_rejects_before_any_query(self):
+        self.assertEqual([self.like(self.clients[0]).status_code for _ in range(3)], [200] * 3)
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.like(self.clients[0])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(captured), 0)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # the other users and scopes have their own buckets
+        self.assertEqual(self.like(self.clients[1]).status_code, 200)
+        self.assertEqual(self.clients[0].post(f'/api/users/follow/{self.user_ids[1]}/').status_code, 200)
+
+    def test_ip_bucket_limits_all_the_users_of_an_address(self):
+        statuses = [self.like(client).status_code for client in self.clients for _ in range(2)]
+        self.assertEqual(statuses, [200] * 5 + [429])
+
+    def register(self, username, **headers):
+        return APIClient(**headers).post('/api/users/registration/', {
+            'user': {'username': username, 'email': f'{username}@example.com', 'password': 'Throttle-password-1'},
+        }, format='json')
+
+    def test_registration_is_limited_by_address(self):
+        self.assertEqual([self.register(f'throttled_{i}').status_code for i in range(3)], [201, 201, 429])
+        self.assertFalse(UserTwitter.objects.filter(user__username='throttled_2').exists())
+
+    def test_spoofed_forwarded_addresses_share_a_bucket(self):
+        statuses = [self.register(f'spoofed_{i}', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}').status_code for i in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+
+        throttling.memory_buckets.clear()
+        with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            # behind one proxy, only the address it appended counts
+            statuses = [
+                self.register(f'proxied_{i}', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}, 198.51.100.1').status_code
+                for i in range(3)
+            ]
+            self.assertEqual(statuses, [201, 201, 429])
+            self.assertEqual(self.register('proxied_3', HTTP_X_FORWARDED_FOR='198.51.100.2').status_code, 201)
+
+    @override_settings(FORWARDED_ALLOW_IPS=['172.28.0.4'])
+    def test_forwarded_addresses_are_only_read_from_the_proxy(self):
+        with self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            # a client connecting without the proxy hop cannot choose its bucket
+            statuses = [
+                self.register(f'direct_{i}', REMOTE_ADDR='192.0.2.1', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}').status_code
+                for i in range(3)
+            ]
+            self.assertEqual(statuses, [201, 201, 429])
+            proxied = self.register('proxied', REMOTE_ADDR='172.28.0.4', HTTP_X_FORWARDED_FOR='203.0.113.9')
+            self.assertEqual(proxied.status_code, 201)
+
+    def test_bulk_import_is_limited(self):
+        body = json.dumps({'title': 'Bulk', 'body': 'Throttled'})
+        statuses = [
+            self.clients[0].generic('POST', '/api/posts/bulk/', body, content_type='application/x-ndjson').status_code
+            for _ in range(2)
+        ]
+        self.assertEqual(statuses, [201, 429])
+
+    def test_async_like_is_throttled(self):
+        from .async_views import post_like
+
+        def like():
+            request = RequestFactory().post(
+                f'/api/posts/{self.post_id}/like/', HTTP_AUTHORIZATION=self.clients[0].defaults['HTTP_AUTHORIZATION'],
+            )
+            return async_to_sync(post_like)(request, self.post_id)
+
+        self.assertEqual([like().status_code for _ in range(3)], [200] * 3)
+        response = like()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_memory_buckets_refill(self):
+        buckets = throttling.MemoryBuckets()
+        self.assertEqual([buckets.take('key', 0.05, 2) for _ in range(2)], [0.0, 0.0])
+        self.assertGreater(buckets.take('key', 0.05, 2), 0)
+        buckets.full_at['key'] -= 0.05
+        self.assertEqual(buckets.take('key', 0.05, 2), 0.0)
+        buckets.prune(time.monotonic() + 1)
+        self.assertEqual(buckets.full_at, {})
+
+    def test_disabled(self):
+        with self.settings(THROTTLE_ENABLED=False):
+            self.assertEqual({self.like(self.clients[0]).status_code for _ in range(5)}, {200})
+
+
+class SoftDeleteTest(SeededGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        benchmark = Benchmark()
+        follow = Follow.objects.order_by('pk').first()
+        self.author = benchmark.client_for(follow.followee_id)
+        self.follower = benchmark.client_for(follow.follower_id)
+        response = self.author.post('/api/posts/', {'title': 'Ephemeral', 'body': 'A #softdelete zanzibar post'})
+        self.post_id = response.json()['id']
+
+    def visible_ids(self):
+        responses = {
+            'list': self.author.get('/api/posts/'),
+            'feed': self.follower.get('/api/feed/'),
+            'search': self.follower.get('/api/posts/search/?q=zanzibar'),
+            'hashtag': self.follower.get('/api/hashtags/softdelete/posts/'),
+        }
+        return {
+            name: self.post_id in [post['id'] for post in response.json()['results']['data']]
+            for name, response in responses.items()
+        }
+
+    def test_deleted_post_is_kept_inactive_and_hidden(self):
+        self.assertEqual(self.visible_ids(), {'list': True, 'feed': True, 'search': True, 'hashtag': True})
+
+        self.assertEqual(self.author.delete(f'/api/posts/{self.post_id}/').status_code, 200)
+
+        self.assertEqual(Post.objects.get(pk=self.post_id).status, StatusEnum.INACTIVE.value)
+        self.assertFalse(TimelineEntry.objects.filter(post_id=self.post_id).exists())
+        self.assertEqual(self.visible_ids(), {'list': False, 'feed': False, 'search': False, 'hashtag': False})
+        self.assertEqual(self.author.get(f'/api/posts/{self.post_id}/').status_code, 404)
+        self.assertEqual(self.follower.post(f'/api/posts/{self.post_id}/like/').status_code, 400)
+        self.assertEqual(self.author.delete(f'/api/posts/{self.post_id}/').status_code, 400)
+
+    def test_rebuilt_timelines_skip_inactive_posts(self):
+        Post.objects.filter(pk=self.post_id).update(status=StatusEnum.INACTIVE.value)
+        owner = Follow.objects.order_by('pk').first().follower
+        rebuild_timeline(owner)
+        self.assertFalse(TimelineEntry.objects.filter(owner=owner, post_id=self.post_id).exists())
+
+
+class FollowSuggestionTest(SeededGraphTestCase):
+
+    def expected(self, owner_id):
+        """
+            The suggestions of a user computed from the edges in Python, as [(suggested, mutuals)].
+        """
+        following = defaultdict(set)
+        for follower_id, followee_id in Follow.objects.values_list('follower_id', 'followee_id'):
+            following[follower_id].add(followee_id)
+        mutuals = Counter(
+            candidate for followee_id in following[owner_id] for candidate in following[followee_id]
+            if candidate != owner_id and candidate not in following[owner_id]
+        )
+        return sorted(mutuals.items(), key=lambda item: (-item[1], item[0]))
+
+    def stored(self, owner_id):
+        return list(
+            FollowSuggestion.objects.filter(owner_id=owner_id)
+            .order_by('-mutuals', 'suggested_id').values_list('suggested_id', 'mutuals')
+        )
+
+    def test_rebuild_keeps_the_top_second_degree_users(self):
+        with self.settings(SUGGESTIONS_PER_USER=5):
+            call_command('rebuild_suggestions', '--batch-size', '7', stdout=StringIO())
+            user_ids = UserTwitter.objects.values_list('pk', flat=True)
+            for user_id in user_ids:
+                self.assertEqual(self.stored(user_id), self.expected(user_id)[:5])
+        self.assertTrue(FollowSuggestion.objects.exists())
+
+    def test_follow_updates_the_suggestions(self):
+        list(rebuild_all_suggestions())
+        owner_id = Follow.objects.order_by('pk').first().follower_id
+        author_id = self.expected(owner_id)[0][0]
+        client = Benchmark().client_for(owner_id)
+
+        for _ in range(2):
+            self.assertEqual(client.post(f'/api/users/follow/{author_id}/').status_code, 200)
+            self.assertEqual(self.stored(owner_id), self.expected(owner_id)[:settings.SUGGESTIONS_PER_USER])
+            # the followers of the owner keep exact counts for the users already suggested to them
+            for follower_id in Follow.objects.filter(followee_id=owner_id).values_list('follower_id', flat=True):
+                expected = dict(self.expected(follower_id))
+                for suggested_id, mutuals in self.stored(follower_id):
+                    self.assertEqual(mutuals, expected[suggested_id])
+
+    def test_endpoint_reads_the_stored_suggestions(self):
+        owner_id = Follow.objects.order_by('pk').first().follower_id
+        rebuild_suggestions([owner_id])
+        client = Benchmark().client_for(owner_id)
+
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get('/api/users/suggestions/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual([(user['id'], user['mutuals']) for user in data], self.stored(owner_id))
+        self.assertEqual(set(data[0]), {'id', 'username', 'followers_count', 'mutuals'})
+        self.assertEqual(sum(FollowSuggestion._meta.db_table in query['sql'] for query in captured), 1)
+
+
+class UserDirectoryTest(SeededGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = Benchmark().client_for(UserTwitter.objects.order_by('pk').first().pk)
+
+    def walk(self, url):
+        """
+            Follow the next links from `url`, returning the users of every page.
+        """
+        users = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            users.extend(response.json()['results']['data'])
+            url = response.json()['next']
+        return users
+
+    def test_pages_cover_the_users_in_username_order(self):
+        users = self.walk('/api/users/?page_size=7')
+        expected = UserTwitter.objects.order_by('user__username').values_list('pk', 'user__username', 'followers_count')
+        self.assertEqual([(user['id'], user['username'], user['followers_count']) for user in users], list(expected))
+        self.assertEqual(set(users[0]), {'id', 'username', 'created_at', 'followers_count', 'following_count'})
+
+    def test_previous_link_goes_back(self):
+        first = self.client.get('/api/users/?page_size=7').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+        self.assertEqual(self.client.get('/api/users/?cursor=bad').status_code, 404)
+
+    def test_prefix_search_ignores_the_case(self):
+        users = self.walk('/api/users/?q=SEED_1&page_size=4')
+        self.assertEqual([user['username'] for user in users], sorted(['seed_1'] + [f'seed_1{i}' for i in range(10)]))
+        self.assertEqual(self.walk('/api/users/?q=seed%25'), [])
+
+    def test_prefix_search_uses_the_username_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('checks the SQLite index')
+        plan = UserTwitter.objects.filter(user__username__istartswith='seed_1').values('user__username').explain()
+        self.assertIn('auth_user_username_nocase_idx', plan)
+
+    def test_registration_listing_is_paginated(self):
+        response = self.client.get('/api/users/registration/?page_size=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertIsNotNone(response.json()['next'])
+
+
+@override_settings(STREAM_BACKEND='memory', STREAM_MAX_SECONDS=5)
+class FeedStreamTest(SeededGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        benchmark = Benchmark()
+        follow = Follow.objects.order_by('pk').first()
+        self.author = benchmark.client_for(follow.followee_id)
+        self.author_id = follow.followee_id
+        followed = Follow.objects.filter(follower_id=follow.follower_id).values('followee_id')
+        stranger_id = UserTwitter.objects.exclude(pk__in=followed).exclude(pk=follow.follower_id).values_list('pk', flat=True)[0]
+        self.stranger = benchmark.client_for(stranger_id)
+        self.authorization = benchmark.client_for(follow.follower_id).defaults['HTTP_AUTHORIZATION']
+        self.app = streams.FeedStream(None)
+        # the data of the test is only visible to the connection of its thread, not to the pool threads
+        self.enterContext(mock.patch.object(streams, 'run_query', sync_to_async))
+
+    def open_stream(self, during=None, until=None, headers=None):
+        """
+            Run a stream, call `during` once it started and disconnect once its body contains `until`.
+
+            Returns:
+                tuple: The status and the body of the response.
+        """
+        if headers is None:
+            headers = {'authorization': self.authorization}
+
+        async def run():
+            messages = []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+
+            def body():
+                return b''.join(message.get('body', b'') for message in messages).decode()
+
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': streams.STREAM_PATH, 'query_string': b'',
+                'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+            }
+            task = asyncio.ensure_future(self.app(scope, receive, send))
+            while not messages and not task.done():
+                await asyncio.sleep(0.01)
+            if during is not None:
+                await during()
+            for _ in range(200):
+                if task.done() or (until is not None and until in body()):
+                    break
+                await asyncio.sleep(0.01)
+            disconnected.set()
+            await task
+            return messages[0]['status'], body()
+
+        return async_to_sync(run)()
+
+    def create_posts(self, client, count=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [client.post('/api/posts/', {'title': f'Live {i}', 'body': 'Streamed'}).json()['id'] for i in range(count)]
+
+    def event_ids(self, body, kind='post'):
+        return [int(block.split('\n')[0][4:]) for block in body.split('\n\n') if f'\nevent: {kind}\n' in f'\n{block}\n']
+
+    def test_pushes_the_posts_of_followed_users(self):
+        created = {}
+
+        async def during():
+            created['stranger'] = await sync_to_async(self.create_posts)(self.stranger)
+            created['author'] = await sync_to_async(self.create_posts)(self.author, 2)
+
+        status_code, body = self.open_stream(during, until='event: post\n')
+        self.assertEqual(status_code, 200)
+        self.assertTrue(body.startswith('retry: '))
+        self.assertEqual(self.event_ids(body), created['author'])
+        self.assertIn(f'"author": {self.author_id}', body)
+
+    def test_pushes_the_bulk_imported_posts(self):
+        created = []
+
+        def bulk_import():
+            body = ''.join(json.dumps({'title': f'Bulk {i}', 'body': 'Streamed'}) + '\n' for i in range(2))
+            with self.captureOnCommitCallbacks(execute=True):
+                data = self.author.generic('POST', '/api/posts/bulk/', body, content_type='application/x-ndjson').json()['data']
+            self.assertEqual(data['created'], 2)
+            created.extend(Post.objects.filter(title__startswith='Bulk ').order_by('pk').values_list('pk', flat=True))
+
+        async def during():
+            await sync_to_async(bulk_import)()
+
+        _, body = self.open_stream(during, until='event: post\n')
+        self.assertEqual(self.event_ids(body), created)
+
+    def test_replays_the_posts_missed_since_last_event_id(self):
+        before = Post.objects.order_by('-pk').values_list('pk', flat=True)[0]
+        missed = self.create_posts(self.author, 3)
+
+        with self.settings(STREAM_MAX_SECONDS=0):
+            _, body = self.open_stream(headers={'authorization': self.authorization, 'last-event-id': str(before)})
+            self.assertEqual(self.event_ids(body), missed)
+            with self.settings(STREAM_REPLAY_LIMIT=2):
+                _, body = self.open_stream(headers={'authorization': self.authorization, 'last-event-id': str(before)})
+        self.assertEqual(self.event_ids(body), [])
+        self.assertEqual(self.event_ids(body, 'reset'), [missed[-1]])
+
+    def test_slow_client_catches_up_from_the_database(self):
+        created = []
+
+        async def during():
+            posts = await sync_to_async(list)(
+                Post.objects.create(user_twitter_id=self.author_id, title=f'Missed {i}', body='Streamed') for i in range(3)
+            )
+            created.extend(post.pk for post in posts)
+            # the subscription holds one event, the others overflow before the stream reads them
+            for post in posts:
+                streams.memory_broker.dispatch(streams.post_event(post.pk, self.author_id, post.created_at))
+
+        with self.settings(STREAM_QUEUE_SIZE=1):
+            _, body = self.open_stream(during, until='event: post\n')
+        self.assertEqual(self.event_ids(body), created)
+
+    def test_heartbeat_and_end_of_stream(self):
+        with self.settings(STREAM_HEARTBEAT_SECONDS=0.01, STREAM_MAX_SECONDS=0.1):
+            _, body = self.open_stream()
+        self.assertIn(': ping\n\n', body)
+        self.assertEqual(streams.memory_broker.subscriptions, {})
+
+    def test_requires_a_token_and_passes_other_requests_on(self):
+        self.assertEqual(self.open_stream(headers={})[0], 401)
+        self.assertEqual(self.open_stream(headers={'authorization': 'Bearer invalid'})[0], 401)
+
+        calls = []
+
+        async def application(scope, receive, send):
+            calls.append(scope['path'])
+
+        async_to_sync(streams.FeedStream(application))({'type': 'http', 'path': '/api/feed/'}, None, None)
+        self.assertEqual(calls, ['/api/feed/'])
+
+
+class ConditionalGetTest(SeededGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        benchmark = Benchmark()
+        follow = Follow.objects.order_by('pk').first()
+        self.owner_id = follow.follower_id
+        self.client = benchmark.client_for(follow.follower_id)
+        self.author = benchmark.client_for(follow.followee_id)
+
+    def test_unchanged_feed_page_is_not_modified(self):
+        response = self.client.get('/api/feed/')
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/feed/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(captured), 0)
+        self.assertEqual(self.client.get('/api/feed/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        # another page or format is another body
+        self.assertEqual(self.client.get('/api/feed/?counts=true', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/feed/?format=api', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_like_and_new_post_change_the_etag(self):
+        response = self.client.get('/api/feed/')
+        etag = response['ETag']
+        post_id = response.json()['results']['data'][0]['id']
+
+        self.client.post(f'/api/posts/{post_id}/like/')
+        response = self.client.get('/api/feed/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.author.post('/api/posts/', {'title': 'Fresh', 'body': 'New in the feed'})
+        self.assertEqual(self.client.get('/api/feed/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_async_feed_answers_the_same_etag(self):
+        from .async_views import feed
+
+        etag = self.client.get('/api/feed/')['ETag']
+        request = RequestFactory().get(
+            '/api/feed/', HTTP_AUTHORIZATION=self.client.defaults['HTTP_AUTHORIZATION'], HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(async_to_sync(feed)(request).status_code, 304)
+
+    def test_user_listing_changes_with_follows(self):
+        etag = self.client.get('/api/users/registration/?counts=true')['ETag']
+        self.assertEqual(self.client.get('/api/users/registration/?counts=true', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        stranger = UserTwitter.objects.exclude(followers__pk=self.owner_id).exclude(pk=self.owner_id).first()
+        self.client.post(f'/api/users/follow/{stranger.pk}/')
+        self.assertEqual(self.client.get('/api/users/registration/?counts=true', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FastJSONRendererTest(TestCase):
+
+    def test_renders_the_same_json_as_drf(self):
+        from decimal import Decimal
+
+        from django.utils.timezone import now
+        from django.utils.translation import gettext_lazy
+        from rest_framework.renderers import JSONRenderer
+
+        from .renderers import ORJSONRenderer
+
+        data = {'text': 'caf\u00e9 #python', 'when': now(), 'price': Decimal('1.50'), 'lazy': gettext_lazy('Yes'), 'ids': [1, 2]}
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        self.assertIn(b'\n', ORJSONRenderer().render(data, 'application/json; indent=2'))
+
+    def test_bench_serialization(self):
+        GraphSeeder(users=10, posts=30, avg_following=3, seed=1).run()
+        output = StringIO()
+        call_command('bench_serialization', '--pages', '3', stdout=output)
+        rows = {line.split()[0] for line in output.getvalue().splitlines()[2:]}
+        self.assertEqual(rows, {'serialize', 'json', 'orjson'})
+
+
+class MetricsTest(SeededGraphTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.client = Benchmark().client_for(UserTwitter.objects.order_by('pk').values_list('pk', flat=True).first())
+
+    def test_records_requests_by_url_name(self):
+        self.client.get('/api/feed/')
+        self.client.get('/api/feed/')
+        self.client.get('/api/missing/')
+
+        with self.settings(METRICS_TOKEN='secret'):
+            text = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+
+        self.assertIn('http_requests_total{view="feed",method="GET",status="200"} 2', text)
+        self.assertIn('http_requests_total{view="unmatched",method="GET",status="404"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="feed",method="GET",le="+Inf"} 2', text)
+        self.assertIn('# TYPE http_request_db_queries histogram', text)
+        self.assertIn('background_jobs{status="pending"} 0', text)
+
+    def test_counts_the_queries_of_each_request(self):
+        self.client.get('/api/feed/?counts=true')
+        histogram = metrics.registry.histograms[('http_request_db_queries', (('view', 'feed'), ('method', 'GET')))]
+        self.assertEqual(histogram.count, 1)
+        self.assertGreater(histogram.sum, 0)
+
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.settings(METRICS_SLOW_REQUEST_MS=0.001), self.assertLogs('mini_twitter.slow_requests') as logs:
+            self.client.get('/api/feed/?counts=true')
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_closed_without_a_token(self):
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_token_is_required(self):
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+QUERY_BUDGET = os.path.join(settings.BASE_DIR, 'benchmarks', 'query_budget.json')
+
+
+def route_names(patterns=None):
+    """
+        Get the URL names of all the routes, the admin site counting as the single route 'admin'.
+    """
+    names = set()
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            names |= {'admin'} if pattern.app_name == 'admin' else route_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+@override_settings(METRICS_TOKEN='budget')
+class QueryBudgetTest(TestCase):
+    """
+        Every route is requested on a small and a large seeded graph, with a small and a large
+        page, and must make the same number of queries on both: the number of queries of an
+        endpoint cannot grow with the data. The counts are checked against the budget in
+        `benchmarks/query_budget.json`; after an intended change, rewrite it with
+        `UPDATE_QUERY_BUDGET=1 python manage.py test mini_twitter`.
+
+        The caches are emptied before each request, so the budget is the one of a cache miss.
+    """
+    SIZES = {
+        'small': {'users': 15, 'posts': 60, 'page_size': 2},
+        'large': {'users': 60, 'posts': 600, 'page_size': 5},
+    }
+
+    def get_cases(self, data):
+        """
+            The requests of each route: (budget key, URL name, method, path, body).
+        """
+        page = f"page_size={data['page_size']}"
+        post, other_post = data['post'], data['other_post']
+        return [
+            ('api-root GET', 'api-root', 'get', '/api/', None),
+            ('post-list GET', 'post-list', 'get', f'/api/posts/?{page}', None),
+            ('post-list GET counts', 'post-list', 'get', f'/api/posts/?{page}&counts=true', None),
+            ('post-list POST', 'post-list', 'post', '/api/posts/', {'title': 'New', 'body': 'A #python post'}),
+            ('post-detail GET', 'post-detail', 'get', f'/api/posts/{post}/', None),
+            ('post-detail PATCH', 'post-detail', 'patch', f'/api/posts/{post}/', {'body': 'Edited #django'}),
+            ('post-detail DELETE', 'post-detail', 'delete', f'/api/posts/{post}/', None),
+            ('post-like POST', 'post-like', 'post', f'/api/posts/{other_post}/like/', None),
+            ('post-search GET', 'post-search', 'get', f'/api/posts/search/?q=python&{page}', None),
+            ('post-bulk POST', 'post-bulk', 'post', '/api/posts/bulk/', None),
+            ('user-list GET', 'user-list', 'get', f'/api/users/registration/?{page}', None),
+            ('user-list GET counts', 'user-list', 'get', f'/api/users/registration/?{page}&counts=true', None),
+            ('user-list POST', 'user-list', 'post', '/api/users/registration/',
+             {'user': {'username': 'newcomer', 'email': 'new@example.com', 'password': 'Budget-pass-1'}}),
+            ('follow-toggle POST', 'follow-toggle', 'post', f"/api/users/follow/{data['followee']}/", None),
+            ('user-directory GET', 'user-directory', 'get', f'/api/users/?{page}', None),
+            ('user-directory GET search', 'user-directory', 'get', f'/api/users/?q=seed_1&{page}', None),
+            ('follow-suggestions GET', 'follow-suggestions', 'get', '/api/users/suggestions/', None),
+            ('feed GET', 'feed', 'get', f'/api/feed/?{page}', None),
+            ('feed GET counts', 'feed', 'get', f'/api/feed/?{page}&counts=true', None),
+            ('hashtag-posts GET', 'hashtag-posts', 'get', f'/api/hashtags/python/posts/?{page}', None),
+            ('hashtag-trending GET', 'hashtag-trending', 'get', '/api/hashtags/trending/', None),
+            ('metrics GET', 'metrics', 'get', '/api/metrics/', None),
+            ('token_obtain_pair POST', 'token_obtain_pair', 'post', '/api/token/',
+             {'username': data['username'], 'password': DEFAULT_PASSWORD}),
+            ('token_refresh POST', 'token_refresh', 'post', '/api/token/refresh/', {'refresh': data['refresh']}),
+            ('schema GET', 'schema', 'get', '/api/schema/', None),
+            ('swagger-ui GET', 'swagger-ui', 'get', '/api/docs/', None),
+            ('admin GET', 'admin', 'get', '/admin/', None),
+        ]
+
+    def seed(self, users, posts, page_size):
+        """
+            Seed a graph and give the acting user a full page of their own liked posts.
+        """
+        GraphSeeder(users=users, posts=posts, avg_following=10, seed=1).run()
+        actor = UserTwitter.objects.select_related('user').order_by('-following_count', 'pk').first()
+        rng = random.Random(1)
+        user_ids = list(UserTwitter.objects.exclude(pk=actor.pk).values_list('pk', flat=True))
+        for i in range(page_size * 2):
+            post = Post.objects.create(user_twitter=actor, title=f'Mine {i}', body='#python')
+            likers = rng.sample(user_ids, page_size)
+            post.likes_users.add(*likers)
+            Post.objects.filter(pk=post.pk).update(likes=len(likers))
+
+        list(rebuild_all_suggestions())
+
+        followed = Follow.objects.filter(follower=actor).values_list('followee_id')
+        tokens = APIClient().post('/api/token/', {'username': actor.user.username, 'password': DEFAULT_PASSWORD}).data
+        return {
+            'page_size': page_size,
+            'username': actor.user.username,
+            'access': tokens['access'],
+            'refresh': tokens['refresh'],
+            'post': Post.objects.filter(user_twitter=actor).latest('pk').pk,
+            'other_post': Post.objects.exclude(user_twitter=actor).exclude(likes_users=actor).latest('pk').pk,
+            'followee': UserTwitter.objects.exclude(pk=actor.pk).exclude(pk__in=followed).order_by('pk').first().pk,
+        }
+
+    def measure(self, users, posts, page_size):
+        """
+            Count the queries of each case on a freshly seeded graph, rolled back afterwards.
+        """
+        counts = {}
+        with transaction.atomic():
+            data = self.seed(users, posts, page_size)
+            for key, _, method, path, body in self.get_cases(data):
+                client = APIClient()
+                if key == 'metrics GET':
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {settings.METRICS_TOKEN}')
+                elif not key.startswith('token_'):
+                    client.credentials(HTTP_AUTHORIZATION=f"Bearer {data['access']}")
+                cache.clear()
+                active_users.clear()
+                # the schema generator warns about each view it cannot fully describe
+                with CaptureQueriesContext(connection) as queries, redirect_stderr(StringIO()):
+                    if key == 'post-bulk POST':
+                        lines = ''.join(json.dumps({'title': f'Bulk {i}', 'body': '#python'}) + '\n' for i in range(page_size))
+                        response = client.post(path, lines, content_type='application/x-ndjson')
+                    else:
+                        response = getattr(client, method)(path, body, format='json')
+                self.assertLess(response.status_code, 400, f'{key}: {response.status_code} {response.content[:300]!r}')
+                counts[key] = len(queries)
+            transaction.set_rollback(True)
+        return counts
+
+    def test_every_route_is_covered(self):
+        covered = {name for _, name, _, _, _ in self.get_cases({'page_size': 1, 'post': 1, 'other_post': 1,
+                                                                 'followee': 1, 'username': '', 'refresh': ''})}
+        self.assertEqual(route_names() - covered, set())
+
+    def test_query_counts_do_not_grow_with_the_data(self):
+        small, large = (self.measure(**size) for size in self.SIZES.values())
+
+        grew = {key: (small[key], large[key]) for key in small if small[key] != large[key]}
+        self.assertEqual(grew, {}, 'Query counts that change with the data, as (small, large)')
+
+        if os.environ.get('UPDATE_QUERY_BUDGET'):
+            with open(QUERY_BUDGET, 'w', encoding='utf-8') as file:
+                json.dump(large, file, indent=2, sort_keys=True)
+                file.write('\n')
+        with open(QUERY_BUDGET, encoding='utf-8') as file:
+            budget = json.load(file)
+        changed = {key: (budget.get(key), large.get(key)) for key in budget.keys() | large.keys() if budget.get(key) != large.get(key)}
+        self.assertEqual(
+            changed, {},
+            'Query counts differ from benchmarks/query_budget.json, as (budget, measured); '
+            'if intended, run UPDATE_QUERY_BUDGET=1 python manage.py test mini_twitter',
+        )
@@ -0,0 +1,210 @@
+"""
+    Token bucket rate limits of the write endpoints.
+
+    Each client has a bucket of `num` tokens per scope, refilled at `num / period` for a rate
+    `num/period` of `REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']`; a request takes one token and is
+    rejected with a 429 and a `Retry-After` header when the bucket is empty. The bucket is stored
+    as a single number, the time at which it will be full again (the generic cell rate algorithm),
+    so taking a token is one read and one write of that number.
+
+    The throttles run after the authentication, which reads the token claims and an in-process
+    cache, and before the view: a rejected request makes no query.
+
+        - `UserTokenBucketThrottle` limits each user by the scope rate, and the anonymous requests
+          (the registration) by their IP address
+        - `IPTokenBucketThrottle` limits each IP address by the `<scope>_ip` rate, if there is one,
+          so many accounts behind one address are limited too
+
+    The IP address is the one of the connection, or the one seen by the last of the
+    `REST_FRAMEWORK['NUM_PROXIES']` proxies in X-Forwarded-For, never an address the client wrote:
+    the header is only read when the connection comes from one of the `FORWARDED_ALLOW_IPS`.
+
+    With `THROTTLE_BACKEND = 'memory'` the buckets are kept in a dict of the process, shared by its
+    threads without a lock: concurrent requests of the same client may both read the bucket before
+    either writes it, which lets through at most one extra request per concurrent thread. Each
+    process counts its own requests, so with several workers a client gets up to the rate of each
+    one. `THROTTLE_BACKEND = 'redis'` keeps the buckets in the Redis of the default cache, updated
+    atomically by a script, so all the processes share them.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+MAX_MEMORY_KEYS = 100000
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# KEYS[1]: bucket; ARGV: seconds per token, tokens of a full bucket. Returns the seconds to wait, as a string.
+GCRA_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local full_at = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), now) + interval
+local wait = full_at - now - capacity * interval
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('SET', KEYS[1], tostring(full_at), 'PX', math.ceil((full_at - now) * 1000))
+return '0'
+"""
+
+
+def parse_rate(rate):
+    """
+        Parse a rate such as '60/min' into the number of requests and the period in seconds.
+    """
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class MemoryBuckets:
+    """
+        Buckets of this process, as the time (`time.monotonic`) at which each one is full again.
+    """
+
+    def __init__(self):
+        self.full_at = {}
+
+    def take(self, key, interval, capacity):
+        """
+            Take a token from the bucket.
+
+            Returns:
+                float: 0 when a token was taken, otherwise the seconds until one is available.
+        """
+        now = time.monotonic()
+        full_at = max(self.full_at.get(key, now), now) + interval
+        wait = full_at - now - capacity * interval
+        if wait > 0:
+            return wait
+        if len(self.full_at) >= MAX_MEMORY_KEYS:
+            self.prune(now)
+        self.full_at[key] = full_at
+        return 0.0
+
+    def prune(self, now):
+        # a full bucket is the same as no bucket; copy() is atomic, iterating the dict itself is not
+        for key, full_at in self.full_at.copy().items():
+            if full_at <= now:
+                self.full_at.pop(key, None)
+
+    def clear(self):
+        self.full_at.clear()
+
+
+class RedisBuckets:
+    """
+        Buckets shared by the processes, in the Redis of the default cache.
+    """
+
+    def take(self, key, interval, capacity):
+        try:
+            # the redis-py client of the Django Redis cache backend
+            client = cache._cache.get_client(key, write=True)
+        except AttributeError:
+            raise ImproperlyConfigured("THROTTLE_BACKEND = 'redis' needs CACHE_URL to point to a Redis server")
+        try:
+            return float(client.eval(GCRA_SCRIPT, 1, cache.make_key(f'throttle:{key}'), interval, capacity))
+        except Exception:
+            # an unreachable Redis does not take the write endpoints down with it
+            logger.exception('Could not reach the throttle buckets, request allowed')
+            return 0.0
+
+    def clear(self):
+        pass
+
+
+memory_buckets = MemoryBuckets()
+redis_buckets = RedisBuckets()
+
+
+def get_buckets():
+    return redis_buckets if settings.THROTTLE_BACKEND == 'redis' else memory_buckets
+
+
+def from_trusted_proxy(request):
+    """
+        Tell if the request was sent by one of the `FORWARDED_ALLOW_IPS` proxies.
+    """
+    trusted = settings.FORWARDED_ALLOW_IPS
+    return '*' in trusted or request.META.get('REMOTE_ADDR') in trusted
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+        Base token bucket throttle of the views with a `throttle_scope`.
+    """
+    rate_suffix = ''
+
+    def get_rate(self, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is None:
+            return None, None
+        return scope, api_settings.DEFAULT_THROTTLE_RATES.get(scope + self.rate_suffix)
+
+    def get_client(self, request):
+        raise NotImplementedError
+
+    def get_ident(self, request):
+        # a peer that is not a trusted proxy wrote X-Forwarded-For itself, only its connection counts
+        if not from_trusted_proxy(request):
+            return request.META.get('REMOTE_ADDR')
+        return super().get_ident(request)
+
+    def allow_request(self, request, view):
+        self.wait_time = None
+        scope, rate = self.get_rate(view)
+        if not settings.THROTTLE_ENABLED or rate is None:
+            return True
+        num, period = parse_rate(rate)
+        key = f'{scope}{self.rate_suffix}:{self.get_client(request)}'
+        self.wait_time = get_buckets().take(key, period / num, num)
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+        Limit each user, or each IP address for the anonymous requests, by the rate of the scope.
+    """
+
+    def get_client(self, request):
+        # set by the JWT authentication, from the token claims
+        user_twitter = getattr(request, 'user_twitter', None)
+        if user_twitter is not None:
+            return f'user:{user_twitter.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """
+        Limit each IP address by the `<scope>_ip` rate.
+    """
+    rate_suffix = '_ip'
+
+    def get_client(self, request):
+        return f'ip:{self.get_ident(request)}'
+
+
+THROTTLE_CLASSES = [UserTokenBucketThrottle, IPTokenBucketThrottle]
+
+
+def check_throttles(request, scope):
+    """
+        Check the throttles of a scope outside of a DRF view, for the async views.
+
+        Returns:
+            float or None: The seconds to wait when the request is throttled, otherwise None.
+    """
+    view = type('ThrottledView', (), {'throttle_scope': scope})
+    waits = [throttle.wait() for throttle in (cls() for cls in THROTTLE_CLASSES) if not throttle.allow_request(request, view)]
+    return max(waits) if waits else None
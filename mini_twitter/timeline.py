@@ -0,0 +1,327 @@
+"""
+    Materialized home timelines.
+
+    Posts are pushed (fan-out-on-write) into a `TimelineEntry` row per follower when they are
+    created, so the feed is read as one pre-sorted slice of the owner's timeline. Authors with
+    more followers than `TIMELINE_CELEBRITY_THRESHOLD` are not fanned out: their posts are
+    pulled at read time (fan-out-on-read) and merged into the slice.
+
+    The API does not write the timelines itself, it enqueues `timeline.fan_out` and
+    `timeline.follow` jobs (see mini_twitter/tasks.py) run by the worker.
+"""
+from collections import defaultdict
+from heapq import merge
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from . import jobs
+from .models import Follow, Post, StatusEnum, TimelineEntry, UserTwitter
+from .pagination import keyset_filter, keyset_ordering
+
+BATCH_SIZE = 1000
+
+
+def _sort_key(post):
+    return (post.created_at, post.pk)
+
+
+def is_celebrity(user_twitter):
+    """
+        Check if the user has too many followers to be fanned out on write.
+    """
+    return user_twitter.followers_count >= settings.TIMELINE_CELEBRITY_THRESHOLD
+
+
+def followed_celebrity_ids(user_twitter):
+    """
+        Get the ids of the users followed by `user_twitter` that are read with fan-out-on-read.
+    """
+    return list(
+        Follow.objects
+        .filter(follower=user_twitter, followee__followers_count__gte=settings.TIMELINE_CELEBRITY_THRESHOLD)
+        .values_list('followee_id', flat=True)
+    )
+
+
+def trim_timelines(owner_ids):
+    """
+        Drop the entries beyond `TIMELINE_MAX_LENGTH` from the timelines of the given owners.
+    """
+    stale = (
+        TimelineEntry.objects
+        .filter(owner_id__in=owner_ids)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=F('owner_id'),
+            order_by=[F('created_at').desc(), F('post_id').desc()],
+        ))
+        .filter(position__gt=settings.TIMELINE_MAX_LENGTH)
+        .values('pk')
+    )
+    TimelineEntry.objects.filter(pk__in=stale).delete()
+
+
+def fan_out_post(post):
+    """
+        Push a new post into the timelines of the author's followers.
+
+        Posts of celebrity accounts are skipped, they are merged into the feed at read time.
+
+        Args:
+            post (Post): The post that was just created.
+
+        Returns:
+            int: The number of timelines the post was pushed to.
+    """
+    author = post.user_twitter
+    if is_celebrity(author):
+        return 0
+
+    follower_ids = list(Follow.objects.filter(followee=author).values_list('follower_id', flat=True))
+    for start in range(0, len(follower_ids), BATCH_SIZE):
+        chunk = follower_ids[start:start + BATCH_SIZE]
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(owner_id=owner_id, post=post, author=author, created_at=post.created_at)
+                for owner_id in chunk
+            ],
+            ignore_conflicts=True,
+        )
+        trim_timelines(chunk)
+    return len(follower_ids)
+
+
+def fan_out_posts(posts):
+    """
+        Batch version of `fan_out_post` for posts written together, such as an import.
+
+        The followers of each author are read once and the entries are written and trimmed in
+        batches of `BATCH_SIZE`.
+
+        Returns:
+            int: The number of timeline entries written.
+    """
+    by_author = defaultdict(list)
+    for post in posts:
+        by_author[post.user_twitter_id].append(post)
+    celebrities = set(
+        UserTwitter.objects
+        .filter(pk__in=list(by_author), followers_count__gte=settings.TIMELINE_CELEBRITY_THRESHOLD)
+        .values_list('pk', flat=True)
+    )
+    followers = (
+        Follow.objects.filter(followee_id__in=[pk for pk in by_author if pk not in celebrities])
+        .values_list('followee_id', 'follower_id')
+    )
+
+    written = 0
+    entries = []
+    owners = set()
+    for author_id, owner_id in followers.iterator(chunk_size=BATCH_SIZE):
+        owners.add(owner_id)
+        for post in by_author[author_id]:
+            entries.append(TimelineEntry(owner_id=owner_id, post=post, author_id=author_id, created_at=post.created_at))
+        if len(entries) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            written += len(entries)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    written += len(entries)
+
+    owners = list(owners)
+    for start in range(0, len(owners), BATCH_SIZE):
+        trim_timelines(owners[start:start + BATCH_SIZE])
+    return written
+
+
+def schedule_fan_out(post):
+    """
+        Enqueue the fan-out of a new post, done by the `timeline.fan_out` job once it is committed.
+    """
+    jobs.enqueue('timeline.fan_out', {'post': post.pk}, key=f'timeline.fan_out:{post.pk}')
+
+
+def schedule_timeline_update(owner, author):
+    """
+        Enqueue the update of the owner's timeline after they followed or unfollowed `author`.
+    """
+    jobs.enqueue(
+        'timeline.follow',
+        {'owner': owner.pk, 'author': author.pk},
+        key=f'timeline.follow:{owner.pk}:{author.pk}',
+    )
+
+
+def add_author_to_timeline(owner, author):
+    """
+        Copy the most recent posts of a newly followed user into the owner's timeline.
+    """
+    if is_celebrity(author):
+        return
+    posts = (
+        Post.objects.active().filter(user_twitter=author)
+        .order_by('-created_at', '-id')
+        .values_list('pk', 'created_at')[:settings.TIMELINE_MAX_LENGTH]
+    )
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(owner=owner, post_id=post_id, author=author, created_at=created_at)
+            for post_id, created_at in posts
+        ],
+        ignore_conflicts=True,
+    )
+    trim_timelines([owner.pk])
+
+
+def remove_author_from_timeline(owner, author):
+    """
+        Remove the posts of an unfollowed user from the owner's timeline.
+    """
+    TimelineEntry.objects.filter(owner=owner, author=author).delete()
+
+
+def remove_post_from_timelines(post):
+    """
+        Remove a post that became inactive from the timelines it was pushed to.
+    """
+    TimelineEntry.objects.filter(post=post).delete()
+
+
+def rebuild_timeline(owner):
+    """
+        Rebuild the timeline of a user from the posts of the users they follow.
+
+        Returns:
+            int: The number of entries written to the timeline.
+    """
+    celebrities = followed_celebrity_ids(owner)
+    followed = Follow.objects.filter(follower=owner).exclude(followee_id__in=celebrities).values_list('followee_id')
+    posts = (
+        Post.objects.active().filter(user_twitter__in=followed)
+        .order_by('-created_at', '-id')
+        .values_list('pk', 'user_twitter_id', 'created_at')[:settings.TIMELINE_MAX_LENGTH]
+    )
+    entries = [
+        TimelineEntry(owner=owner, post_id=post_id, author_id=author_id, created_at=created_at)
+        for post_id, author_id, created_at in posts
+    ]
+    TimelineEntry.objects.filter(owner=owner).delete()
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return len(entries)
+
+
+def rebuild_timelines(owner_ids):
+    """
+        Batch version of `rebuild_timeline`, for many users at once such as a seeded graph.
+
+        The entries are selected and written by a single INSERT ... SELECT, ranking the posts
+        of the followed users with a window function, so no row goes through Python.
+
+        Returns:
+            int: The number of entries written.
+    """
+    owner_ids = list(owner_ids)
+    if not owner_ids:
+        return 0
+    TimelineEntry.objects.filter(owner_id__in=owner_ids).delete()
+    placeholders = ', '.join(['%s'] * len(owner_ids))
+    sql = f"""
+        INSERT INTO {TimelineEntry._meta.db_table} (owner_id, post_id, author_id, created_at)
+        SELECT owner_id, post_id, author_id, created_at FROM (
+            SELECT follow.follower_id AS owner_id, post.id AS post_id, post.user_twitter_id AS author_id,
+                post.created_at AS created_at,
+                ROW_NUMBER() OVER (
+                    PARTITION BY follow.follower_id ORDER BY post.created_at DESC, post.id DESC
+                ) AS position
+            FROM {Follow._meta.db_table} follow
+            JOIN {UserTwitter._meta.db_table} followee
+                ON followee.id = follow.followee_id AND followee.followers_count < %s
+            JOIN {Post._meta.db_table} post ON post.user_twitter_id = follow.followee_id AND post.status = %s
+            WHERE follow.follower_id IN ({placeholders})
+        ) ranked
+        WHERE position <= %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            settings.TIMELINE_CELEBRITY_THRESHOLD, StatusEnum.ACTIVE.value, *owner_ids, settings.TIMELINE_MAX_LENGTH,
+        ])
+        return cursor.rowcount
+
+
+class TimelineFeed:
+    """
+        Read-side view of a home timeline that can be handed to `KeysetPagination`.
+
+        It slices the owner's materialized timeline and merges in the posts of the
+        followed celebrity accounts, keeping the newest-first order.
+    """
+
+    def __init__(self, owner, celebrities=None):
+        self.owner = owner
+        if celebrities is None:
+            celebrities = followed_celebrity_ids(owner)
+        self.entries = TimelineEntry.objects.filter(owner=owner)
+        self.pulled_posts = None
+        if celebrities:
+            self.entries = self.entries.exclude(author_id__in=celebrities)
+            self.pulled_posts = Post.objects.active().filter(user_twitter_id__in=celebrities)
+
+    @classmethod
+    async def acreate(cls, owner):
+        """
+            Build the feed of `owner` from an async context.
+        """
+        celebrities = [
+            pk async for pk in
+            Follow.objects
+            .filter(follower=owner, followee__followers_count__gte=settings.TIMELINE_CELEBRITY_THRESHOLD)
+            .values_list('followee_id', flat=True)
+        ]
+        return cls(owner, celebrities)
+
+    def count(self):
+        total = self.entries.count()
+        if self.pulled_posts is not None:
+            total += self.pulled_posts.count()
+        return total
+
+    async def acount(self):
+        total = await self.entries.acount()
+        if self.pulled_posts is not None:
+            total += await self.pulled_posts.acount()
+        return total
+
+    def _slices(self, position, reverse, limit):
+        entries = self.entries
+        if position is not None:
+            entries = keyset_filter(entries, position, reverse, id_field='post_id')
+        entries = entries.select_related('post').order_by(*keyset_ordering(reverse, id_field='post_id'))[:limit]
+        pulled = self.pulled_posts
+        if pulled is not None:
+            if position is not None:
+                pulled = keyset_filter(pulled, position, reverse)
+            pulled = pulled.order_by(*keyset_ordering(reverse))[:limit]
+        return entries, pulled
+
+    def _merge(self, posts, pulled, reverse, limit):
+        if pulled is not None:
+            posts = merge(posts, pulled, key=_sort_key, reverse=not reverse)
+        return list(islice(posts, limit))
+
+    def keyset_slice(self, position, reverse, limit):
+        """
+            Get up to `limit` posts after the `(created_at, id)` position, see `KeysetPagination`.
+        """
+        entries, pulled = self._slices(position, reverse, limit)
+        return self._merge([entry.post for entry in entries], pulled, reverse, limit)
+
+    async def akeyset_slice(self, position, reverse, limit):
+        entries, pulled = self._slices(position, reverse, limit)
+        posts = [entry.post async for entry in entries]
+        if pulled is not None:
+            pulled = [post async for post in pulled]
+        return self._merge(posts, pulled, reverse, limit)
@@ -1,6 +1,8 @@
 from rest_framework import routers
+from django.conf import settings
 from django.urls import path, include
-from .views import UserTwitterViewSet, PostViewSet, FollowToggleView, FeedView
+from . import async_views
+from .views import UserTwitterViewSet, UserDirectoryView, PostViewSet, FollowToggleView, FollowSuggestionsView, FeedView, HashtagPostsView, TrendingHashtagsView, PostSearchView, BulkPostView, MetricsView
 
 router = routers.DefaultRouter()
 
@@ -8,9 +10,25 @@ router = routers.DefaultRouter()
 router.register(r'posts', PostViewSet)
 
 urlpatterns = [
+    # ahead of the router, which would read 'search' and 'bulk' as the pk of a post
+    path('posts/search/', PostSearchView.as_view(), name='post-search'),
+    path('posts/bulk/', BulkPostView.as_view(), name='post-bulk'),
     path('', include(router.urls)),
+    path('users/', UserDirectoryView.as_view(), name='user-directory'),
     path('users/registration/', UserTwitterViewSet.as_view({'get': 'list', 'post': 'create'}), name='user-list'),
-    path('posts/<int:pk>/like/', PostViewSet.as_view({'post': 'like'}), name='post-detail'),
+    path('posts/<int:pk>/like/', PostViewSet.as_view({'post': 'like'}), name='post-like'),
     path('users/follow/<int:pk>/', FollowToggleView.as_view(), name='follow-toggle'),
+    path('users/suggestions/', FollowSuggestionsView.as_view(), name='follow-suggestions'),
     path('feed/', FeedView.as_view(), name='feed'),
-]
\ No newline at end of file
+    path('hashtags/trending/', TrendingHashtagsView.as_view(), name='hashtag-trending'),
+    path('hashtags/<str:name>/posts/', HashtagPostsView.as_view(), name='hashtag-posts'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+]
+
+if settings.ASYNC_VIEWS:
+    # async versions of the read-heavy routes, ahead of the router so they take precedence
+    urlpatterns = [
+        path('posts/', async_views.post_list, name='post-list'),
+        path('posts/<int:pk>/like/', async_views.post_like, name='post-like'),
+        path('feed/', async_views.feed, name='feed'),
+    ] + urlpatterns
@@ -1,14 +1,22 @@
-from .serializers import UserTwitterSerializer, PostSerializer
-from .models import UserTwitter, Post
-from .pagination import FeedPagination
+from .serializers import UserTwitterSerializer, UserSummarySerializer, PostSerializer, wants_counts
+from .models import UserTwitter, Post, Job, JobStatusEnum, StatusEnum
+from .pagination import FeedPagination, SearchPagination, UserDirectoryPagination
+from .authentication import UserTwitterJWTAuthentication
+from . import follows, hashtags, images, ingest, likes, metrics, response_cache, search, streams, suggestions, timeline
 
+import hmac
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
 from django.contrib.auth.models import User
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 from rest_framework import viewsets
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import action
 
@@ -41,6 +49,123 @@ def get_message_response(flag, message, status_code, data=None):
             'message': message
         }
 
+def get_page_data(page, data, message):
+    """
+        Build the body of a page of posts from its cached pagination fields and its serialized posts.
+    """
+    return {
+        'count': page['count'],
+        'next': page['next'],
+        'previous': page['previous'],
+        'results': get_message_response('success', message, 200, data),
+    }
+
+def get_cached_page(paginator, data):
+    """
+        Get what is cached of a page of posts: its pagination fields and the ids of its posts.
+    """
+    return {
+        'count': paginator.count,
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'ids': [post['id'] for post in data],
+    }
+
+def get_serialized_posts(ids, counts, tokens=None):
+    """
+        Get the serialized posts with the given ids, in the same order, from the response cache.
+
+        Only the posts missing from the cache are loaded from the database; ids of posts that no
+        longer exist are skipped.
+    """
+    posts, keys = response_cache.get_posts(ids, counts, tokens)
+    missing = [pk for pk in ids if pk not in posts]
+    if missing:
+        queryset = PostSerializer.setup_eager_loading(Post.objects.filter(pk__in=missing), counts)
+        loaded = {post['id']: post for post in PostSerializer(queryset, many=True, context={'counts': counts}).data}
+        response_cache.set_posts(loaded, keys, tokens=tokens)
+        posts.update(loaded)
+    return [posts[pk] for pk in ids if pk in posts]
+
+def get_page_validators(key, listing, ids, format='json', listing_token=None):
+    """
+        Get the version tokens of a page of posts and its ETag and Last-Modified time.
+
+        `listing_token` is the token of the listing when it was read before the page was loaded.
+    """
+    names = [f'post:{pk}' for pk in ids]
+    tokens = response_cache.get_tokens(names if listing_token else [listing, *names])
+    if listing_token:
+        tokens[listing] = listing_token
+    return (tokens, *response_cache.get_validators(f'{key}:{format}', tokens))
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def get_posts_page_response(request, listing, get_posts, message):
+    """
+        Paginate and serialize a listing of posts, going through the response cache.
+
+        On a cache hit the page is rebuilt from the cached post ids and the cached serialized posts,
+        only the posts missing from the cache are loaded from the database.
+
+        Args:
+            request (Request): The request of the listing.
+            listing (str): The cache name of the listing, like 'feed:<user id>' or 'posts:<user id>'.
+            get_posts (callable): Returns the posts of the listing (queryset or `TimelineFeed`), only called on a miss.
+            message (str): The message of the response.
+
+        Returns:
+            Response: The paginated response, with a `X-Cache` header telling if it was a hit or a miss,
+                or a 304 when the `If-None-Match` or `If-Modified-Since` of the request still match the page.
+    """
+    counts = wants_counts(request)
+    key = response_cache.page_key(listing, request)
+    page = response_cache.get_page(key)
+    format = request.accepted_renderer.format
+    if page is None:
+        # the token of the listing is read before its page, those of the posts before they are serialized:
+        # a write in between leaves them cached under the token it replaced, never under the new one
+        listing_token = response_cache.get_tokens([listing])[listing]
+        paginator = FeedPagination()
+        ids = [post.pk for post in paginator.paginate_queryset(get_posts(), request)]
+        tokens, etag, last_modified = get_page_validators(key, listing, ids, format, listing_token)
+        data = get_serialized_posts(ids, counts, tokens)
+        page = get_cached_page(paginator, data)
+        settled = response_cache.is_settled(listing_token)
+        if settled:
+            response_cache.set_page(key, page)
+        response = get_conditional_response(request, etag, last_modified) or Response(get_page_data(page, data, message))
+        response['X-Cache'] = 'MISS'
+        # a page read from a replica that may lag behind the last write is neither cached nor validated
+        return set_validators(response, etag, last_modified) if settled else response
+
+    # the client may already have the page: answered before any post is read or serialized
+    tokens, etag, last_modified = get_page_validators(key, listing, page['ids'], format)
+    response = get_conditional_response(request, etag, last_modified)
+    if response is None:
+        response = Response(get_page_data(page, get_serialized_posts(page['ids'], counts, tokens), message))
+    response['X-Cache'] = 'HIT'
+    return set_validators(response, etag, last_modified)
+
+def get_users_response(request, build):
+    """
+        Answer 304 when the client already has the current listing of users, otherwise build it.
+
+        Args:
+            request (Request): The request, with the optional `If-None-Match` and `If-Modified-Since` headers.
+            build (callable): Called without arguments, returns the response of the listing.
+    """
+    key = f'{request.get_full_path()}:{request.accepted_renderer.format}'
+    tokens = response_cache.get_tokens(['users'])
+    etag, last_modified = response_cache.get_validators(key, tokens)
+    response = get_conditional_response(request, etag, last_modified) or build()
+    if not response_cache.is_settled(tokens['users']):
+        return response
+    return set_validators(response, etag, last_modified)
+
 class UserTwitterViewSet(viewsets.ModelViewSet):
     """
         ViewSet for managing `UserTwitter` instances.
@@ -52,7 +177,25 @@ class UserTwitterViewSet(viewsets.ModelViewSet):
     queryset = UserTwitter.objects.all()
     serializer_class = UserTwitterSerializer
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [UserTwitterJWTAuthentication]
+    # the users embed their id lists, so they are listed a page at a time; see UserDirectoryView
+    pagination_class = UserDirectoryPagination
+
+    @property
+    def throttle_scope(self):
+        return 'registration' if self.action == 'create' else None
+
+    def get_queryset(self):
+        """
+            Get the users with the relations used by the serializer already loaded
+        """
+        return UserTwitterSerializer.setup_eager_loading(super().get_queryset(), counts=wants_counts(self.request))
+
+    def list(self, request, *args, **kwargs):
+        """
+            List a page of users, or answer 304 when the client already has the current listing
+        """
+        return get_users_response(request, lambda: super(UserTwitterViewSet, self).list(request, *args, **kwargs))
 
     def get_permissions(self):
         if self.action == 'create':
@@ -79,6 +222,7 @@ class UserTwitterViewSet(viewsets.ModelViewSet):
             user = serializer.validated_data.pop('user')
             user = User.objects.create_user(**user)
             serializer.save(user=user)
+            response_cache.invalidate_users()
 
 class FollowToggleView(APIView):
     """
@@ -88,7 +232,8 @@ class FollowToggleView(APIView):
         JWT authentication is required to access this endpoint.
     """
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [UserTwitterJWTAuthentication]
+    throttle_scope = 'follow'
     
     def post(self, request, pk=None):
         """
@@ -105,35 +250,78 @@ class FollowToggleView(APIView):
                 Response: A success or error response with a message and updated user data if applicable.
         """
         try:
-            # check if the user already exists
-            user = UserTwitter.objects.get(user=request.user)
+            user = request.user_twitter
 
             # check if the user to follow exists and is not the same as the current user
             if pk == user.pk:
                 return Response(get_message_response('error', 'You cannot follow yourself', 400), status=status.HTTP_400_BAD_REQUEST)
             else:
-                user_to_follow = UserTwitter.objects.get(pk=pk)
-
-            # check if the user_to_follow is already following the user
-            if user_to_follow in user.following.all():
-                # unfollow the user
-                user.following.remove(user_to_follow)
-                user_to_follow.followers.remove(user)
-                user_to_follow.save()
-                user.save()
-                data_user = UserTwitterSerializer(user).data
-                return Response(get_message_response('success', 'User unfollowed successfully', 200, data_user), status=status.HTTP_200_OK)
-            else:
-                # follow the user
-                user.following.add(user_to_follow)
-                user_to_follow.followers.add(user)
-                user_to_follow.save()
-                user.save()
-                data_user = UserTwitterSerializer(user).data
+                user_to_follow = UserTwitter.objects.only('id', 'followers_count').get(pk=pk)
+
+            # follow the user, or unfollow them if the edge already exists
+            followed = follows.toggle_follow(user, user_to_follow.pk)
+            user = UserTwitter.objects.select_related('user').get(pk=user.pk)
+            data_user = UserTwitterSerializer(user, context={'counts': wants_counts(request)}).data
+            # the timeline is updated by a background job, which invalidates the feed again once it is done
+            timeline.schedule_timeline_update(user, user_to_follow)
+            suggestions.schedule_suggestions_update(user, user_to_follow)
+            response_cache.invalidate_feed(user.pk)
+            response_cache.invalidate_users()
+            if followed:
                 return Response(get_message_response('success', 'User followed successfully', 200, data_user), status=status.HTTP_200_OK)
+            return Response(get_message_response('success', 'User unfollowed successfully', 200, data_user), status=status.HTTP_200_OK)
         except UserTwitter.DoesNotExist:
             return Response(get_message_response('error', 'User does not exist', 400), status=status.HTTP_400_BAD_REQUEST)
 
+class UserDirectoryView(APIView):
+    """
+        API view to browse and search the users.
+
+        JWT authentication is required for access.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [UserTwitterJWTAuthentication]
+
+    def get(self, request):
+        """
+            Retrieve a page of users in alphabetical order, with their number of followers and followed users.
+
+            The optional `q` query parameter keeps the users whose username starts with it, ignoring the case.
+
+            Returns:
+                Response: A paginated list of user summaries, or a 304 when the client already has the current page.
+        """
+        def build():
+            users = UserSummarySerializer.setup_eager_loading(UserTwitter.objects.all())
+            prefix = request.query_params.get('q', '').strip()
+            if prefix:
+                users = users.filter(user__username__istartswith=prefix)
+            paginator = UserDirectoryPagination()
+            page = paginator.paginate_queryset(users, request, view=self)
+            data = UserSummarySerializer(page, many=True).data
+            return paginator.get_paginated_response(get_message_response('success', 'Users retrieved successfully', 200, data))
+
+        return get_users_response(request, build)
+
+class FollowSuggestionsView(APIView):
+    """
+        API view to retrieve the users suggested to the authenticated user.
+
+        JWT authentication is required for access.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [UserTwitterJWTAuthentication]
+
+    def get(self, request):
+        """
+            Retrieve the precomputed suggestions, the users followed by the most users that the authenticated user follows.
+
+            Returns:
+                Response: A list of users with their number of mutual follows, most mutual follows first.
+        """
+        data = suggestions.get_suggestions(request.user_twitter)
+        return Response(get_message_response('success', 'Suggestions retrieved successfully', 200, data), status=status.HTTP_200_OK)
+
 class PostViewSet(viewsets.ModelViewSet):
     """
         ViewSet for managing user posts.
@@ -144,26 +332,23 @@ class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [UserTwitterJWTAuthentication]
+
+    @property
+    def throttle_scope(self):
+        return {'create': 'post', 'like': 'like'}.get(self.action)
 
     def get_queryset(self):
         """
-            Get the posts of the user
+            Get the active posts of the user
         """
-        user = UserTwitter.objects.get(user=self.request.user)
-        return Post.objects.filter(user_twitter=user).order_by('-created_at')
+        return Post.objects.active().filter(user_twitter=self.request.user_twitter).order_by('-created_at', '-id')
 
     def list(self, request, *args, **kwargs):
         """
             list all posts of the user
         """
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        # Pagination
-        paginator = FeedPagination()
-        paginated_posts = paginator.paginate_queryset(queryset, request)
-        serializer = PostSerializer(paginated_posts, many=True)
-        return paginator.get_paginated_response(get_message_response('success', 'Posts retrieved successfully', 200, serializer.data))
+        return get_posts_page_response(request, f'posts:{request.user_twitter.pk}', self.get_queryset, 'Posts retrieved successfully')
     
     def update(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -186,11 +371,18 @@ class PostViewSet(viewsets.ModelViewSet):
         """
             Save the post
         """
-        serializer.save(user_twitter=UserTwitter.objects.get(user=self.request.user))
+        # the job is enqueued in the transaction of the post: both are committed, or neither
+        with transaction.atomic():
+            post = serializer.save(user_twitter=self.request.user_twitter)
+            if 'image' in serializer.validated_data:
+                images.schedule_variants(post)
+            tags = hashtags.set_post_hashtags(post)
+        response_cache.invalidate_post(post.pk)
+        response_cache.invalidate_hashtags(tags)
     
     def destroy(self, request, *args, **kwargs):
         """
-            Delete a post
+            Delete a post: it becomes inactive and is taken out of the listings, the timelines and the trending hastags
         """
         queryset = self.get_queryset()
         # check post exists in the queryset
@@ -199,7 +391,14 @@ class PostViewSet(viewsets.ModelViewSet):
         except Post.DoesNotExist:
             return Response(get_message_response('error', 'Post does not exist', 400), status=status.HTTP_400_BAD_REQUEST)
         
-        post.delete()
+        with transaction.atomic():
+            tags = hashtags.remove_post_hashtags(post)
+            post.status = StatusEnum.INACTIVE.value
+            post.save(update_fields=['status'])
+            timeline.remove_post_from_timelines(post)
+        response_cache.invalidate_post(post.pk)
+        response_cache.invalidate_post_lists(post)
+        response_cache.invalidate_hashtags(tags)
         return Response(get_message_response('success', 'Post deleted successfully', 200), status=status.HTTP_200_OK)
 
     def create(self, request, *args, **kwargs):
@@ -213,9 +412,19 @@ class PostViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """
-            Save the post
+            Save the post and tag it with the hastags of its text.
+            The fan-out to the followers' timelines and the variants of its image are done by background jobs,
+            the followers' feed streams are notified once the post is committed.
         """
-        serializer.save(user_twitter=UserTwitter.objects.get(user=self.request.user))
+        # the jobs are enqueued in the transaction of the post: a post is never committed without them
+        with transaction.atomic():
+            post = serializer.save(user_twitter=self.request.user_twitter)
+            tags = hashtags.set_post_hashtags(post)
+            timeline.schedule_fan_out(post)
+            images.schedule_variants(post)
+            streams.publish_post(post)
+        response_cache.invalidate_author_posts([post.user_twitter_id])
+        response_cache.invalidate_hashtags(tags)
 
     @action(detail=True, methods=['post'])
     def like(self, request, pk=None):
@@ -223,7 +432,8 @@ class PostViewSet(viewsets.ModelViewSet):
             Toggle like or unlike for a specific post.
 
             If the user has already liked the post, it will be unliked.
-            If not, it will be liked.
+            If not, it will be liked. The toggle runs in a single transaction and the
+            counter is updated in the database, so concurrent likes are never lost.
 
             Args:
                 pk (int): The primary key of the post to like or unlike.
@@ -232,25 +442,79 @@ class PostViewSet(viewsets.ModelViewSet):
                 Response: A message indicating whether the post was liked or unliked.
         """
         try:
-            post = self.get_object()
-            user = UserTwitter.objects.get(user=request.user)
-            if user in post.likes_users.all():
-                # unlike the post
-                post.likes_users.remove(user)
-                post.likes -= 1
-                post.save()
-                data_post = PostSerializer(post).data
-                return Response(get_message_response('success', 'Post unliked successfully', 200, data_post), status=status.HTTP_200_OK)
-            else:
-                # like the post
-                post.likes_users.add(user)
-                post.likes += 1
-                post.save()
-                data_post = PostSerializer(post).data
+            post = Post.objects.active().get(pk=pk)
+            liked = likes.toggle_like(post, request.user_twitter)
+            response_cache.invalidate_post(post.pk)
+            post.refresh_from_db(fields=['likes'])
+            if likes.is_hot(post):
+                post.likes += likes.pending_likes(post)
+            data_post = PostSerializer(post, context={'counts': wants_counts(request)}).data
+            if liked:
                 return Response(get_message_response('success', 'Post liked successfully', 200, data_post), status=status.HTTP_200_OK)
+            return Response(get_message_response('success', 'Post unliked successfully', 200, data_post), status=status.HTTP_200_OK)
         except Post.DoesNotExist:
             return Response(get_message_response('error', 'Post does not exist', 400), status=status.HTTP_400_BAD_REQUEST)
     
+class BulkPostView(APIView):
+    """
+        API view to create many posts of the authenticated user in one request.
+
+        The body is read as a stream of NDJSON lines and written in batches, see `mini_twitter/ingest.py`.
+        JWT authentication is required for access.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [UserTwitterJWTAuthentication]
+    throttle_scope = 'bulk'
+
+    def post(self, request):
+        """
+            Create the posts sent as NDJSON, one `{"title": ..., "body": ..., "created_at": ...}` object per line.
+
+            Invalid lines are skipped and reported with their line number, at most `BULK_MAX_RECORDS`
+            lines are read. The answer is a 400 when no post was created, an empty body included.
+
+            Returns:
+                Response: The number of posts created and the errors of the rejected lines.
+        """
+        importer = ingest.Importer(author=request.user_twitter, max_records=settings.BULK_MAX_RECORDS)
+        importer.run(request.stream or [])
+        data = {
+            'created': importer.written['posts'],
+            'errors_count': importer.error_count,
+            'errors': importer.errors,
+        }
+        if importer.written['posts']:
+            return Response(get_message_response('success', 'Posts created successfully', 201, data), status=status.HTTP_201_CREATED)
+        return Response({**get_message_response('error', 'No post was created', 400), 'data': data}, status=status.HTTP_400_BAD_REQUEST)
+
+class PostSearchView(APIView):
+    """
+        API view to search the posts by the words of their title and body.
+
+        JWT authentication is required for access.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [UserTwitterJWTAuthentication]
+
+    def get(self, request):
+        """
+            Search the posts containing all the words of `?q=`, best match first.
+
+            The search runs on the full-text index of the database (see `mini_twitter/search.py`)
+            and the results are paginated with `?offset=`.
+
+            Returns:
+                Response: A paginated list of the matching posts.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(get_message_response('error', 'The search query (q) is required', 400), status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = SearchPagination()
+        ids = paginator.paginate_ids(lambda limit, offset: search.search_post_ids(query, limit, offset), request)
+        data = get_serialized_posts(ids, wants_counts(request))
+        return paginator.get_paginated_response(get_message_response('success', 'Posts retrieved successfully', 200, data))
+
 class FeedView(APIView):
     """
        API view to retrieve the feed of posts from followed users.
@@ -259,22 +523,95 @@ class FeedView(APIView):
         JWT authentication is required for access.
     """
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [UserTwitterJWTAuthentication]
 
     def get(self, request):
         """
             Retrieve the feed of posts from users followed by the authenticated user.
 
-            The posts are ordered by creation date (newest first) and are paginated.
+            The posts are read from the user's materialized timeline, ordered by creation date
+            (newest first) and paginated.
 
             Returns:
                 Response: A paginated list of posts from users the authenticated user is following.
         """
-        user_current = UserTwitter.objects.get(user=request.user)
-        posts = Post.objects.filter(user_twitter__in=user_current.following.all()).order_by('-created_at')
+        user_current = request.user_twitter
+        return get_posts_page_response(
+            request, f'feed:{user_current.pk}', lambda: timeline.TimelineFeed(user_current), 'Feed retrieved successfully'
+        )
 
-        # Pagination
-        paginator = FeedPagination()
-        paginated_posts = paginator.paginate_queryset(posts, request)
-        serializer = PostSerializer(paginated_posts, many=True)
-        return paginator.get_paginated_response(get_message_response('success', 'Feed retrieved successfully', 200, serializer.data))
\ No newline at end of file
+class HashtagPostsView(APIView):
+    """
+        API view to retrieve the posts tagged with a hastag.
+
+        JWT authentication is required for access.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [UserTwitterJWTAuthentication]
+
+    def get(self, request, name):
+        """
+            Retrieve the posts tagged with a hastag, newest first and paginated.
+
+            Args:
+                name (str): The hastag, with or without the '#' and in any case.
+
+            Returns:
+                Response: A paginated list of the posts tagged with the hastag.
+        """
+        name = hashtags.normalize(name)
+        return get_posts_page_response(
+            request, f'hashtag:{name}', lambda: Post.objects.active().filter(hastags__name=name), 'Posts retrieved successfully'
+        )
+
+class TrendingHashtagsView(APIView):
+    """
+        API view to retrieve the hastags with the most posts in the last hours.
+
+        JWT authentication is required for access.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [UserTwitterJWTAuthentication]
+
+    def get(self, request):
+        """
+            Retrieve the trending hastags, computed from hourly counts over `HASHTAG_TRENDING_WINDOW` hours.
+
+            Returns:
+                Response: A list of hastags with the number of posts that used them, most used first.
+        """
+        return Response(get_message_response('success', 'Trending hastags retrieved successfully', 200, hashtags.trending_hashtags()), status=status.HTTP_200_OK)
+
+class MetricsView(APIView):
+    """
+        API view exposing the request metrics of this process in the Prometheus text format.
+
+        The scraper must send `METRICS_TOKEN` as a Bearer token, the endpoint is closed while it is unset.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+    renderer_classes = [metrics.PrometheusRenderer]
+
+    def get(self, request):
+        """
+            Render the request histograms, the response cache counters and the size of the job queue.
+
+            Returns:
+                Response: The metrics as Prometheus exposition text.
+        """
+        token = settings.METRICS_TOKEN
+        if not token:
+            return Response(get_message_response('error', 'Metrics are disabled, set METRICS_TOKEN', 403), status=status.HTTP_403_FORBIDDEN)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response(get_message_response('error', 'Invalid metrics token', 403), status=status.HTTP_403_FORBIDDEN)
+
+        samples = [
+            ('response_cache_requests_total', (('kind', kind), ('result', result)), count)
+            for (kind, result), count in sorted(response_cache.stats().items())
+        ]
+        jobs = dict(Job.objects.values_list('status').annotate(total=Count('pk')).values_list('status', 'total'))
+        samples += [
+            ('background_jobs', (('status', job_status.name.lower()),), jobs.get(job_status.value, 0))
+            for job_status in JobStatusEnum
+        ]
+        return Response(metrics.render(samples), content_type='text/plain; version=0.0.4; charset=utf-8')
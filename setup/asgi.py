@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'setup.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up; serves the server-sent events of /api/feed/stream/ on the event loop
+from mini_twitter.streams import FeedStream  # noqa: E402
+
+application = FeedStream(django_application)
@@ -14,6 +14,7 @@ from pathlib import Path
 from decouple import config, Csv
 from dj_database_url import parse as db_url
 import os
+import sys
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -26,7 +27,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = config("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = config("DEBUG")
+DEBUG = config("DEBUG", cast=bool)
 
 ALLOWED_HOSTS = config("ALLOWED_HOSTS", cast=Csv())
 
@@ -45,6 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so the time spent in the other middleware is measured
+    'mini_twitter.metrics.MetricsMiddleware',
+    # before any middleware that reads the database
+    'mini_twitter.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +90,73 @@ DATABASES = {
     )
 }
 
+# DATABASE REPLICA CONFIG
+# read replica of the default database: the reads of GET requests go to it, see mini_twitter/replicas.py
+DATABASE_REPLICA_URL = config('DATABASE_REPLICA_URL', default='')
+REPLICA_DATABASE_ALIAS = 'replica' if DATABASE_REPLICA_URL else ''
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = db_url(DATABASE_REPLICA_URL)
+    # the tests read the test database of default through the replica alias
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['mini_twitter.replicas.ReplicaRouter']
+# seconds the reads of a client go to the primary after it wrote, so it sees its own writes despite the replication lag
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)
+
+# DATABASE CONNECTIONS CONFIG
+# seconds a connection is kept open between requests, 0 opens one per request (ignored with the pool)
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+# check that a persistent or pooled connection still works before reusing it
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+# psycopg 3 connection pool, PostgreSQL only; recommended under ASGI, where persistent connections are not reused
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+# connections of each server process: kept open / at most
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', default=2, cast=int)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=10, cast=int)
+# seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=10, cast=float)
+# seconds before idle connections above the minimum, and any connection, are closed
+DB_POOL_MAX_IDLE = config('DB_POOL_MAX_IDLE', default=300, cast=float)
+DB_POOL_MAX_LIFETIME = config('DB_POOL_MAX_LIFETIME', default=3600, cast=float)
+
+for database in DATABASES.values():
+    database['CONN_HEALTH_CHECKS'] = DB_CONN_HEALTH_CHECKS
+    if DB_POOL and database['ENGINE'] == 'django.db.backends.postgresql':
+        # the pooled connections are handed back at the end of each request, Django requires CONN_MAX_AGE=0
+        database['CONN_MAX_AGE'] = 0
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+            'max_idle': DB_POOL_MAX_IDLE,
+            'max_lifetime': DB_POOL_MAX_LIFETIME,
+        }
+    else:
+        database['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# redis://host:6379/0 shares the cache between processes, otherwise an in-process LRU cache is used
+CACHE_URL = config('CACHE_URL', default='')
+
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'mini-twitter',
+            'OPTIONS': {
+                'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int),
+            },
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -127,6 +199,23 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# STATIC FILES CONFIG
+# the static files are collected with a compressed copy of each file and served by nginx (see nginx/default.conf),
+# no sync-only middleware stands in front of the async views; with the manifest (set in the Docker image, where
+# collectstatic runs at build) their names are hashed and they are cached forever. runserver serves them in development
+STATICFILES_MANIFEST = config('STATICFILES_MANIFEST', default=False, cast=bool)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedManifestStaticFilesStorage' if STATICFILES_MANIFEST
+            else 'whitenoise.storage.CompressedStaticFilesStorage'
+        ),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -157,10 +246,87 @@ SPECTACULAR_SETTINGS = {
 }
 
 # DRF CONFIGURATIONS
+# JSON RENDERER CONFIG
+# render the API responses with orjson (see mini_twitter/renderers.py) instead of the json module
+FAST_JSON_RENDERER = config('FAST_JSON_RENDERER', default=True, cast=bool)
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [
+        'mini_twitter.renderers.ORJSONRenderer' if FAST_JSON_RENDERER else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # token buckets of the views with a `throttle_scope`, see mini_twitter/throttling.py
+    'DEFAULT_THROTTLE_CLASSES': [
+        'mini_twitter.throttling.UserTokenBucketThrottle',
+        'mini_twitter.throttling.IPTokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'like': config('THROTTLE_RATE_LIKE', default='60/min'),
+        'follow': config('THROTTLE_RATE_FOLLOW', default='30/min'),
+        'post': config('THROTTLE_RATE_POST', default='30/min'),
+        # one request of the bulk endpoint creates up to BULK_MAX_RECORDS posts
+        'bulk': config('THROTTLE_RATE_BULK', default='5/min'),
+        # by IP address, the registration is anonymous
+        'registration': config('THROTTLE_RATE_REGISTRATION', default='10/hour'),
+        # by IP address, for all the users behind it
+        'like_ip': config('THROTTLE_RATE_LIKE_IP', default='600/min'),
+        'follow_ip': config('THROTTLE_RATE_FOLLOW_IP', default='300/min'),
+        'post_ip': config('THROTTLE_RATE_POST_IP', default='300/min'),
+        'bulk_ip': config('THROTTLE_RATE_BULK_IP', default='50/min'),
+    },
+    # proxies in front of the app that append the client address to X-Forwarded-For: the throttles key the
+    # anonymous requests and the IP buckets on the address seen by the last of them, or on the address of
+    # the connection with 0. Unset, DRF would use the whole header, which any client can fill as it likes
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
+# THROTTLE CONFIG
+THROTTLE_ENABLED = config('THROTTLE_ENABLED', default=True, cast=bool)
+# 'memory' counts the requests in each process, 'redis' shares the buckets of all the processes in the Redis cache
+THROTTLE_BACKEND = config('THROTTLE_BACKEND', default='redis' if CACHE_URL else 'memory')
+# addresses of the proxies whose X-Forwarded-For is trusted, as in gunicorn.conf.py ('*' for any): the throttles
+# ignore the header on the requests of any other peer, which could write in it the address it likes
+FORWARDED_ALLOW_IPS = config('FORWARDED_ALLOW_IPS', default='127.0.0.1', cast=Csv())
+
+# TIMELINE CONFIG
+# maximum number of entries kept in each materialized home timeline
+TIMELINE_MAX_LENGTH = config('TIMELINE_MAX_LENGTH', default=800, cast=int)
+# authors with at least this many followers are merged into the feed at read time
+TIMELINE_CELEBRITY_THRESHOLD = config('TIMELINE_CELEBRITY_THRESHOLD', default=10000, cast=int)
+
+# FEED STREAM CONFIG
+# 'memory' sends the new posts to the streams of the same process, 'redis' to the streams of every process
+STREAM_BACKEND = config('STREAM_BACKEND', default='redis' if CACHE_URL else 'memory')
+# seconds between two heartbeats of an idle stream
+STREAM_HEARTBEAT_SECONDS = config('STREAM_HEARTBEAT_SECONDS', default=15, cast=float)
+# seconds before a stream is closed, the client reconnects with its Last-Event-ID
+STREAM_MAX_SECONDS = config('STREAM_MAX_SECONDS', default=300, cast=float)
+# milliseconds the client waits before reconnecting
+STREAM_RETRY_MS = config('STREAM_RETRY_MS', default=3000, cast=int)
+# events kept for a client that reads slower than they are published, then it catches up from the database
+STREAM_QUEUE_SIZE = config('STREAM_QUEUE_SIZE', default=100, cast=int)
+# posts sent to a reconnecting client, past it the client is told to reload its feed
+STREAM_REPLAY_LIMIT = config('STREAM_REPLAY_LIMIT', default=100, cast=int)
+
+# FOLLOW SUGGESTIONS CONFIG
+# number of suggestions stored and served for each user
+SUGGESTIONS_PER_USER = config('SUGGESTIONS_PER_USER', default=20, cast=int)
+
+# RESPONSE CACHE CONFIG
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_ALIAS = 'default'
+# seconds a cached page or post is kept, invalidation does not depend on it
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=300, cast=int)
+
+# LIKE COUNTER CONFIG
+# number of counter shards used by hot posts, 0 disables the sharded counter
+LIKE_COUNTER_SHARDS = config('LIKE_COUNTER_SHARDS', default=0, cast=int)
+# posts with at least this many likes are counted on the shards
+LIKE_HOT_THRESHOLD = config('LIKE_HOT_THRESHOLD', default=1000, cast=int)
+# seconds between a like counted on the shards and the job that folds them into the post
+LIKE_FLUSH_DELAY = config('LIKE_FLUSH_DELAY', default=5, cast=int)
+
 # JWT CONFIG
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=int(config('ACCESS_TOKEN_LIFETIME'))),
@@ -169,4 +335,52 @@ SIMPLE_JWT = {
     "BLACKLIST_AFTER_ROTATION": config('BLACKLIST_AFTER_ROTATION'),
     "ALGORITHM": config('ALGORITHM'),
     "AUTH_HEADER_TYPES": ("Bearer",),
+    "TOKEN_OBTAIN_SERIALIZER": "mini_twitter.authentication.UserTwitterTokenObtainPairSerializer",
 }
+
+# seconds the API authentication keeps the active state of a user in memory
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', default=30, cast=int)
+
+# ASYNC VIEWS CONFIG
+# serve the feed, the post listing and the like toggle with the async views (see mini_twitter/async_views.py),
+# meant for ASGI servers; under WSGI each async view runs in its own event loop
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+# HASHTAG CONFIG
+# hours of hourly counts summed by the trending hastags
+HASHTAG_TRENDING_WINDOW = config('HASHTAG_TRENDING_WINDOW', default=24, cast=int)
+HASHTAG_TRENDING_LIMIT = config('HASHTAG_TRENDING_LIMIT', default=10, cast=int)
+# seconds the trending hastags are cached, 0 disables the cache
+HASHTAG_TRENDING_CACHE_TTL = config('HASHTAG_TRENDING_CACHE_TTL', default=60, cast=int)
+
+# BULK IMPORT CONFIG
+# maximum number of NDJSON lines read by POST /api/posts/bulk/
+BULK_MAX_RECORDS = config('BULK_MAX_RECORDS', default=10000, cast=int)
+
+# IMAGE CONFIG
+# uploads are streamed to a temporary file instead of being read into memory
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+IMAGE_MAX_UPLOAD_SIZE = config('IMAGE_MAX_UPLOAD_SIZE', default=10 * 1024 * 1024, cast=int)
+# widths (in pixels) and formats of the resized copies of the post images
+IMAGE_VARIANT_WIDTHS = config('IMAGE_VARIANT_WIDTHS', default='320,640,1280', cast=lambda v: [int(w) for w in Csv()(v)])
+IMAGE_VARIANT_FORMATS = config('IMAGE_VARIANT_FORMATS', default='webp,jpeg', cast=Csv())
+
+# JOBS CONFIG
+# run the background jobs inline when they are enqueued, without a worker: the default under the test runner
+# only, elsewhere the API enqueues them for `run_worker`
+JOBS_EAGER = config('JOBS_EAGER', default=sys.argv[1:2] == ['test'], cast=bool)
+# jobs claimed at once by a worker, the jobs of the same kind that support it run as one batch
+JOBS_BATCH_SIZE = config('JOBS_BATCH_SIZE', default=100, cast=int)
+JOBS_MAX_ATTEMPTS = config('JOBS_MAX_ATTEMPTS', default=5, cast=int)
+# seconds before the first retry of a failed job, doubled on each attempt
+JOBS_RETRY_BACKOFF = config('JOBS_RETRY_BACKOFF', default=10, cast=int)
+# seconds after which a running job is considered abandoned by its worker and claimed again
+JOBS_LOCK_TIMEOUT = config('JOBS_LOCK_TIMEOUT', default=600, cast=int)
+# hours the finished jobs are kept before the worker deletes them
+JOBS_RETENTION_HOURS = config('JOBS_RETENTION_HOURS', default=72, cast=int)
+
+# METRICS CONFIG
+# requests slower than this (in ms) are logged with their SQL on 'mini_twitter.slow_requests', 0 disables the log
+METRICS_SLOW_REQUEST_MS = config('METRICS_SLOW_REQUEST_MS', default=0, cast=int)
+# GET /api/metrics/ requires it as a Bearer token, and answers 403 while it is empty
+METRICS_TOKEN = config('METRICS_TOKEN', default='')